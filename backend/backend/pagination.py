@@ -0,0 +1,181 @@
+"""
+Pagination for API listings.
+
+``StandardPagination`` keeps page-number pagination as the default and adds two
+per-request options:
+
+- ``?count=false`` skips the ``COUNT(*)`` over the filtered queryset. ``count``
+  is then null and whether there is a next page is worked out by fetching one
+  extra row.
+- ``?cursor=`` (empty for the first page) switches to keyset pagination. Rows are
+  ordered by the view's ``cursor_ordering`` and each page continues from the
+  last row of the previous one with a ``WHERE (name, id) > (...)`` style filter
+  instead of an OFFSET, so deep pages cost the same as the first one. No count
+  is returned unless ``?count=true`` is also given.
+"""
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class StandardPagination(PageNumberPagination):
+    """Page-number pagination with optional counts and an opt-in cursor mode."""
+
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    count_query_param = 'count'
+    cursor_query_param = 'cursor'
+    # Used for views without ``cursor_ordering``. Fields must be non-null and
+    # the last one unique, so the ordering is total.
+    default_cursor_ordering = ('pk',)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.cursor_mode = self.cursor_query_param in request.query_params
+        wants_count = self._wants_count(request)
+
+        if self.cursor_mode:
+            self.count = queryset.count() if wants_count else None
+            ordering = getattr(view, 'cursor_ordering', self.default_cursor_ordering)
+            return self._paginate_by_cursor(queryset, request, ordering)
+        if wants_count:
+            page = super().paginate_queryset(queryset, request, view)
+            self.count = self.page.paginator.count
+            return page
+        self.count = None
+        return self._paginate_without_count(queryset, request)
+
+    def _wants_count(self, request):
+        value = request.query_params.get(self.count_query_param)
+        if value is None:
+            return not self.cursor_mode
+        return value.lower() not in ('0', 'false', 'no')
+
+    def _paginate_without_count(self, queryset, request):
+        page_size = self.get_page_size(request)
+        try:
+            self.page_number = int(request.query_params.get(self.page_query_param, 1))
+            if self.page_number < 1:
+                raise ValueError
+        except ValueError:
+            raise NotFound('Invalid page.')
+
+        offset = (self.page_number - 1) * page_size
+        rows = list(queryset[offset:offset + page_size + 1])
+        self.has_next = len(rows) > page_size
+        self.has_previous = self.page_number > 1
+        return rows[:page_size]
+
+    def _paginate_by_cursor(self, queryset, request, ordering):
+        page_size = self.get_page_size(request)
+        reverse, values = self._decode_cursor(request, ordering, queryset.model)
+
+        queryset = queryset.order_by(*[f'-{field}' if reverse else field for field in ordering])
+        if values is not None:
+            queryset = queryset.filter(self._after(ordering, values, reverse))
+
+        rows = list(queryset[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, values is not None
+        if not rows:
+            self.has_next = self.has_previous = False
+
+        self.next_position = self._position(rows[-1], ordering) if rows and self.has_next else None
+        self.previous_position = self._position(rows[0], ordering) if rows and self.has_previous else None
+        return rows
+
+    @staticmethod
+    def _after(ordering, values, reverse):
+        """Rows strictly after ``values`` in ``ordering`` (before them when ``reverse``)."""
+        operator = 'lt' if reverse else 'gt'
+        condition = Q()
+        for position, field in enumerate(ordering):
+            step = Q(**dict(zip(ordering[:position], values[:position])))
+            condition |= step & Q(**{f'{field}__{operator}': values[position]})
+        # Bound on the leading field so the database can range-scan its index
+        bound = 'lte' if reverse else 'gte'
+        return Q(**{f'{ordering[0]}__{bound}': values[0]}) & condition
+
+    @staticmethod
+    def _position(row, ordering):
+        return json.loads(json.dumps([getattr(row, field) for field in ordering], cls=DjangoJSONEncoder))
+
+    def _encode_cursor(self, reverse, position):
+        cursor = json.dumps({'r': reverse, 'p': position}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(cursor.encode()).decode()
+
+    @staticmethod
+    def _ordering_field(model, name):
+        """Model field behind an ordering name such as ``pk`` or ``company__name``."""
+        *relations, name = name.split('__')
+        for relation in relations:
+            model = model._meta.get_field(relation).related_model
+        return model._meta.pk if name == 'pk' else model._meta.get_field(name)
+
+    def _decode_cursor(self, request, ordering, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return False, None
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            reverse, position = bool(cursor['r']), cursor['p']
+        except (binascii.Error, ValueError, TypeError, KeyError):
+            raise NotFound('Invalid cursor')
+        if not isinstance(position, list) or len(position) != len(ordering):
+            raise NotFound('Invalid cursor')
+        # Values that do not fit their field would otherwise fail in the query
+        try:
+            values = [self._ordering_field(model, name).to_python(value) for name, value in zip(ordering, position)]
+        except (ValidationError, ValueError, TypeError):
+            raise NotFound('Invalid cursor')
+        if any(value is None for value in values):
+            raise NotFound('Invalid cursor')
+        return reverse, values
+
+    def get_next_link(self):
+        if not self.cursor_mode and self.count is not None:
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        if self.cursor_mode:
+            return replace_query_param(url, self.cursor_query_param, self._encode_cursor(False, self.next_position))
+        return replace_query_param(url, self.page_query_param, self.page_number + 1)
+
+    def get_previous_link(self):
+        if not self.cursor_mode and self.count is not None:
+            return super().get_previous_link()
+        if not self.has_previous:
+            return None
+        url = self.request.build_absolute_uri()
+        if self.cursor_mode:
+            return replace_query_param(url, self.cursor_query_param, self._encode_cursor(True, self.previous_position))
+        if self.page_number == 2:
+            return remove_query_param(url, self.page_query_param)
+        return replace_query_param(url, self.page_query_param, self.page_number - 1)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.count,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema['properties']['count']['nullable'] = True
+        return response_schema
@@ -97,6 +97,22 @@ DATABASES = {
     }
 }
 
+# Caches
+# Local memory by default, which is per process. Point CACHE_BACKEND and
+# CACHE_LOCATION at a shared cache (e.g. django.core.cache.backends.redis.RedisCache)
+# when running several processes, so invalidations reach all of them.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+# Cache holding serialized companies (see companies.cache), and the seconds a
+# serialized company is kept. Changes invalidate it immediately either way, also
+# from upload workers, as the versions entries are cached under live in the database.
+COMPANY_CACHE_ALIAS = os.getenv('COMPANY_CACHE_ALIAS', 'default')
+COMPANY_CACHE_TIMEOUT = int(os.getenv('COMPANY_CACHE_TIMEOUT', 3600))
+
 # Custom user model
 AUTH_USER_MODEL = 'users.User'
 
@@ -122,12 +138,12 @@ AUTH_PASSWORD_VALIDATORS = [
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.CachedJWTAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'backend.pagination.StandardPagination',
     'PAGE_SIZE': 20,
 }
 
@@ -181,10 +197,47 @@ SIMPLE_JWT = {
     'AUTH_TOKEN_CLASSES': ('rest_framework_simplejwt.tokens.AccessToken',),
     'TOKEN_TYPE_CLAIM': 'token_type',
 }
+# Seconds the role, company and active flag of a token's user are cached for by
+# CachedJWTAuthentication. Saving the user drops its entry from the default
+# cache, so with several processes use a shared cache backend or keep this short.
+USER_STATE_CACHE_TIMEOUT = int(os.getenv('USER_STATE_CACHE_TIMEOUT', 60))
 
 #Fernet encryption settings
 # In production, this should be a secure, randomly generated key stored in environment variables
 # Generate a key with: python -c "from cryptography.fernet import Fernet; print(Fernet.generate_key().decode())"
-FERNET_KEYS = [os.getenv('FERNET_KEY', 'PbEgeq2o7ARQ58-MtD9x3NAtLh-jf3UZx4iJmqdgv1w=')]
- 
-
+# FERNET_KEYS is a comma-separated key ring, newest key first. Values are encrypted
+# with the first key and decrypted with any of them, so retired keys stay listed
+# until `manage.py rotate_encryption_keys` has re-encrypted everything.
+FERNET_KEYS = [
+    key.strip()
+    for key in os.getenv('FERNET_KEYS', os.getenv('FERNET_KEY', 'PbEgeq2o7ARQ58-MtD9x3NAtLh-jf3UZx4iJmqdgv1w=')).split(',')
+    if key.strip()
+]
+# How encrypted columns are written: 'token' stores the Fernet token as is,
+# 'base64' wraps it in a second base64 layer (the original format, a third larger).
+# Both formats are always readable.
+ENCRYPTED_FIELD_FORMAT = os.getenv('ENCRYPTED_FIELD_FORMAT', 'token')
+# Decrypted values cached per process, keyed by ciphertext (0 disables the cache)
+ENCRYPTED_FIELD_CACHE_SIZE = int(os.getenv('ENCRYPTED_FIELD_CACHE_SIZE', 10000))
+
+# Blind index settings
+# Key for the HMAC lookup columns that sit next to encrypted fields. Changing it
+# invalidates every stored blind index, so keep it separate from FERNET_KEYS.
+BLIND_INDEX_KEY = os.getenv('BLIND_INDEX_KEY', SECRET_KEY)
+
+# Bulk upload settings
+# Number of rows resolved and written per transaction by the bulk ingestion pipelines
+BULK_UPLOAD_CHUNK_SIZE = int(os.getenv('BULK_UPLOAD_CHUNK_SIZE', 1000))
+# Run bulk uploads on the background queue (`manage.py process_uploads`).
+# When disabled, uploads are processed inside the request as before.
+BULK_UPLOADS_ASYNC = os.getenv('BULK_UPLOADS_ASYNC', 'True') == 'True'
+# Seconds without a progress report before a processing job is considered abandoned
+BULK_UPLOAD_STALE_AFTER = int(os.getenv('BULK_UPLOAD_STALE_AFTER', 900))
+BULK_UPLOAD_MAX_ATTEMPTS = int(os.getenv('BULK_UPLOAD_MAX_ATTEMPTS', 3))
+# Seconds between heartbeats of a running job; keep well below BULK_UPLOAD_STALE_AFTER
+BULK_UPLOAD_HEARTBEAT_INTERVAL = int(os.getenv('BULK_UPLOAD_HEARTBEAT_INTERVAL', 60))
+# Error messages returned inline with an upload's result; the rest are served
+# by /api/employees/uploads/<id>/errors/
+BULK_UPLOAD_ERROR_SUMMARY_SIZE = int(os.getenv('BULK_UPLOAD_ERROR_SUMMARY_SIZE', 100))
+# Processes used to hash passwords when provisioning users in bulk
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', os.cpu_count() or 1))
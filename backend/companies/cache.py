@@ -0,0 +1,135 @@
+"""
+Versioned cache of serialized companies.
+
+Serializing a company decrypts its encrypted fields and reads its departments,
+but companies rarely change. Each company has a version, and its
+``CompanySerializer`` representation is cached under that version; the company
+list has a version of its own. ``invalidate_companies`` bumps the versions of
+the companies it is given and of the list, so entries of older versions are
+simply never read again and expire.
+
+Versions are ``CacheVersion`` rows rather than cache entries: uploads and
+stats updates run in ``process_uploads`` workers, and their bumps must reach
+every web process even when the cache is local to each process. Reading the
+versions of a page costs one indexed query and writes nothing; rows are only
+created when a version is bumped.
+
+``Company`` and ``Department`` saves and deletes are invalidated by signals in
+``companies.signals``, and so are the company stats behind ``employees_count``
+(``companies.stats``). Bulk writes that bypass signals call
+``invalidate_companies`` themselves.
+
+Versions also make ETags: a client whose ``If-None-Match`` carries the current
+version gets a 304 without the company being loaded or serialized.
+
+Representations are kept in the ``COMPANY_CACHE_ALIAS`` entry of ``CACHES``.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F, prefetch_related_objects
+from django.utils.http import quote_etag
+
+from .models import CacheVersion
+
+LIST_VERSION_KEY = 'companies:list'
+
+
+def get_cache():
+    return caches[settings.COMPANY_CACHE_ALIAS]
+
+
+def _version_key(company_id):
+    return f'company:{company_id}'
+
+
+def _representation_key(company_id, version):
+    return f'companies:company:{company_id}:{version}'
+
+
+def _new_version():
+    # Versions start from the clock rather than 1, so representations cached
+    # under the versions of a deleted company or an earlier database are never read back
+    return time.time_ns()
+
+
+def _versions(keys):
+    # Reading never writes: a key without a row, e.g. of a company never
+    # changed or of an id that does not exist, is at version 0
+    keys = list(keys)
+    versions = dict(CacheVersion.objects.filter(key__in=keys).values_list('key', 'version'))
+    return {key: versions.get(key, 0) for key in keys}
+
+
+def company_versions(company_ids):
+    """Current version of each company, as ``{company id: version}``."""
+    company_ids = list(company_ids)
+    versions = _versions(_version_key(company_id) for company_id in company_ids)
+    return {company_id: versions[_version_key(company_id)] for company_id in company_ids}
+
+
+def list_version():
+    """Current version of the company list."""
+    return _versions([LIST_VERSION_KEY])[LIST_VERSION_KEY]
+
+
+def _bump(company_ids):
+    keys = [LIST_VERSION_KEY, *(_version_key(company_id) for company_id in company_ids)]
+    # Rows are only created here, when a version first changes
+    CacheVersion.objects.bulk_create(
+        [CacheVersion(key=key, version=_new_version()) for key in keys], ignore_conflicts=True
+    )
+    CacheVersion.objects.filter(key__in=keys).update(version=F('version') + 1)
+
+
+def invalidate_companies(company_ids=()):
+    """
+    Stop serving cached representations of ``company_ids`` and cached company
+    lists. Pass no ids when only companies were added.
+
+    The versions are bumped in the current transaction and again once it
+    commits, so a representation cached from data read before the commit is
+    not served afterwards.
+    """
+    company_ids = set(company_ids)
+    _bump(company_ids)
+    transaction.on_commit(lambda: _bump(company_ids))
+
+
+def company_etag(company_id):
+    """ETag of the representation of a company."""
+    return quote_etag(f'{company_id}-{company_versions([company_id])[company_id]}')
+
+
+def list_etag(request):
+    """ETag of a company list response for ``request``, which depends on its query parameters."""
+    digest = hashlib.md5(request.get_full_path().encode(), usedforsecurity=False).hexdigest()
+    return quote_etag(f'{digest}-{list_version()}')
+
+
+def company_representations(companies):
+    """
+    ``CompanySerializer`` data of ``companies``, in order, serializing only the
+    ones whose current version is not cached.
+    """
+    from .serializers import CompanySerializer
+
+    companies = list(companies)
+    cache = get_cache()
+    versions = company_versions(company.pk for company in companies)
+    keys = {company.pk: _representation_key(company.pk, versions[company.pk]) for company in companies}
+    cached = cache.get_many(keys.values())
+
+    missing = [company for company in companies if keys[company.pk] not in cached]
+    if missing:
+        prefetch_related_objects(missing, 'departments')
+        serialized = {
+            keys[company.pk]: data
+            for company, data in zip(missing, CompanySerializer(missing, many=True).data)
+        }
+        cache.set_many(serialized, timeout=settings.COMPANY_CACHE_TIMEOUT)
+        cached.update(serialized)
+    return [cached[keys[company.pk]] for company in companies]
@@ -0,0 +1,210 @@
+"""
+Resolving department names to departments.
+
+Department names are matched regardless of case and spacing: "Sales",
+" sales" and "SALES " are one department, stored with the first spelling seen
+(spaces collapsed). ``DepartmentResolver`` loads each company's departments
+once and creates the missing ones of a batch of names with one
+``bulk_create``; uploads, bulk edits and ``sync_departments`` all resolve
+names through it.
+
+``sync_departments`` diffs a submitted list against the stored departments
+instead of replacing them, so departments that stay keep their rows, and the
+employees and roles pointing at them are not touched. Only departments whose
+name is left out of the list are deleted.
+"""
+from django.db import transaction
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+
+from employees.models import Employee
+from employees.search import rebuild_search_documents
+from .cache import invalidate_companies
+from .models import Department
+
+
+def clean_department_name(name):
+    """``name`` with surrounding spaces removed and inner runs of spaces collapsed."""
+    return ' '.join(str(name or '').split())
+
+
+def department_key(name):
+    """Key department names are matched by, or None for a blank name."""
+    return clean_department_name(name).casefold() or None
+
+
+class DepartmentResolver:
+    """
+    Departments of companies by name.
+
+    Each company's departments are loaded the first time it is used and kept,
+    so a resolver should live for one upload or request. Departments created
+    in a transaction that is rolled back must be dropped with ``forget``.
+    """
+
+    def __init__(self):
+        self._companies = {}  # {company id: {name key: department}}
+
+    def load(self, company_ids):
+        """Load the departments of the ``company_ids`` not loaded yet, with one query."""
+        company_ids = set(company_ids) - set(self._companies)
+        if not company_ids:
+            return
+        for company_id in company_ids:
+            self._companies[company_id] = {}
+        # Of stored names differing only in case, the first in name order wins
+        for department in Department.objects.filter(company_id__in=company_ids).order_by('name'):
+            self._companies[department.company_id].setdefault(department_key(department.name), department)
+
+    def departments(self, company_id):
+        """``{name key: department}`` of a company."""
+        self.load([company_id])
+        return self._companies[company_id]
+
+    def get(self, company_id, name):
+        """Department of a company called ``name``, or None if there is none yet."""
+        return self.departments(company_id).get(department_key(name))
+
+    def resolve(self, names):
+        """
+        Departments of ``(company id, name)`` pairs as ``{(company id, name): department}``,
+        creating the missing ones with one ``bulk_create``. Blank names are left out.
+        """
+        names = [(company_id, name) for company_id, name in names if department_key(name)]
+        self.load(company_id for company_id, _ in names)
+        missing = {}
+        for company_id, name in names:
+            key = department_key(name)
+            if key not in self._companies[company_id]:
+                missing.setdefault((company_id, key), Department(company_id=company_id, name=clean_department_name(name)))
+
+        if missing:
+            # Another upload may be creating the same departments; read back whichever row won
+            Department.objects.bulk_create(missing.values(), ignore_conflicts=True)
+            # bulk_create skips the signals that invalidate cached companies
+            invalidate_companies({company_id for company_id, _ in missing})
+            company_ids = {company_id for company_id, _ in missing}
+            for department in Department.objects.filter(company_id__in=company_ids).order_by('name'):
+                self._companies[department.company_id].setdefault(department_key(department.name), department)
+        return {(company_id, name): self.get(company_id, name) for company_id, name in names}
+
+    def forget(self, departments):
+        """Drop ``departments``, e.g. ones whose creation was rolled back."""
+        for department in departments:
+            company = self._companies.get(department.company_id, {})
+            key = department_key(department.name)
+            if company.get(key) is department:
+                del company[key]
+
+
+def _entries(departments):
+    """
+    ``(id or None, name)`` of each submitted department with a name. Names
+    without an id are unique regardless of case, and so are ids.
+    """
+    entries = {}
+    for department in departments:
+        if isinstance(department, dict):
+            department_id, name = department.get('id'), department.get('name')
+        else:
+            department_id, name = None, department
+        name = clean_department_name(name)
+        if name:
+            department_id = str(department_id) if department_id else None
+            key = ('id', department_id) if department_id else ('name', department_key(name))
+            entries.setdefault(key, (department_id, name))
+    return list(entries.values())
+
+
+def sync_departments(company, departments):
+    """
+    Make the departments of ``company`` those of ``departments`` and return
+    them in that order.
+
+    Each item is a name or a ``{'name': ...}`` dict. Departments are matched
+    one by one: a dict with the ``id`` of one of the company's departments
+    renames it in place, a name matches the department stored under exactly
+    that name, and otherwise the one department stored under it in another
+    case or spacing, which is renamed. Departments whose name is not listed in
+    any case are deleted, and missing ones are created with one
+    ``bulk_create``; departments may swap names. The number of queries does
+    not depend on the number of employees.
+
+    Raises ``ValidationError`` rather than guess when several stored
+    departments differ only in case from a listed name, since the ones not
+    matched would be deleted with their employees' departments.
+    """
+    entries = _entries(departments)
+    stored = list(Department.objects.filter(company=company).order_by('name'))
+    by_id = {str(department.pk): department for department in stored}
+    by_name = {department.name: department for department in stored}
+    by_key = {}
+    for department in stored:
+        by_key.setdefault(department_key(department.name), []).append(department)
+
+    kept = {}
+    # Explicit ids and exact names first, so case variants cannot take them
+    matched = []
+    for department_id, name in entries:
+        department = by_id.get(department_id) if department_id else None
+        if department is None or department.pk in kept:
+            department = by_name.get(name)
+        if department is not None and department.pk in kept:
+            department = None
+        if department is not None:
+            kept[department.pk] = department
+        matched.append(department)
+
+    renamed = []
+    created = []
+    for (department_id, name), department in zip(entries, matched):
+        if department is None:
+            candidates = [other for other in by_key.get(department_key(name), []) if other.pk not in kept]
+            if len(candidates) > 1:
+                raise ValidationError({'departments': [
+                    f"Several departments are called '{name}' in different cases; "
+                    f"list each of them by id."
+                ]})
+            if not candidates:
+                created.append((company.pk, name))
+                continue
+            department = candidates[0]
+            kept[department.pk] = department
+        if department.name != name:
+            department.name = name
+            renamed.append(department)
+
+    listed = {department_key(name) for _, name in entries}
+    ambiguous = [department.name for department in stored if department.pk not in kept and department_key(department.name) in listed]
+    if ambiguous:
+        raise ValidationError({'departments': [
+            f"Departments {', '.join(sorted(ambiguous))} differ only in case from listed ones; "
+            f"list each of them by id, or leave their name out to delete them."
+        ]})
+
+    with transaction.atomic():
+        # Employees and roles of removed departments lose them
+        Department.objects.filter(company=company).exclude(pk__in=kept).delete()
+        if renamed:
+            # Names may be swapped between departments, and each name must stay
+            # unique within the company after every statement: rename through
+            # temporary names that cannot clash first
+            names = [department.name for department in renamed]
+            for department in renamed:
+                department.name = str(department.pk)
+            Department.objects.bulk_update(renamed, ['name'])
+            for department, name in zip(renamed, names):
+                department.name = name
+            Department.objects.bulk_update(renamed, ['name'])
+            # bulk_update skips the signals that keep these in sync
+            invalidate_companies([company.pk])
+            employee_ids = list(
+                Employee.objects.filter(Q(current_department__in=renamed) | Q(roles__department__in=renamed))
+                .values_list('pk', flat=True).distinct()
+            )
+            transaction.on_commit(lambda: rebuild_search_documents(employee_ids))
+        # Resolved once the removed departments are gone
+        resolved = DepartmentResolver().resolve(created)
+
+    by_name = {department.name: department for department in kept.values()}
+    return [by_name.get(name) or resolved[(company.pk, name)] for _, name in entries]
@@ -1,39 +1,305 @@
-from django.db import models
-from cryptography.fernet import Fernet
+from collections import OrderedDict
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
 from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import models
+from django.db.models.query_utils import DeferredAttribute
+from django.dispatch import receiver
 from django.utils.encoding import force_bytes, force_str
+from django.utils.functional import SimpleLazyObject, empty
 import base64
+import hashlib
+import hmac
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Fernet tokens start with the version byte and a timestamp whose high bytes are
+# still zero; the original storage format base64-encodes them once more
+TOKEN_PREFIX = 'gAAAAA'
+
+
+class DecryptionCache:
+    """Thread-safe LRU mapping of stored ciphertext to plaintext, bounded to ``max_size`` entries."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, ciphertext):
+        with self._lock:
+            plaintext = self._values.get(ciphertext)
+            if plaintext is not None:
+                self._values.move_to_end(ciphertext)
+            return plaintext
+
+    def set(self, ciphertext, plaintext):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._values[ciphertext] = plaintext
+            self._values.move_to_end(ciphertext)
+            while len(self._values) > self.max_size:
+                self._values.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def __len__(self):
+        return len(self._values)
+
+
+_key_ring = None
+_primary_key = None
+_decryption_cache = None
+
+
+def get_key_ring():
+    """``MultiFernet`` over ``FERNET_KEYS``: encrypts with the first key, decrypts with any."""
+    global _key_ring
+    if _key_ring is None:
+        _key_ring = MultiFernet([Fernet(force_bytes(key)) for key in settings.FERNET_KEYS])
+    return _key_ring
+
+
+def get_primary_key():
+    """``Fernet`` for the first (current) key in ``FERNET_KEYS``."""
+    global _primary_key
+    if _primary_key is None:
+        _primary_key = Fernet(force_bytes(settings.FERNET_KEYS[0]))
+    return _primary_key
+
+
+def get_decryption_cache():
+    global _decryption_cache
+    if _decryption_cache is None:
+        _decryption_cache = DecryptionCache(settings.ENCRYPTED_FIELD_CACHE_SIZE)
+    return _decryption_cache
+
+
+@receiver(setting_changed)
+def reset_encryption_state(setting, **kwargs):
+    """Pick up changed keys or cache size (e.g. from ``override_settings``)."""
+    global _key_ring, _primary_key, _decryption_cache
+    if setting in ('FERNET_KEYS', 'ENCRYPTED_FIELD_CACHE_SIZE'):
+        _key_ring = None
+        _primary_key = None
+        _decryption_cache = None
+
+
+def _to_token(ciphertext):
+    """Fernet token of a stored value in either storage format."""
+    if ciphertext.startswith(TOKEN_PREFIX):
+        return force_bytes(ciphertext)
+    return base64.b64decode(ciphertext)
+
+
+def _to_stored(token):
+    """Stored form of a Fernet token in the configured storage format."""
+    if settings.ENCRYPTED_FIELD_FORMAT == 'base64':
+        return base64.b64encode(token).decode('ascii')
+    return token.decode('ascii')
+
+
+def encrypt_value(value):
+    """Encrypt ``value`` with the primary key, in the configured storage format."""
+    plaintext = force_str(value)
+    ciphertext = _to_stored(get_key_ring().encrypt(force_bytes(plaintext)))
+    # The value is usually read back soon after it has been written
+    get_decryption_cache().set(ciphertext, plaintext)
+    return ciphertext
+
+
+def decrypt_value(ciphertext):
+    """
+    Decrypt a stored value in either storage format.
+
+    Raises ``cryptography.fernet.InvalidToken`` if no key in the ring can
+    decrypt it.
+    """
+    cache = get_decryption_cache()
+    plaintext = cache.get(ciphertext)
+    if plaintext is None:
+        plaintext = force_str(get_key_ring().decrypt(_to_token(ciphertext)))
+        cache.set(ciphertext, plaintext)
+    return plaintext
+
+
+def decrypt_values(ciphertexts):
+    """
+    Decrypt a batch of stored values, returning the plaintexts in order.
+
+    Each distinct value is decrypted once. The decryption cache is read but
+    not filled, so exporting a whole table does not evict the values that
+    requests keep reading. Values no key can decrypt come back as None, the
+    way undecryptable fields read.
+    """
+    cache = get_decryption_cache()
+    key_ring = get_key_ring()
+    plaintexts = {}
+    result = []
+    for ciphertext in ciphertexts:
+        plaintext = plaintexts.get(ciphertext)
+        if plaintext is None:
+            plaintext = cache.get(ciphertext)
+            if plaintext is None:
+                try:
+                    plaintext = force_str(key_ring.decrypt(_to_token(ciphertext)))
+                except InvalidToken:
+                    logger.warning('An encrypted value could not be decrypted with any of FERNET_KEYS')
+            plaintexts[ciphertext] = plaintext
+        result.append(plaintext)
+    return result
+
+
+def reencrypt_value(ciphertext):
+    """
+    Return ``ciphertext`` re-encrypted with the primary key in the configured
+    storage format, or None if it already is.
+
+    Raises ``cryptography.fernet.InvalidToken`` if no key in the ring can
+    decrypt it.
+    """
+    token = _to_token(ciphertext)
+    in_format = ciphertext.startswith(TOKEN_PREFIX) == (settings.ENCRYPTED_FIELD_FORMAT != 'base64')
+    try:
+        get_primary_key().decrypt(token)
+    except InvalidToken:
+        # Keeps the token's original timestamp
+        return _to_stored(get_key_ring().rotate(token))
+    return None if in_format else _to_stored(token)
+
+
+class LazyDecrypted(SimpleLazyObject):
+    """
+    Plaintext of an encrypted column, decrypted the first time it is used.
+    
+    Behaves like the ``str`` it wraps. Until the attribute is reassigned the
+    original ``ciphertext`` is kept, and saving the row writes it back as is
+    instead of encrypting the value again.
+    
+    Model attributes read as None instead when no key can decrypt the value
+    (see ``EncryptedAttribute``); used directly, e.g. from ``values_list()``,
+    such a value raises ``cryptography.fernet.InvalidToken``.
+    """
+    
+    def __init__(self, ciphertext, plaintext=None):
+        self.__dict__['ciphertext'] = ciphertext
+        self.__dict__['undecryptable'] = False
+        super().__init__(lambda: decrypt_value(ciphertext))
+        if plaintext is not None:
+            self._wrapped = plaintext
+    
+    def decrypts(self):
+        """Whether the value can be decrypted, decrypting it unless that was tried already."""
+        if self._wrapped is empty and not self.undecryptable:
+            try:
+                self._setup()
+            except InvalidToken:
+                self.__dict__['undecryptable'] = True
+                logger.warning('An encrypted value could not be decrypted with any of FERNET_KEYS')
+        return self._wrapped is not empty
+    
+    def __getattr__(self, name):
+        # Answer probes such as hasattr(value, 'resolve_expression') made while
+        # saving without decrypting: a str has no such attribute
+        if not hasattr(str, name):
+            raise AttributeError(name)
+        return super().__getattr__(name)
+    
+    def __copy__(self):
+        if self._wrapped is empty:
+            return type(self)(self.ciphertext)
+        return type(self)(self.ciphertext, self._wrapped)
+    
+    def __deepcopy__(self, memo):
+        result = self.__copy__()
+        memo[id(self)] = result
+        return result
+
+
+def blind_index(value):
+    """
+    Return the keyed HMAC-SHA256 "blind index" of a plaintext value.
+
+    Fernet output is randomized, so encrypted columns cannot be compared in
+    SQL. The blind index is deterministic for a given key, which lets exact
+    matches run as indexed lookups without storing the plaintext.
+    """
+    if value is None:
+        return None
+    value = str(value).strip()
+    if not value:
+        return None
+    key = force_bytes(settings.BLIND_INDEX_KEY)
+    return hmac.new(key, force_bytes(value), hashlib.sha256).hexdigest()
+
+class EncryptedAttribute(DeferredAttribute):
+    """
+    Model attribute of an encrypted field. Reading it decrypts the value, and
+    a value no key can decrypt reads as None, logged rather than raised, so
+    one bad row does not break every page or export that shows it.
+    """
+    
+    def __get__(self, instance, cls=None):
+        value = super().__get__(instance, cls)
+        if isinstance(value, LazyDecrypted) and not value.decrypts():
+            return None
+        return value
+    
+    def __set__(self, instance, value):
+        # Defining __set__ makes this a data descriptor, so reads go through
+        # __get__ even once the value is in the instance __dict__
+        instance.__dict__[self.field.attname] = value
+
+
+def raw_value(instance, attname):
+    """Value of a field as loaded, without decrypting it."""
+    if attname in instance.__dict__:
+        return instance.__dict__[attname]
+    return getattr(instance, attname)
+
 
 class EncryptedField(models.Field):
-    """Base class for encrypted fields."""
+    """
+    Base class for encrypted fields.
     
-    def __init__(self, *args, **kwargs):
-        self.fernet = Fernet(force_bytes(settings.FERNET_KEYS[0]))
-        super().__init__(*args, **kwargs)
+    Values are encrypted with ``MultiFernet`` over ``settings.FERNET_KEYS`` and
+    stored as text in the format chosen by ``ENCRYPTED_FIELD_FORMAT``. Loaded
+    values are ``LazyDecrypted`` objects, so columns that are never used are
+    never decrypted. Decrypted values are cached per process by ciphertext.
+    """
+    
+    descriptor_class = EncryptedAttribute
     
     def get_internal_type(self):
         return "TextField"
     
+    def pre_save(self, model_instance, add):
+        # Saving an unchanged value writes its ciphertext back without decrypting it,
+        # which also keeps values no key can decrypt
+        return raw_value(model_instance, self.attname)
+    
     def get_db_prep_value(self, value, connection, prepared=False):
         if value is None:
             return None
         
+        # Unchanged values keep the ciphertext they were loaded with
+        if isinstance(value, LazyDecrypted):
+            return value.ciphertext
+        
         # Encrypt the value before storing it
-        value = force_bytes(value)
-        encrypted_value = self.fernet.encrypt(value)
-        return base64.b64encode(encrypted_value).decode('ascii')
+        return encrypt_value(value)
     
     def from_db_value(self, value, expression, connection):
         if value is None:
             return value
         
-        # Decrypt the value from the database
-        try:
-            encrypted_value = base64.b64decode(value)
-            decrypted_value = self.fernet.decrypt(encrypted_value)
-            return force_str(decrypted_value)
-        except Exception:
-            return None
+        # Decrypt the value on first use
+        return LazyDecrypted(value, get_decryption_cache().get(value))
 
 
 class EncryptedCharField(EncryptedField):
@@ -56,4 +322,43 @@ class EncryptedEmailField(EncryptedField):
         from django.forms import EmailField
         defaults = {'form_class': EmailField}
         defaults.update(kwargs)
-        return super().formfield(**defaults)
\ No newline at end of file
+        return super().formfield(**defaults)
+
+
+class EncryptedTextField(EncryptedField):
+    """TextField that transparently encrypts its value."""
+
+
+class BlindIndexField(models.CharField):
+    """
+    Indexed companion column holding the blind index of an encrypted field.
+
+    The value is recomputed from ``source`` whenever the model is saved or
+    bulk created. ``bulk_update()`` skips ``pre_save()``, so callers that
+    change the source field that way must call ``pre_save()`` themselves and
+    include this field in the update.
+    """
+
+    def __init__(self, source, *args, **kwargs):
+        self.source = source
+        kwargs.setdefault('max_length', 64)
+        kwargs.setdefault('db_index', True)
+        kwargs.setdefault('editable', False)
+        kwargs.setdefault('null', True)
+        kwargs.setdefault('blank', True)
+        super().__init__(*args, **kwargs)
+
+    def pre_save(self, model_instance, add):
+        source_value = raw_value(model_instance, self.source)
+        current = getattr(model_instance, self.attname)
+        if isinstance(source_value, LazyDecrypted) and current is not None:
+            # Source unchanged since it was loaded, so neither is its index
+            return current
+        value = blind_index(source_value)
+        setattr(model_instance, self.attname, value)
+        return value
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs['source'] = self.source
+        return name, path, args, kwargs
@@ -0,0 +1,377 @@
+"""
+Job handlers for company bulk uploads.
+
+These run on the bulk upload queue (see ``employees.jobs``), or inline when
+``BULK_UPLOADS_ASYNC`` is disabled.
+"""
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+import logging
+
+from .cache import invalidate_companies
+from .departments import clean_department_name, department_key
+from .models import Company, Department
+from .encryption import blind_index
+from employees.errors import UploadErrors
+from employees.jobs import UploadFileError, upload_chunks
+from employees.models import BulkUploadError, Employee
+from employees.plans import UPDATE, BulkEditor, PlanConflict, PlannedChange
+from employees.schema import Column, UploadSchema
+from employees.search import rebuild_search_documents
+from users.models import User
+from users.services import UserAccount, provision_users
+
+logger = logging.getLogger(__name__)
+
+
+# Columns of ``company_with_user`` uploads, as documented on ``CompanyViewSet.bulk_upload``
+COMPANY_UPLOAD_SCHEMA = UploadSchema(
+    Column('name', required=True),
+    Column('registration_number', required=True),
+    Column('registration_date', 'date', required=True),
+    Column('address', required=True),
+    Column('number_of_employees', 'int', required=True),
+    Column('contact_person', required=True),
+    Column('contact_phone', required=True),
+    Column('email_address', required=True),
+    Column('departments'),
+    Column('user_email'),
+    Column('user_password'),
+)
+
+# Columns of ``company_edit`` uploads, as documented on ``CompanyViewSet.bulk_edit``
+COMPANY_EDIT_SCHEMA = UploadSchema(
+    Column('registration_number', required=True),
+    Column('name'),
+    Column('number_of_employees', 'int'),
+    Column('contact_person'),
+    Column('contact_phone'),
+    Column('email_address'),
+)
+
+
+def _provision_company_users(accounts, report):
+    """
+    Create the users for ``(row number, UserAccount)`` pairs in one batch.
+
+    If the batch violates a constraint, e.g. an email registered since it was
+    checked, accounts are retried one at a time so the error is reported to
+    ``report`` against the right row. Returns the ``ProvisionedUser`` list.
+    """
+    try:
+        with transaction.atomic():
+            return provision_users([account for _, account in accounts])
+    except IntegrityError:
+        provisioned = []
+        for number, account in accounts:
+            try:
+                with transaction.atomic():
+                    provisioned.extend(provision_users([account]))
+            except IntegrityError as e:
+                report.add(number, f"Row {number}: Company created but user '{account.email}' could not be created: {str(e)}")
+                logger.error(f"Error creating user for company row {number}: {str(e)}")
+        return provisioned
+
+
+class _Batch:
+    """Companies planned from one chunk of rows, merged into the uploader on commit."""
+
+    def __init__(self):
+        self.companies = []
+        self.departments = []
+        self.accounts = []  # (row number, UserAccount) for users created once the companies exist
+        self.registration_indexes = set()
+        self.emails = set()
+        self.skipped = 0
+        self.warnings = []  # (row, message), reported once the batch is committed
+
+
+class CompanyBulkUploader:
+    """
+    Onboard companies, their departments and company users from upload rows.
+
+    Registration numbers and user emails are checked against the database
+    once per chunk. Each chunk's companies and departments are written with
+    ``bulk_create`` in one transaction, and its users are then provisioned
+    together; a chunk that fails is retried row by row so the error is
+    reported against the row that caused it.
+    """
+
+    def __init__(self, report, chunk_size=None):
+        self.report = report
+        self.chunk_size = chunk_size or settings.BULK_UPLOAD_CHUNK_SIZE
+        self.processed = 0
+        self.created = 0
+        self.users_created = 0
+        self.skipped = 0
+        self.password_setup = []
+        # Blind indexes of registration numbers known to exist, filled chunk by chunk
+        self._registration_indexes = set()
+        # Emails known to be taken, to avoid duplicate users
+        self._emails = set()
+
+    def _add_error(self, number, message):
+        self.report.add(number, f"Error in row {number}: {message}")
+        logger.error(f"Error processing company row {number}: {message}")
+
+    def process(self, df):
+        """Validate ``df`` and onboard its valid rows in chunks of ``chunk_size`` rows."""
+        self.processed += len(df)
+        clean, invalid = COMPANY_UPLOAD_SCHEMA.validate(df)
+        for number, code, message in invalid.itertuples(index=False):
+            self.report.add(number, f"Error in row {number}: {message}", code)
+            logger.error(f"Error processing company row {number}: {message}")
+
+        # Company user: use specified user_email or derive from company email
+        user_emails = clean['user_email'].where(clean['user_email'].notna(), clean['email_address'])
+        clean = clean.assign(user_email=user_emails.map(User.objects.normalize_email))
+
+        # Look up the registration numbers through their blind index instead of
+        # decrypting every company in the database, and the emails of the users
+        # the rows would create
+        self._registration_indexes.update(
+            Company.objects.by_registration_numbers(clean['registration_number'])
+            .values_list('registration_number_index', flat=True)
+        )
+        self._emails.update(
+            User.objects.filter(email__in=set(clean['user_email'])).values_list('email', flat=True)
+        )
+
+        rows = list(clean.itertuples())
+        for start in range(0, len(rows), self.chunk_size):
+            self._process_chunk(rows[start:start + self.chunk_size])
+
+    def _process_chunk(self, rows):
+        try:
+            accounts = self._commit(rows)
+        except Exception:
+            # Isolate the failing row(s) by retrying each one on its own
+            accounts = []
+            for row in rows:
+                try:
+                    accounts.extend(self._commit([row]))
+                except Exception as e:
+                    self._add_error(row.Index, str(e))
+
+        if accounts:
+            provisioned = _provision_company_users(accounts, self.report)
+            self.users_created += len(provisioned)
+            self.password_setup.extend(
+                {'email': user.email, 'uid': uid, 'token': token}
+                for user, uid, token in provisioned if token
+            )
+
+    def _commit(self, rows):
+        """Create the companies and departments of ``rows`` in one transaction and return their user accounts."""
+        batch = _Batch()
+        with transaction.atomic():
+            self._plan(rows, batch)
+            Company.objects.bulk_create(batch.companies, batch_size=self.chunk_size)
+            Department.objects.bulk_create(batch.departments, batch_size=self.chunk_size)
+            # New companies only change the cached company lists
+            invalidate_companies()
+
+        self._registration_indexes.update(batch.registration_indexes)
+        self._emails.update(batch.emails)
+        self.created += len(batch.companies)
+        self.skipped += batch.skipped
+        for number, message in batch.warnings:
+            self.report.add(number, message, BulkUploadError.DUPLICATE, warning=True)
+        return batch.accounts
+
+    def _plan(self, rows, batch):
+        for row in rows:
+            number = row.Index
+            registration_index = blind_index(row.registration_number)
+
+            # Check if company already exists, or is created by an earlier row of the upload
+            if registration_index in self._registration_indexes or registration_index in batch.registration_indexes:
+                batch.skipped += 1
+                batch.warnings.append((
+                    number,
+                    f"Row {number}: Company with registration number '{row.registration_number}' already exists. Use bulk_edit to update existing companies.",
+                ))
+                continue
+
+            company = Company(
+                name=row.name,
+                registration_number=row.registration_number,
+                registration_date=row.registration_date,
+                address=row.address,
+                number_of_employees=row.number_of_employees,
+                contact_person=row.contact_person,
+                contact_phone=row.contact_phone,
+                email_address=row.email_address
+            )
+            batch.companies.append(company)
+            batch.registration_indexes.add(registration_index)
+
+            # Process departments if included
+            if row.departments is not None:
+                # Department names are unique per company, whatever their case and spacing
+                names = {}
+                for name in row.departments.split(','):
+                    if department_key(name):  # Only create non-empty department names
+                        names.setdefault(department_key(name), clean_department_name(name))
+                for dept_name in names.values():
+                    batch.departments.append(Department(company=company, name=dept_name))
+
+            # Check if a user with this email already exists
+            if row.user_email in self._emails or row.user_email in batch.emails:
+                batch.warnings.append((
+                    number,
+                    f"Row {number}: User with email '{row.user_email}' already exists. Company created but no user was created.",
+                ))
+                continue
+            batch.emails.add(row.user_email)
+
+            # Without a password the user gets a one-time set-password token instead
+            batch.accounts.append((number, UserAccount(
+                email=row.user_email,
+                password=row.user_password,
+                role='company_user',
+                company=company,
+            )))
+
+
+def process_company_upload(upload_log):
+    """Job handler for ``company_with_user`` uploads."""
+    report = UploadErrors(upload_log)
+    uploader = CompanyBulkUploader(report)
+
+    with upload_chunks(upload_log) as chunks:
+        for df in chunks:
+            missing_columns = COMPANY_UPLOAD_SCHEMA.missing_columns(df)
+            if missing_columns:
+                raise UploadFileError(f"Missing required columns: {', '.join(missing_columns)}")
+            uploader.process(df)
+            report.flush()
+            upload_log.report_progress(uploader.processed, uploader.created, 0, report.errors)
+
+    result = {
+        'success': True,
+        'processed': uploader.processed,
+        'companies_created': uploader.created,
+        'users_created': uploader.users_created,
+        'skipped_existing': uploader.skipped,
+        'errors': report.errors,
+        'details': 'File processed successfully',
+        # The first errors only; see error_summary for the totals
+        'error_details': report.first,
+        'error_summary': report.summary,
+        # Users created without a password, identified by email and uid
+        'password_setup': [{'email': setup['email'], 'uid': setup['uid']} for setup in uploader.password_setup],
+    }
+    # Update log with results
+    upload_log.records_total = uploader.processed
+    upload_log.mark_completed(
+        records_processed=uploader.processed,
+        records_created=uploader.created,
+        records_updated=0,  # No updates in this endpoint
+        errors=report.errors,
+        error_details=report.as_text(),
+        result=result
+    )
+    # The set-password tokens are only ever returned, never stored: anyone who
+    # can read upload logs could otherwise take over the accounts
+    return {**result, 'password_setup': uploader.password_setup}
+
+
+class CompanyBulkEditor(BulkEditor):
+    """Plan and apply ``company_edit`` upload rows for existing companies."""
+
+    schema = COMPANY_EDIT_SCHEMA
+    row_label = 'company'
+    fields = ('name', 'number_of_employees', 'contact_person', 'contact_phone', 'email_address')
+
+    def reset_planning(self):
+        # Companies as planned so far, keyed by blind index
+        self._planned_companies = {}
+
+    def plan_rows(self, rows):
+        # Fetch only the companies referenced by the chunk that earlier chunks have not planned
+        reg_to_company = self._planned_companies
+        unseen = [value for value in rows['registration_number'] if blind_index(value) not in reg_to_company]
+        if unseen:
+            for comp in Company.objects.by_registration_numbers(unseen):
+                reg_to_company[comp.registration_number_index] = comp
+
+        changes = []
+        for row in rows.itertuples():
+            # Look up company by reg number in our mapping
+            company = reg_to_company.get(blind_index(row.registration_number))
+            if not company:
+                self.report.add(
+                    row.Index,
+                    f"Company with registration number '{row.registration_number}' not found.",
+                    BulkUploadError.NOT_FOUND,
+                )
+                continue
+
+            # Update fields if present
+            for field in self.fields:
+                value = getattr(row, field)
+                if value is not None and value != getattr(company, field):
+                    changes.append(PlannedChange(row.Index, UPDATE, company.pk, field, getattr(company, field), value))
+                    setattr(company, field, value)
+        return changes
+
+    def apply(self, changes):
+        companies = Company.objects.in_bulk({change.target_id for change in changes})
+        for change in changes:
+            company = companies.get(change.target_id)
+            if company is None:
+                raise PlanConflict(change.row, f"Company {change.target_id} no longer exists")
+            field = Company._meta.get_field(change.field)
+            if getattr(company, change.field) != field.to_python(change.old):
+                raise PlanConflict(change.row, f"'{change.field}' of company {company.pk} has changed since the plan was made")
+            setattr(company, change.field, field.to_python(change.new))
+        if not changes:
+            return
+
+        now = timezone.now()
+        for company in companies.values():
+            company.updated_at = now
+        Company.objects.bulk_update(
+            companies.values(),
+            sorted({change.field for change in changes}) + ['updated_at'],
+        )
+        # bulk_update skips the signals that invalidate cached companies
+        invalidate_companies(companies)
+        # bulk_update skips the signals that keep employee search documents in sync
+        renamed = {change.target_id for change in changes if change.field == 'name'}
+        if renamed:
+            rebuild_search_documents(
+                Employee.objects.filter(Q(current_company__in=renamed) | Q(roles__company__in=renamed))
+                .values_list('pk', flat=True).distinct()
+            )
+
+
+def process_company_edit(upload_log):
+    """Job handler for ``company_edit`` uploads."""
+    editor = CompanyBulkEditor(upload_log.user, upload_log)
+    plan = editor.run(upload_log)
+
+    result = {
+        'success': True,
+        'processed': editor.processed,
+        'updated': editor.updated,
+        'errors': editor.errors,
+        # The first errors only; see error_summary for the totals
+        'error_details': editor.report.first,
+        'error_summary': editor.report.summary
+    }
+    if plan is not None:
+        result.update(dry_run=True, plan_id=str(plan.pk), summary=plan.summary)
+    upload_log.records_total = editor.processed
+    upload_log.mark_completed(
+        records_processed=editor.processed,
+        records_created=0,
+        records_updated=editor.updated,
+        errors=editor.errors,
+        error_details=editor.report.as_text(),
+        result=result
+    )
+    return result
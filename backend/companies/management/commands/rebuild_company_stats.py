@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from companies.stats import rebuild_company_stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute the employee statistics of every company from its employees'
+
+    def handle(self, *args, **options):
+        rebuilt = rebuild_company_stats()
+        self.stdout.write(f"Rebuilt the statistics of {rebuilt} companies")
@@ -0,0 +1,231 @@
+from contextlib import nullcontext
+import json
+import logging
+import multiprocessing
+import os
+import time
+
+import django
+from cryptography.fernet import InvalidToken
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+
+from companies.encryption import EncryptedField, LazyDecrypted, reencrypt_value
+
+logger = logging.getLogger(__name__)
+
+
+def encrypted_fields(model):
+    return [field.name for field in model._meta.concrete_fields if isinstance(field, EncryptedField)]
+
+
+def rotate_chunk(label, start, end, dry_run):
+    """
+    Re-encrypt the rows of ``label`` with ``start < pk <= end``.
+
+    Values already encrypted with the primary key in the configured format are
+    left alone, so chunks can safely be run again. Rows are locked while their
+    chunk is written where the database supports it; elsewhere a row is only
+    written if its ciphertexts are still the ones that were read. Either way an
+    edit made meanwhile is not overwritten. Returns ``(label, end, rows
+    scanned, rows rotated, rows that could not be decrypted)``.
+    """
+    if not apps.ready:
+        # Spawned (not forked) worker processes start without Django configured
+        django.setup()
+
+    model = apps.get_model(label)
+    fields = encrypted_fields(model)
+    rows = model._default_manager.only('pk', *fields).order_by('pk').filter(pk__lte=end)
+    if start is not None:
+        rows = rows.filter(pk__gt=start)
+    lock = not dry_run and connections[rows.db].features.has_select_for_update
+
+    with transaction.atomic(using=rows.db) if lock else nullcontext():
+        if lock:
+            rows = rows.select_for_update()
+        changed = []
+        failed = 0
+        scanned = 0
+        for row in rows:
+            scanned += 1
+            try:
+                updates = {}
+                for field in fields:
+                    value = row.__dict__.get(field)
+                    if value is not None:
+                        ciphertext = reencrypt_value(value.ciphertext)
+                        if ciphertext is not None:
+                            updates[field] = LazyDecrypted(ciphertext)
+            except InvalidToken:
+                failed += 1
+                logger.error(f"{label} {row.pk}: no key in FERNET_KEYS can decrypt this row")
+                continue
+            if updates:
+                read = {field: row.__dict__.get(field) for field in fields}
+                for field, value in updates.items():
+                    setattr(row, field, value)
+                changed.append((row, read))
+
+        if dry_run or not changed:
+            rotated = len(changed)
+        elif lock:
+            model._default_manager.bulk_update([row for row, _ in changed], fields)
+            rotated = len(changed)
+        else:
+            rotated = update_unchanged(model, changed, fields)
+    return label, end, scanned, rotated, failed
+
+
+def update_unchanged(model, changed, fields):
+    """
+    Write ``(row, values read)`` pairs one row at a time, each only while the
+    row still holds the values read. Rows edited since were saved with the
+    primary key already and are skipped. Returns the number of rows written.
+    """
+    written = 0
+    with transaction.atomic(using=model._default_manager.db):
+        for row, read in changed:
+            if model._default_manager.filter(pk=row.pk, **read).update(
+                **{field: row.__dict__[field] for field in fields}
+            ):
+                written += 1
+            else:
+                logger.info(f"{model._meta.label} {row.pk}: changed while rotating, left as saved")
+    return written
+
+
+def _rotate_chunk_task(task):
+    return rotate_chunk(*task)
+
+
+class Command(BaseCommand):
+    help = (
+        'Re-encrypt every encrypted column with the first key in FERNET_KEYS, '
+        'in the storage format set by ENCRYPTED_FIELD_FORMAT'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of rows re-encrypted per transaction')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of worker processes')
+        parser.add_argument('--models', nargs='+', metavar='APP_LABEL.MODEL',
+                            help='Only these models (default: every model with encrypted fields)')
+        parser.add_argument('--checkpoint', metavar='FILE',
+                            help='JSON file recording finished batches; a rerun continues after them')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report what would be re-encrypted without writing anything')
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        self.dry_run = options['dry_run']
+        self.checkpoint_path = options['checkpoint']
+        self.checkpoint = self.load_checkpoint()
+
+        if options['models']:
+            try:
+                models = [apps.get_model(label) for label in options['models']]
+            except (LookupError, ValueError) as e:
+                raise CommandError(str(e))
+        else:
+            models = [model for model in apps.get_models() if encrypted_fields(model)]
+
+        workers = max(1, options['workers'])
+        failed = 0
+        for model in models:
+            if not encrypted_fields(model):
+                raise CommandError(f"{model._meta.label} has no encrypted fields")
+            failed += self.rotate_model(model, workers)
+
+        if failed:
+            self.stderr.write(
+                f"{failed} rows could not be decrypted with any key and were left unchanged. "
+                "Do not remove old keys from FERNET_KEYS until they are dealt with."
+            )
+
+    def load_checkpoint(self):
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return {}
+        with open(self.checkpoint_path) as file:
+            return json.load(file)
+
+    def save_checkpoint(self):
+        if not self.checkpoint_path or self.dry_run:
+            return
+        temporary = f"{self.checkpoint_path}.tmp"
+        with open(temporary, 'w') as file:
+            json.dump(self.checkpoint, file)
+        os.replace(temporary, self.checkpoint_path)
+
+    def chunks(self, model, start):
+        """``(start, end]`` primary key ranges of ``batch_size`` rows each, after ``start``."""
+        pks = model._default_manager.order_by('pk').values_list('pk', flat=True)
+        ranges = []
+        while True:
+            batch = pks if start is None else pks.filter(pk__gt=start)
+            end = batch[self.batch_size - 1:self.batch_size].first()
+            if end is None:
+                end = batch.last()
+                if end is not None:
+                    ranges.append((start, str(end)))
+                return ranges
+            ranges.append((start, str(end)))
+            start = str(end)
+
+    def rotate_model(self, model, workers):
+        label = model._meta.label
+        start = self.checkpoint.get(label)
+        remaining = model._default_manager.count() if start is None else model._default_manager.filter(pk__gt=start).count()
+        ranges = self.chunks(model, start)
+        self.stdout.write(
+            f"{label}: {remaining} rows in {len(ranges)} batches"
+            + (f", resuming after {start}" if start else '')
+            + (' (dry run)' if self.dry_run else '')
+        )
+
+        tasks = [(label, chunk_start, chunk_end, self.dry_run) for chunk_start, chunk_end in ranges]
+        # Batches finish out of order with several workers; the checkpoint only
+        # moves past a batch once every batch before it has finished too
+        pending = [chunk_end for _, chunk_end in ranges]
+        finished = set()
+        scanned = rotated = failed = 0
+        started = last_report = time.monotonic()
+
+        if workers == 1:
+            results = (rotate_chunk(*task) for task in tasks)
+            pool = None
+        else:
+            # Forked children must not share the parent's database connections
+            connections.close_all()
+            pool = multiprocessing.Pool(workers)
+            results = pool.imap_unordered(_rotate_chunk_task, tasks)
+
+        try:
+            for _, end, chunk_scanned, chunk_rotated, chunk_failed in results:
+                scanned += chunk_scanned
+                rotated += chunk_rotated
+                failed += chunk_failed
+
+                finished.add(end)
+                while pending and pending[0] in finished:
+                    self.checkpoint[label] = pending.pop(0)
+                self.save_checkpoint()
+
+                now = time.monotonic()
+                if now - last_report >= 5 or not pending:
+                    last_report = now
+                    rate = scanned / max(now - started, 1e-6)
+                    eta = (remaining - scanned) / rate if rate else 0
+                    self.stdout.write(
+                        f"{label}: {scanned}/{remaining} rows scanned, {rotated} "
+                        f"{'to re-encrypt' if self.dry_run else 're-encrypted'}, {failed} unreadable "
+                        f"({rate:.0f} rows/s, about {eta:.0f}s left)"
+                    )
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        return failed
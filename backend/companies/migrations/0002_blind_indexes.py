@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:22
+
+import companies.encryption
+from django.db import migrations
+
+
+def backfill_registration_number_index(apps, schema_editor):
+    """Compute the blind index for every existing company."""
+    Company = apps.get_model('companies', 'Company')
+    batch = []
+    for obj in Company.objects.only('id', 'registration_number').iterator(chunk_size=2000):
+        obj.registration_number_index = companies.encryption.blind_index(obj.registration_number)
+        batch.append(obj)
+        if len(batch) >= 2000:
+            Company.objects.bulk_update(batch, ['registration_number_index'])
+            batch = []
+    if batch:
+        Company.objects.bulk_update(batch, ['registration_number_index'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('companies', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='registration_number_index',
+            field=companies.encryption.BlindIndexField(blank=True, db_index=True, editable=False, max_length=64, null=True, source='registration_number'),
+        ),
+        migrations.RunPython(backfill_registration_number_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,85 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:02
+
+import django.db.models.deletion
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncMonth
+
+
+def backfill_company_stats(apps, schema_editor):
+    """Count the existing employees of every company (see companies.stats)."""
+    Company = apps.get_model('companies', 'Company')
+    CompanyStats = apps.get_model('companies', 'CompanyStats')
+    DepartmentHeadcount = apps.get_model('companies', 'DepartmentHeadcount')
+    MonthlyEmployeeStats = apps.get_model('companies', 'MonthlyEmployeeStats')
+    Employee = apps.get_model('employees', 'Employee')
+    employees = Employee.objects.order_by()
+    active = employees.filter(is_active=True)
+
+    counts = dict(active.values_list('current_company').annotate(count=Count('id')))
+    CompanyStats.objects.bulk_create([
+        CompanyStats(company_id=company_id, active_employees=counts.get(company_id, 0))
+        for company_id in Company.objects.values_list('id', flat=True)
+    ])
+    DepartmentHeadcount.objects.bulk_create([
+        DepartmentHeadcount(company_id=company_id, department_id=department_id, headcount=count)
+        for company_id, department_id, count in active.filter(current_department__isnull=False)
+        .values_list('current_company', 'current_department').annotate(count=Count('id'))
+    ])
+    monthly = defaultdict(lambda: [0, 0])
+    for index, field in enumerate(('date_joined', 'date_left')):
+        for company_id, month, count in (
+            employees.filter(**{f'{field}__isnull': False})
+            .annotate(month=TruncMonth(field)).values_list('current_company', 'month').annotate(count=Count('id'))
+        ):
+            monthly[(company_id, month)][index] += count
+    MonthlyEmployeeStats.objects.bulk_create([
+        MonthlyEmployeeStats(company_id=company_id, month=month, joiners=joiners, leavers=leavers)
+        for (company_id, month), (joiners, leavers) in monthly.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('companies', '0003_keyset_pagination_indexes'),
+        ('employees', '0008_upload_errors'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompanyStats',
+            fields=[
+                ('company', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='companies.company')),
+                ('active_employees', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'Company stats',
+            },
+        ),
+        migrations.CreateModel(
+            name='DepartmentHeadcount',
+            fields=[
+                ('department', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='headcount', serialize=False, to='companies.department')),
+                ('headcount', models.IntegerField(default=0)),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='department_headcounts', to='companies.company')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MonthlyEmployeeStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('joiners', models.IntegerField(default=0)),
+                ('leavers', models.IntegerField(default=0)),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_stats', to='companies.company')),
+            ],
+            options={
+                'ordering': ['company', 'month'],
+                'constraints': [models.UniqueConstraint(fields=('company', 'month'), name='monthlyemployeestats_company_month')],
+            },
+        ),
+        migrations.RunPython(backfill_company_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:08
+
+from django.db import migrations, models
+from django.db.models import Count, F
+
+
+def merge_duplicate_departments(apps, schema_editor):
+    """
+    Merge departments sharing a company and name before the constraint is
+    added: employees, roles and headcounts move to the first one by id.
+    """
+    Department = apps.get_model('companies', 'Department')
+    DepartmentHeadcount = apps.get_model('companies', 'DepartmentHeadcount')
+    Employee = apps.get_model('employees', 'Employee')
+    EmployeeRole = apps.get_model('employees', 'EmployeeRole')
+    duplicates = (
+        Department.objects.values('company_id', 'name')
+        .annotate(count=Count('id'))
+        .filter(count__gt=1)
+        .order_by()
+    )
+    for group in duplicates.iterator():
+        ids = list(
+            Department.objects.filter(company_id=group['company_id'], name=group['name'])
+            .order_by('id').values_list('id', flat=True)
+        )
+        keep, others = ids[0], ids[1:]
+        Employee.objects.filter(current_department_id__in=others).update(current_department_id=keep)
+        EmployeeRole.objects.filter(department_id__in=others).update(department_id=keep)
+        merged = sum(DepartmentHeadcount.objects.filter(department_id__in=others).values_list('headcount', flat=True))
+        if merged:
+            headcount, _ = DepartmentHeadcount.objects.get_or_create(
+                department_id=keep, defaults={'company_id': group['company_id']}
+            )
+            DepartmentHeadcount.objects.filter(pk=headcount.pk).update(headcount=F('headcount') + merged)
+        Department.objects.filter(id__in=others).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('companies', '0004_company_stats'),
+        ('employees', '0008_upload_errors'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_departments, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='department',
+            constraint=models.UniqueConstraint(fields=('company', 'name'), name='department_company_name'),
+        ),
+    ]
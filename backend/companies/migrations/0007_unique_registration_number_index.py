@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:45
+
+import companies.encryption
+from django.db import migrations
+from django.db.models import Count
+
+
+def check_duplicate_registration_numbers(apps, schema_editor):
+    """
+    Stop before adding the constraint if companies share a registration
+    number: merging them moves employees and users, which needs a person.
+    """
+    Company = apps.get_model('companies', 'Company')
+    duplicates = (
+        Company.objects.exclude(registration_number_index=None)
+        .values('registration_number_index')
+        .annotate(count=Count('id'))
+        .filter(count__gt=1)
+        .order_by()
+    )
+    names = [
+        list(Company.objects.filter(registration_number_index=group['registration_number_index']).values_list('name', flat=True))
+        for group in duplicates[:20]
+    ]
+    if names:
+        raise RuntimeError(
+            'Companies share a registration number and must be merged or corrected first: '
+            + '; '.join(', '.join(group) for group in names)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('companies', '0006_cache_versions'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicate_registration_numbers, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='company',
+            name='registration_number',
+            field=companies.encryption.EncryptedCharField(max_length=None),
+        ),
+        migrations.AlterField(
+            model_name='company',
+            name='registration_number_index',
+            field=companies.encryption.BlindIndexField(blank=True, db_index=True, editable=False, max_length=64, null=True, source='registration_number', unique=True),
+        ),
+    ]
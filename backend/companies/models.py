@@ -1,6 +1,20 @@
 from django.db import models
 import uuid
-from .encryption import EncryptedCharField, EncryptedEmailField
+from .encryption import EncryptedCharField, EncryptedEmailField, BlindIndexField, blind_index
+
+
+class CompanyQuerySet(models.QuerySet):
+    """QuerySet with blind-index lookups for encrypted company fields."""
+
+    def by_registration_number(self, registration_number):
+        """Filter companies by exact (plaintext) registration number."""
+        return self.filter(registration_number_index=blind_index(registration_number))
+
+    def by_registration_numbers(self, registration_numbers):
+        """Filter companies whose registration number is in the given iterable."""
+        indexes = {blind_index(value) for value in registration_numbers} - {None}
+        return self.filter(registration_number_index__in=indexes)
+
 
 class Company(models.Model):
     """Company model for storing employer data."""
@@ -8,7 +22,11 @@ class Company(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     name = models.CharField(max_length=255)
     # Encrypt company registration number as it's sensitive business data
-    registration_number = EncryptedCharField(max_length=100, unique=True)
+    registration_number = EncryptedCharField(max_length=100)
+    # Blind index so registration numbers can be looked up without decrypting
+    # every row. The ciphertext differs on every save, so this is also what
+    # keeps registration numbers unique.
+    registration_number_index = BlindIndexField(source='registration_number', unique=True)
     registration_date = models.DateField()
     address = models.TextField()
     number_of_employees = models.IntegerField()
@@ -19,9 +37,15 @@ class Company(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = CompanyQuerySet.as_manager()
+    
     class Meta:
         verbose_name_plural = "Companies"
         ordering = ['name']
+        indexes = [
+            # Keyset pagination order
+            models.Index(fields=['name', 'id'], name='company_name_id_idx'),
+        ]
     
     def __str__(self):
         return self.name
@@ -34,5 +58,70 @@ class Department(models.Model):
     company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='departments')
     name = models.CharField(max_length=100)
     
+    class Meta:
+        constraints = [
+            # Departments are looked up and created by name, also by concurrent uploads
+            models.UniqueConstraint(fields=['company', 'name'], name='department_company_name'),
+        ]
+    
     def __str__(self):
         return f"{self.name} ({self.company.name})"
+
+
+class CompanyStats(models.Model):
+    """
+    Employee statistics of a company, kept up to date incrementally by
+    ``companies.stats`` so reading them never aggregates over employees.
+    """
+
+    company = models.OneToOneField(Company, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    active_employees = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = "Company stats"
+
+    def __str__(self):
+        return f"Stats for {self.company_id}"
+
+
+class DepartmentHeadcount(models.Model):
+    """Number of active employees whose current department is ``department``."""
+
+    department = models.OneToOneField(Department, on_delete=models.CASCADE, primary_key=True, related_name='headcount')
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='department_headcounts')
+    headcount = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.department_id}: {self.headcount}"
+
+
+class MonthlyEmployeeStats(models.Model):
+    """Employees of a company who joined or left during ``month``."""
+
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='monthly_stats')
+    month = models.DateField()  # First day of the month
+    joiners = models.IntegerField(default=0)
+    leavers = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ['company', 'month']
+        constraints = [
+            models.UniqueConstraint(fields=['company', 'month'], name='monthlyemployeestats_company_month'),
+        ]
+
+    def __str__(self):
+        return f"{self.company_id} {self.month:%Y-%m}: +{self.joiners} -{self.leavers}"
+
+
+class CacheVersion(models.Model):
+    """
+    Version of a cached company representation or of the company list (see
+    ``companies.cache``). Kept in the database so that every process, web or
+    upload worker, sees the same versions.
+    """
+
+    key = models.CharField(max_length=64, primary_key=True)
+    version = models.BigIntegerField()
+
+    def __str__(self):
+        return f"{self.key}: {self.version}"
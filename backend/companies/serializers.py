@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Company, Department
+from .models import Company, Department, DepartmentHeadcount, MonthlyEmployeeStats
 
 
 class DepartmentSerializer(serializers.ModelSerializer):
@@ -15,18 +15,48 @@ class CompanySerializer(serializers.ModelSerializer):
     """Serializer for Company model."""
     
     departments = DepartmentSerializer(many=True, read_only=True)
-    # employees_count = serializers.SerializerMethodField()
+    employees_count = serializers.SerializerMethodField()
     
     class Meta:
         model = Company
         fields = [
             'id', 'name', 'registration_number', 'registration_date', 
             'address', 'number_of_employees', 'contact_person', 'contact_phone', 'email_address',
-            'departments', 'created_at', 'updated_at'
+            'departments', 'employees_count', 'created_at', 'updated_at'
         ]
-        # 'employees_count',
         read_only_fields = ['id', 'created_at', 'updated_at']
     
-    # def get_employees_count(self, obj):
-    #     """Get count of active employees."""
-    #     return obj.employees.filter(is_active=True).count()
\ No newline at end of file
+    def validate_registration_number(self, value):
+        """Registration numbers are unique, compared through their blind index."""
+        companies = Company.objects.by_registration_number(value)
+        if self.instance is not None:
+            companies = companies.exclude(pk=self.instance.pk)
+        if companies.exists():
+            raise serializers.ValidationError('A company with this registration number already exists.')
+        return value
+    
+    def get_employees_count(self, obj):
+        """Get count of active employees, from the company stats rather than counting them."""
+        stats = getattr(obj, 'stats', None)
+        return stats.active_employees if stats else 0
+
+
+class DepartmentHeadcountSerializer(serializers.ModelSerializer):
+    """Serializer for the active headcount of a department."""
+    
+    id = serializers.UUIDField(source='department_id', read_only=True)
+    name = serializers.CharField(source='department.name', read_only=True)
+    
+    class Meta:
+        model = DepartmentHeadcount
+        fields = ['id', 'name', 'headcount']
+
+
+class MonthlyEmployeeStatsSerializer(serializers.ModelSerializer):
+    """Serializer for the joiners and leavers of a company in one month."""
+    
+    month = serializers.DateField(format='%Y-%m', read_only=True)
+    
+    class Meta:
+        model = MonthlyEmployeeStats
+        fields = ['month', 'joiners', 'leavers']
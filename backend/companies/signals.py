@@ -0,0 +1,23 @@
+"""
+Invalidate cached company representations (see ``companies.cache``) when a
+company or one of its departments is saved or deleted.
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import invalidate_companies
+from .models import Company, Department
+
+
+@receiver(post_save, sender=Company)
+@receiver(post_delete, sender=Company)
+def company_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        invalidate_companies([instance.pk])
+
+
+@receiver(post_save, sender=Department)
+@receiver(post_delete, sender=Department)
+def department_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        invalidate_companies([instance.company_id])
@@ -0,0 +1,225 @@
+"""
+Incrementally maintained employee statistics per company.
+
+Every employee adds to a few counters: while active, its company's active
+employee count and its current department's headcount; always, the joiners of
+the month it joined and, once it has left, the leavers of the month it left.
+``stats_key`` captures what one employee adds. A write turns the keys of the
+employees it changes, before and after, into deltas with ``stats_deltas``, and
+``apply_deltas`` adds those to the stored counters with one UPDATE per company
+and distinct delta, so a chunk of a thousand uploaded employees costs a few
+statements rather than a thousand.
+
+``Employee`` saves and deletes are counted by signals in ``employees.signals``
+(``EmployeeRole.save()`` moves its employee with ``save()`` too). Bulk paths
+that bypass them call ``record_employee_changes`` themselves.
+``rebuild_company_stats`` recomputes the counters from scratch.
+"""
+from collections import Counter, defaultdict, namedtuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.functions import TruncMonth
+from django.utils.dateparse import parse_date
+
+from employees.models import Employee
+from .cache import invalidate_companies
+from .models import Company, CompanyStats, DepartmentHeadcount, MonthlyEmployeeStats
+
+StatsKey = namedtuple('StatsKey', ['company_id', 'is_active', 'department_id', 'joined', 'left'])
+
+# Employee fields the statistics depend on, in ``StatsKey`` order
+STATS_FIELDS = ('current_company_id', 'is_active', 'current_department_id', 'date_joined', 'date_left')
+
+# Counters an employee can add to
+ACTIVE = 'active'
+DEPARTMENT = 'department'
+JOINERS = 'joiners'
+LEAVERS = 'leavers'
+
+
+def _month(value):
+    if isinstance(value, str):
+        value = parse_date(value)
+    return value.replace(day=1) if value else None
+
+
+def _key(company_id, is_active, department_id, date_joined, date_left):
+    return StatsKey(company_id, bool(is_active), department_id, _month(date_joined), _month(date_left))
+
+
+def stats_key(employee):
+    """What ``employee`` adds to the statistics, as it is in memory."""
+    return _key(*(getattr(employee, field) for field in STATS_FIELDS))
+
+
+def stored_stats_keys(queryset):
+    """What each employee of ``queryset`` adds to the statistics, as stored, keyed by primary key."""
+    return {pk: _key(*values) for pk, *values in queryset.values_list('pk', *STATS_FIELDS)}
+
+
+def stats_deltas(before=(), after=()):
+    """
+    Counter changes for employees going from the ``before`` keys to the
+    ``after`` keys, as ``{(counter, company id, department id or month): delta}``.
+    None stands for an employee that did not or no longer exists.
+    """
+    counts = Counter()
+    for sign, keys in ((-1, before), (1, after)):
+        for key in keys:
+            if key is None:
+                continue
+            if key.is_active:
+                counts[(ACTIVE, key.company_id, None)] += sign
+                if key.department_id:
+                    counts[(DEPARTMENT, key.company_id, key.department_id)] += sign
+            if key.joined:
+                counts[(JOINERS, key.company_id, key.joined)] += sign
+            if key.left:
+                counts[(LEAVERS, key.company_id, key.left)] += sign
+    return {counter: delta for counter, delta in counts.items() if delta}
+
+
+def _by_delta(deltas):
+    """Group ``{(company id, key): delta}`` into ``{(delta, company id): [key, ...]}``."""
+    groups = defaultdict(list)
+    for (company_id, key), delta in deltas.items():
+        groups[(delta, company_id)].append(key)
+    return groups
+
+
+def apply_deltas(deltas):
+    """Add ``deltas`` from ``stats_deltas`` to the stored counters."""
+    if not deltas:
+        return
+    active = {}
+    headcounts = {}
+    monthly = defaultdict(lambda: [0, 0])
+    for (counter, company_id, key), delta in deltas.items():
+        if counter == ACTIVE:
+            active[(company_id, None)] = delta
+        elif counter == DEPARTMENT:
+            headcounts[(company_id, key)] = delta
+        else:
+            monthly[(company_id, key)][counter == LEAVERS] += delta
+
+    with transaction.atomic():
+        # Create the counters about to go up. Ones that only go down exist
+        # already, unless their company is being deleted along with them
+        CompanyStats.objects.bulk_create(
+            [CompanyStats(company_id=company_id) for (company_id, _), delta in active.items() if delta > 0],
+            ignore_conflicts=True,
+        )
+        DepartmentHeadcount.objects.bulk_create(
+            [DepartmentHeadcount(company_id=company_id, department_id=department_id)
+             for (company_id, department_id), delta in headcounts.items() if delta > 0],
+            ignore_conflicts=True,
+        )
+        MonthlyEmployeeStats.objects.bulk_create(
+            [MonthlyEmployeeStats(company_id=company_id, month=month)
+             for (company_id, month), (joiners, leavers) in monthly.items() if joiners > 0 or leavers > 0],
+            ignore_conflicts=True,
+        )
+
+        for (delta, company_id), _ in _by_delta(active).items():
+            CompanyStats.objects.filter(company_id=company_id).update(
+                active_employees=F('active_employees') + delta
+            )
+        for (delta, company_id), department_ids in _by_delta(headcounts).items():
+            DepartmentHeadcount.objects.filter(department_id__in=department_ids).update(
+                headcount=F('headcount') + delta
+            )
+        for ((joiners, leavers), company_id), months in _by_delta(
+            {key: tuple(delta) for key, delta in monthly.items()}
+        ).items():
+            MonthlyEmployeeStats.objects.filter(company_id=company_id, month__in=months).update(
+                joiners=F('joiners') + joiners, leavers=F('leavers') + leavers
+            )
+
+    if active:
+        # Cached companies show the active employee count
+        invalidate_companies(company_id for company_id, _ in active)
+
+
+def record_employee_changes(before=(), after=()):
+    """Update the statistics for employees going from ``before`` to ``after`` ``StatsKey``s."""
+    apply_deltas(stats_deltas(before, after))
+
+
+def _rebuild_batch(company_ids, **lookups):
+    """
+    Recompute the statistics of the companies ``company_ids`` in one
+    transaction. Queries select them with ``company_id__<lookup>=value`` for
+    each of ``lookups``.
+    """
+    employees = Employee.objects.filter(
+        **{f'current_company_id__{lookup}': value for lookup, value in lookups.items()}
+    ).order_by()
+    active = employees.filter(is_active=True)
+
+    with transaction.atomic():
+        for model in (CompanyStats, DepartmentHeadcount, MonthlyEmployeeStats):
+            model.objects.filter(**{f'company_id__{lookup}': value for lookup, value in lookups.items()}).delete()
+
+        counts = dict(active.values_list('current_company').annotate(count=Count('pk')))
+        CompanyStats.objects.bulk_create(
+            [CompanyStats(company_id=company_id, active_employees=counts.get(company_id, 0)) for company_id in company_ids],
+            batch_size=settings.BULK_UPLOAD_CHUNK_SIZE,
+        )
+        DepartmentHeadcount.objects.bulk_create(
+            [
+                DepartmentHeadcount(company_id=company_id, department_id=department_id, headcount=count)
+                for company_id, department_id, count in active.filter(current_department__isnull=False)
+                .values_list('current_company', 'current_department').annotate(count=Count('pk'))
+            ],
+            batch_size=settings.BULK_UPLOAD_CHUNK_SIZE,
+        )
+
+        monthly = defaultdict(lambda: [0, 0])
+        for index, field in enumerate(('date_joined', 'date_left')):
+            for company_id, month, count in (
+                employees.filter(**{f'{field}__isnull': False})
+                .annotate(month=TruncMonth(field)).values_list('current_company', 'month').annotate(count=Count('pk'))
+            ):
+                monthly[(company_id, month)][index] += count
+        MonthlyEmployeeStats.objects.bulk_create(
+            [
+                MonthlyEmployeeStats(company_id=company_id, month=month, joiners=joiners, leavers=leavers)
+                for (company_id, month), (joiners, leavers) in monthly.items()
+            ],
+            batch_size=settings.BULK_UPLOAD_CHUNK_SIZE,
+        )
+    invalidate_companies(company_ids)
+
+
+def rebuild_company_stats(company_ids=None):
+    """
+    Recompute the statistics of ``company_ids`` (every company by default)
+    from their employees and return the number of companies rebuilt.
+
+    Companies are rebuilt ``BULK_UPLOAD_CHUNK_SIZE`` at a time, each batch in
+    its own transaction. Rebuilding every company walks them in primary key
+    order and selects each batch by the range of its keys, so no statement
+    carries the ids.
+    """
+    batch_size = settings.BULK_UPLOAD_CHUNK_SIZE
+    rebuilt = 0
+    if company_ids is None:
+        companies = Company.objects.order_by('pk').values_list('pk', flat=True)
+        last = None
+        while True:
+            batch = list((companies if last is None else companies.filter(pk__gt=last))[:batch_size])
+            if not batch:
+                break
+            _rebuild_batch(batch, gte=batch[0], lte=batch[-1])
+            rebuilt += len(batch)
+            last = batch[-1]
+        return rebuilt
+
+    company_ids = list(dict.fromkeys(company_ids))
+    for start in range(0, len(company_ids), batch_size):
+        batch = company_ids[start:start + batch_size]
+        _rebuild_batch(batch, **{'in': batch})
+        rebuilt += len(batch)
+    return rebuilt
@@ -1,3 +1,587 @@
-from django.test import TestCase
+from cryptography.fernet import Fernet, InvalidToken
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from unittest import mock
+import base64
+import datetime
+import io
+import json
+import os
+import tempfile
+import uuid
 
-# Create your tests here.
+import pandas as pd
+
+from employees.ingest import EmployeeBulkUploader
+from employees.models import BulkUploadLog, Employee, EmployeeRole
+from users.models import User
+from employees.errors import UploadErrors
+from .encryption import DecryptionCache, LazyDecrypted, decrypt_value, encrypt_value, get_decryption_cache, reencrypt_value
+from .models import CacheVersion, Company, CompanyStats, Department, DepartmentHeadcount, MonthlyEmployeeStats
+from .departments import DepartmentResolver
+from .ingest import CompanyBulkUploader
+from .serializers import CompanySerializer
+from .stats import rebuild_company_stats
+
+OLD_KEY = Fernet.generate_key().decode()
+NEW_KEY = Fernet.generate_key().decode()
+
+
+def create_company(**kwargs):
+    values = dict(
+        name='Acme', registration_number='REG1', registration_date=datetime.date(2020, 1, 1),
+        address='1 Main St', number_of_employees=10, contact_person='Ann',
+        contact_phone='123', email_address='acme@example.com'
+    )
+    values.update(kwargs)
+    return Company.objects.create(**values)
+
+
+def stored_value(company, column):
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT {column} FROM companies_company WHERE id = %s', [company.pk.hex])
+        return cursor.fetchone()[0]
+
+
+class EncryptionTests(TestCase):
+    """Encrypted fields: storage formats, key ring and decryption cache."""
+
+    def test_token_format_drops_outer_base64(self):
+        with override_settings(ENCRYPTED_FIELD_FORMAT='token'):
+            token = encrypt_value('secret')
+        with override_settings(ENCRYPTED_FIELD_FORMAT='base64'):
+            wrapped = encrypt_value('secret')
+        self.assertTrue(token.startswith('gAAAAA'))
+        self.assertLess(len(token), len(wrapped))
+        self.assertEqual(decrypt_value(token), 'secret')
+        self.assertEqual(decrypt_value(wrapped), 'secret')
+
+    def test_old_keys_still_decrypt(self):
+        with override_settings(FERNET_KEYS=[OLD_KEY]):
+            ciphertext = encrypt_value('secret')
+        with override_settings(FERNET_KEYS=[NEW_KEY, OLD_KEY]):
+            self.assertEqual(decrypt_value(ciphertext), 'secret')
+
+    def test_cache_is_bounded_lru(self):
+        cache = DecryptionCache(2)
+        cache.set('a', '1')
+        cache.set('b', '2')
+        cache.get('a')
+        cache.set('c', '3')
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), ('1', None, '3'))
+
+    def test_cached_values_skip_decryption(self):
+        ciphertext = encrypt_value('secret')
+        get_decryption_cache().clear()
+        self.assertEqual(decrypt_value(ciphertext), 'secret')
+        self.assertEqual(get_decryption_cache().get(ciphertext), 'secret')
+
+    def test_rotate_encryption_keys(self):
+        with override_settings(FERNET_KEYS=[OLD_KEY], ENCRYPTED_FIELD_FORMAT='base64'):
+            company = create_company()
+        old_value = stored_value(company, 'contact_phone')
+
+        with override_settings(FERNET_KEYS=[NEW_KEY, OLD_KEY]):
+            call_command('rotate_encryption_keys', stdout=io.StringIO())
+        new_value = stored_value(company, 'contact_phone')
+        self.assertNotEqual(old_value, new_value)
+        self.assertTrue(new_value.startswith('gAAAAA'))
+
+        with override_settings(FERNET_KEYS=[NEW_KEY]):
+            get_decryption_cache().clear()
+            company = Company.objects.get(pk=company.pk)
+            self.assertEqual(company.contact_phone, '123')
+            self.assertEqual(company.registration_number, 'REG1')
+            self.assertTrue(base64.b64decode(old_value).startswith(b'gAAAAA'))
+
+    def test_rotation_keeps_undecryptable_values(self):
+        with override_settings(FERNET_KEYS=[OLD_KEY]):
+            company = create_company()
+        old_value = stored_value(company, 'contact_phone')
+        with override_settings(FERNET_KEYS=[NEW_KEY]):
+            out = io.StringIO()
+            with self.assertLogs('companies.management.commands.rotate_encryption_keys', 'ERROR'):
+                call_command('rotate_encryption_keys', stdout=out, stderr=io.StringIO())
+        self.assertEqual(stored_value(company, 'contact_phone'), old_value)
+        self.assertIn('1 unreadable', out.getvalue())
+
+    def test_rotation_does_not_overwrite_concurrent_edits(self):
+        with override_settings(FERNET_KEYS=[OLD_KEY]):
+            edited, other = create_company(), create_company(registration_number='REG2')
+        reencrypt = reencrypt_value
+        edits = []
+
+        def edit_while_rotating(ciphertext):
+            # Another request saves the row after the chunk has been read
+            if not edits:
+                edits.append(Company.objects.filter(pk=edited.pk).update(contact_phone='456'))
+            return reencrypt(ciphertext)
+
+        with override_settings(FERNET_KEYS=[NEW_KEY, OLD_KEY]):
+            with mock.patch('companies.management.commands.rotate_encryption_keys.reencrypt_value', edit_while_rotating):
+                out = io.StringIO()
+                call_command('rotate_encryption_keys', '--models', 'companies.Company', stdout=out)
+        self.assertIn('1 re-encrypted', out.getvalue())
+        with override_settings(FERNET_KEYS=[NEW_KEY]):
+            get_decryption_cache().clear()
+            self.assertEqual(Company.objects.get(pk=edited.pk).contact_phone, '456')
+            self.assertEqual(Company.objects.get(pk=other.pk).contact_phone, '123')
+
+    def test_rotation_dry_run_writes_nothing(self):
+        with override_settings(FERNET_KEYS=[OLD_KEY]):
+            company = create_company()
+        old_value = stored_value(company, 'contact_phone')
+        with override_settings(FERNET_KEYS=[NEW_KEY, OLD_KEY]):
+            out = io.StringIO()
+            call_command('rotate_encryption_keys', '--dry-run', stdout=out)
+        self.assertEqual(stored_value(company, 'contact_phone'), old_value)
+        self.assertIn('1 to re-encrypt', out.getvalue())
+
+    def test_rotation_resumes_from_checkpoint(self):
+        with override_settings(FERNET_KEYS=[OLD_KEY]):
+            companies = [create_company(registration_number=f'REG{i}') for i in range(3)]
+        companies.sort(key=lambda company: company.pk)
+        old_values = [stored_value(company, 'contact_phone') for company in companies]
+
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint = os.path.join(directory, 'rotation.json')
+            with open(checkpoint, 'w') as file:
+                json.dump({'companies.Company': str(companies[0].pk)}, file)
+            with override_settings(FERNET_KEYS=[NEW_KEY, OLD_KEY]):
+                call_command('rotate_encryption_keys', '--models', 'companies.Company', '--batch-size', '1',
+                             '--checkpoint', checkpoint, stdout=io.StringIO())
+            with open(checkpoint) as file:
+                self.assertEqual(json.load(file), {'companies.Company': str(companies[-1].pk)})
+
+        new_values = [stored_value(company, 'contact_phone') for company in companies]
+        self.assertEqual(new_values[0], old_values[0])
+        self.assertNotEqual(new_values[1], old_values[1])
+        self.assertNotEqual(new_values[2], old_values[2])
+
+
+    def test_registration_numbers_are_unique(self):
+        company = create_company()
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            create_company()
+
+        data = {'registration_number': 'REG1'}
+        self.assertTrue(CompanySerializer(company, data=data, partial=True).is_valid())
+        serializer = CompanySerializer(create_company(registration_number='REG2'), data=data, partial=True)
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('registration_number', serializer.errors)
+
+
+class LazyDecryptionTests(TestCase):
+    """Encrypted columns are decrypted on first use only."""
+
+    def setUp(self):
+        self.company = create_company()
+        get_decryption_cache().clear()
+
+    def test_values_decrypt_on_first_use(self):
+        company = Company.objects.get(pk=self.company.pk)
+        self.assertIsInstance(company.__dict__['contact_phone'], LazyDecrypted)
+        self.assertEqual(len(get_decryption_cache()), 0)
+        self.assertEqual(company.contact_phone, '123')
+        self.assertEqual(str(company.email_address), 'acme@example.com')
+        self.assertEqual(len(get_decryption_cache()), 2)
+
+    def test_unchanged_values_keep_their_ciphertext(self):
+        before = stored_value(self.company, 'contact_phone')
+        company = Company.objects.get(pk=self.company.pk)
+        company.name = 'Acme Ltd'
+        company.save()
+        self.assertEqual(stored_value(company, 'contact_phone'), before)
+        self.assertEqual(len(get_decryption_cache()), 0)
+
+        company.contact_phone = '456'
+        company.save()
+        self.assertNotEqual(stored_value(company, 'contact_phone'), before)
+        self.assertEqual(Company.objects.get(pk=company.pk).contact_phone, '456')
+
+    def test_undecryptable_values_read_as_none(self):
+        before = stored_value(self.company, 'contact_phone')
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(email='admin@example.com', password='pw', role='talent_verify'))
+        with override_settings(FERNET_KEYS=[NEW_KEY]):
+            company = Company.objects.get(pk=self.company.pk)
+            with self.assertLogs('companies.encryption', 'WARNING'):
+                self.assertIsNone(company.contact_phone)
+            self.assertEqual(company.name, 'Acme')
+            # Saving keeps the value for a key that can still decrypt it
+            company.save()
+            self.assertEqual(stored_value(company, 'contact_phone'), before)
+
+            with self.assertLogs('companies.encryption', 'WARNING'):
+                response = client.get(f'/api/companies/{company.pk}/')
+            self.assertEqual((response.status_code, response.data['contact_phone']), (200, None))
+            # Used directly, the value still raises
+            with self.assertRaises(InvalidToken):
+                str(Company.objects.values_list('contact_phone', flat=True).get())
+
+
+def stats_snapshot():
+    return (
+        sorted(CompanyStats.objects.values_list('company_id', 'active_employees')),
+        sorted(DepartmentHeadcount.objects.filter(headcount__gt=0).values_list('department_id', 'headcount')),
+        sorted(MonthlyEmployeeStats.objects.exclude(joiners=0, leavers=0).values_list('company_id', 'month', 'joiners', 'leavers')),
+    )
+
+
+class CompanyStatsTests(TestCase):
+    """Incrementally maintained company stats match a full recount."""
+
+    def setUp(self):
+        self.company = create_company()
+        self.sales = Department.objects.create(company=self.company, name='Sales')
+        self.support = Department.objects.create(company=self.company, name='Support')
+
+    def assertStatsMatchRecount(self):
+        incremental = stats_snapshot()
+        rebuild_company_stats()
+        self.assertEqual(incremental, stats_snapshot())
+
+    @override_settings(BULK_UPLOAD_CHUNK_SIZE=2)
+    def test_rebuild_runs_in_batches(self):
+        companies = [self.company] + [create_company(registration_number=f'REG-{i}') for i in range(4)]
+        for i, company in enumerate(companies):
+            Employee.objects.create(name=f'Emp {i}', current_company=company, date_joined=datetime.date(2023, 1, 15))
+        CompanyStats.objects.update(active_employees=99)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(rebuild_company_stats(), 5)
+        # Three batches, none of them passing the company ids to the deletes
+        deletes = [query['sql'] for query in queries if query['sql'].startswith('DELETE FROM "companies_companystats"')]
+        self.assertEqual(len(deletes), 3)
+        self.assertTrue(all(' IN ' not in sql for sql in deletes))
+        self.assertEqual(set(CompanyStats.objects.values_list('active_employees', flat=True)), {1})
+
+        self.assertEqual(rebuild_company_stats([companies[0].pk, companies[1].pk, companies[2].pk]), 3)
+        self.assertStatsMatchRecount()
+
+    def test_signals_keep_stats_in_sync(self):
+        ann = Employee.objects.create(
+            name='Ann', current_company=self.company, current_department=self.sales,
+            current_role='Rep', date_joined=datetime.date(2023, 1, 15)
+        )
+        bob = Employee.objects.create(
+            name='Bob', current_company=self.company, current_department=self.sales,
+            current_role='Rep', date_joined=datetime.date(2023, 2, 1)
+        )
+        EmployeeRole.objects.create(
+            employee=ann, company=self.company, department=self.support,
+            title='Lead', start_date=datetime.date(2024, 1, 1), duties=''
+        )
+        bob.date_left = datetime.date(2024, 3, 31)
+        bob.is_active = False
+        bob.save()
+
+        stats = self.company.monthly_stats.get(month=datetime.date(2024, 3, 1))
+        self.assertEqual((stats.joiners, stats.leavers), (0, 1))
+        self.assertEqual(CompanyStats.objects.get(company=self.company).active_employees, 1)
+        self.assertEqual(self.support.headcount.headcount, 1)
+        self.assertStatsMatchRecount()
+
+        ann.delete()
+        self.assertEqual(CompanyStats.objects.get(company=self.company).active_employees, 0)
+        self.assertStatsMatchRecount()
+
+    def test_bulk_upload_updates_stats_in_aggregate(self):
+        Employee.objects.create(
+            name='Ann', employee_id='E1', current_company=self.company, current_department=self.sales,
+            current_role='Rep', date_joined=datetime.date(2023, 1, 15)
+        )
+        df = pd.DataFrame({
+            'name': ['Ann', 'Bob', 'Cat'],
+            'employee_id': ['E1', 'E2', 'E3'],
+            'role': ['Lead', 'Rep', 'Rep'],
+            'department': ['Support', 'Sales', 'Sales'],
+            'date_started': ['2024-01-01', '2024-01-05', '2024-02-01'],
+            'date_left': [None, None, '2024-06-30'],
+            'duties': ['', '', ''],
+        })
+        EmployeeBulkUploader(self.company).process(df)
+
+        self.assertEqual(CompanyStats.objects.get(company=self.company).active_employees, 2)
+        self.assertEqual(self.company.monthly_stats.get(month=datetime.date(2024, 1, 1)).joiners, 1)
+        self.assertStatsMatchRecount()
+
+    def test_stats_endpoint(self):
+        Employee.objects.create(
+            name='Ann', current_company=self.company, current_department=self.sales,
+            current_role='Rep', date_joined=datetime.date(2023, 1, 15)
+        )
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(email='admin@example.com', password='pw', role='talent_verify'))
+
+        response = client.get(f'/api/companies/{self.company.pk}/stats/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['active_employees'], 1)
+        self.assertEqual([(d['name'], d['headcount']) for d in response.data['departments']], [('Sales', 1)])
+        self.assertEqual(response.data['monthly'], [{'month': '2023-01', 'joiners': 1, 'leavers': 0}])
+        response = client.get(f'/api/companies/{self.company.pk}/')
+        self.assertEqual(response.data['employees_count'], 1)
+
+
+def company_rows(count, start=0, **columns):
+    rows = {
+        'name': [f'Company {i}' for i in range(start, start + count)],
+        'registration_number': [f'REG-{i}' for i in range(start, start + count)],
+        'registration_date': ['2020-01-01'] * count,
+        'address': ['1 Main St'] * count,
+        'number_of_employees': ['10'] * count,
+        'contact_person': ['Ann'] * count,
+        'contact_phone': ['123'] * count,
+        'email_address': [f'company{i}@example.com' for i in range(start, start + count)],
+        'departments': ['Sales, Support, Sales'] * count,
+    }
+    rows.update(columns)
+    return pd.DataFrame(rows)
+
+
+class CompanyBulkUploadTests(TestCase):
+    """Company onboarding is set-based: its query count does not grow with the number of rows."""
+
+    def upload(self, df):
+        uploader = CompanyBulkUploader(UploadErrors())
+        with CaptureQueriesContext(connection) as context:
+            uploader.process(df)
+        return uploader, len(context.captured_queries)
+
+    def test_query_count_is_constant(self):
+        _, few = self.upload(company_rows(2))
+        _, many = self.upload(company_rows(20, start=2))
+        self.assertEqual(few, many)
+        self.assertEqual(Company.objects.count(), 22)
+        self.assertEqual(Department.objects.count(), 44)
+        self.assertEqual(User.objects.filter(role='company_user', company__isnull=False).count(), 22)
+
+    def test_existing_companies_and_emails_are_skipped(self):
+        create_company(registration_number='REG-0')
+        User.objects.create_user(email='company1@example.com', password='pw', role='company_user')
+        df = company_rows(3, registration_number=['REG-0', 'REG-1', 'REG-1'])
+        uploader, _ = self.upload(df)
+
+        self.assertEqual((uploader.created, uploader.users_created, uploader.skipped), (1, 0, 2))
+        self.assertEqual(uploader.report.by_code, {'duplicate': 3})
+        self.assertTrue(Company.objects.by_registration_number('REG-1').exists())
+
+    @override_settings(BULK_UPLOADS_ASYNC=False, MEDIA_ROOT=tempfile.mkdtemp())
+    def test_set_password_tokens_are_returned_but_not_stored(self):
+        admin = User.objects.create_user(email='admin@example.com', password='pw', role='talent_verify')
+        client = APIClient()
+        client.force_authenticate(admin)
+        content = company_rows(1).to_csv(index=False).encode()
+        response = client.post('/api/companies/bulk_upload/', {'file': SimpleUploadedFile('companies.csv', content)}, format='multipart')
+        self.assertEqual(response.status_code, 200, response.data)
+        [setup] = response.data['password_setup']
+        self.assertEqual(setup['email'], 'company0@example.com')
+        self.assertTrue(setup['token'])
+
+        upload_log = BulkUploadLog.objects.get()
+        self.assertEqual(upload_log.result['password_setup'], [{'email': setup['email'], 'uid': setup['uid']}])
+        response = client.get(f'/api/employees/uploads/{upload_log.pk}/')
+        self.assertNotIn(setup['token'], json.dumps(response.data, default=str))
+
+        # Only the uploader can have tokens issued again
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user(email='other@example.com', password='pw', role='talent_verify'))
+        response = other.post(f'/api/employees/uploads/{upload_log.pk}/password_setup/')
+        self.assertEqual(response.status_code, 403)
+
+        response = client.post(f'/api/employees/uploads/{upload_log.pk}/password_setup/')
+        [issued] = response.data['password_setup']
+        data = {'uid': issued['uid'], 'token': issued['token'], 'password': 'Str0ng-password!'}
+        self.assertEqual(APIClient().post('/api/users/set_password/', data, format='json').status_code, 200)
+        response = client.post(f'/api/employees/uploads/{upload_log.pk}/password_setup/')
+        self.assertEqual(response.data['password_setup'], [])
+
+
+class CompanyCacheTests(TestCase):
+    """Cached company representations, their invalidation and ETags."""
+
+    def setUp(self):
+        cache.clear()
+        self.company = create_company()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(email='admin@example.com', password='pw', role='talent_verify'))
+
+    def test_retrieve_etag(self):
+        url = f'/api/companies/{self.company.pk}/'
+        response = self.client.get(url)
+        etag = response['ETag']
+        # Only the company and its version are read
+        with self.assertNumQueries(2):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # Versions live in the database, so a process whose cache is empty sees the same ones
+        cache.clear()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.company.name = 'Acme Ltd'
+        self.company.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, response.data['name']), (200, 'Acme Ltd'))
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_reading_versions_writes_nothing(self):
+        versions = CacheVersion.objects.count()
+        missing = uuid.uuid4()
+        etag = f'"{missing}-0"'
+        response = self.client.get(f'/api/companies/{missing}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 404)
+        self.client.get(f'/api/companies/{self.company.pk}/')
+        self.client.get('/api/companies/')
+        self.assertEqual(CacheVersion.objects.count(), versions)
+
+    def test_list_is_served_from_cache_until_invalidated(self):
+        self.client.get('/api/companies/')
+        # Only the versions, the count and the page are queried, nothing is serialized again
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/companies/')
+        self.assertEqual(response.data['results'][0]['departments'], [])
+
+        Department.objects.create(company=self.company, name='Sales')
+        Employee.objects.create(name='Bea', employee_id='E1', current_company=self.company, date_joined=datetime.date(2020, 1, 1))
+        etag = response['ETag']
+        response = self.client.get('/api/companies/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        result = response.data['results'][0]
+        self.assertEqual(([department['name'] for department in result['departments']], result['employees_count']), (['Sales'], 1))
+
+
+class DepartmentSyncTests(TestCase):
+    """update_with_departments changes only the departments that differ."""
+
+    def setUp(self):
+        self.company = create_company()
+        self.sales = Department.objects.create(company=self.company, name='Sales')
+        self.support = Department.objects.create(company=self.company, name='Support')
+        self.legal = Department.objects.create(company=self.company, name='Legal')
+        self.employees = [
+            Employee.objects.create(
+                name=f'Emp {i}', current_company=self.company, current_department=department,
+                date_joined=datetime.date(2020, 1, 1)
+            )
+            for i, department in enumerate([self.sales, self.support, self.legal])
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(email='admin@example.com', password='pw', role='talent_verify'))
+
+    def sync(self, departments):
+        return self.client.patch(
+            f'/api/companies/{self.company.pk}/update_with_departments/', {'departments': departments}, format='json'
+        )
+
+    def test_departments_are_diffed(self):
+        response = self.sync(['Sales', {'id': str(self.support.pk), 'name': 'Customer Support'}, ' Finance ', ''])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([department['name'] for department in response.data['departments']], ['Sales', 'Customer Support', 'Finance'])
+        self.assertEqual(
+            sorted(self.company.departments.values_list('name', flat=True)), ['Customer Support', 'Finance', 'Sales']
+        )
+        # Kept and renamed departments keep their rows and employees; removed ones are deleted
+        self.assertEqual(Department.objects.get(name='Customer Support').pk, self.support.pk)
+        departments = [Employee.objects.get(pk=employee.pk).current_department_id for employee in self.employees]
+        self.assertEqual(departments, [self.sales.pk, self.support.pk, None])
+
+    def test_departments_can_swap_names(self):
+        response = self.sync([
+            {'id': str(self.sales.pk), 'name': 'Support'}, {'id': str(self.support.pk), 'name': 'Sales'}, 'Legal'
+        ])
+        self.assertEqual(response.status_code, 200, response.data)
+        self.sales.refresh_from_db()
+        self.support.refresh_from_db()
+        self.assertEqual((self.sales.name, self.support.name), ('Support', 'Sales'))
+
+    def test_case_variants_are_not_deleted_implicitly(self):
+        variant = Department.objects.create(company=self.company, name='SALES')
+        employee = Employee.objects.create(
+            name='Emp 3', current_company=self.company, current_department=variant, date_joined=datetime.date(2020, 1, 1)
+        )
+        response = self.sync(['Sales', 'Support', 'Legal'])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('departments', response.data)
+        self.assertTrue(Department.objects.filter(pk=variant.pk).exists())
+
+        # Listed by id, both are kept
+        response = self.sync([
+            {'id': str(self.sales.pk), 'name': 'Sales'}, {'id': str(variant.pk), 'name': 'SALES'}, 'Support', 'Legal'
+        ])
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(Employee.objects.get(pk=employee.pk).current_department_id, variant.pk)
+        self.assertEqual(self.company.departments.count(), 4)
+
+    def test_only_an_empty_list_removes_every_department(self):
+        for departments in (None, 'Sales', {'name': 'Sales'}):
+            response = self.sync(departments)
+            self.assertEqual(response.status_code, 400, departments)
+            self.assertEqual(self.company.departments.count(), 3)
+        self.assertEqual(self.sync([]).status_code, 200)
+        self.assertFalse(self.company.departments.exists())
+
+    def test_failed_sync_rolls_back_the_company(self):
+        with mock.patch('companies.views.sync_departments', side_effect=IntegrityError('department_company_name')):
+            response = self.client.patch(
+                f'/api/companies/{self.company.pk}/update_with_departments/',
+                {'company': {'address': '2 Side St'}, 'departments': ['Sales']}, format='json'
+            )
+        self.assertEqual(response.status_code, 400)
+        self.company.refresh_from_db()
+        self.assertEqual(str(self.company.address), '1 Main St')
+
+    def test_unchanged_departments_write_nothing(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.sync(['Sales', 'Support', 'Legal'])
+        writes = [query['sql'] for query in queries if query['sql'].startswith(('UPDATE', 'DELETE', 'INSERT'))]
+        # Only the company itself is saved, which invalidates its cached representation
+        self.assertEqual([sql for sql in writes if not ('companies_company"' in sql or 'companies_cacheversion' in sql)], [])
+
+    def test_names_match_regardless_of_case_and_spacing(self):
+        response = self.sync(['  sales', 'SUPPORT', 'Legal'])
+        self.assertEqual([department['id'] for department in response.data['departments']],
+                         [str(self.sales.pk), str(self.support.pk), str(self.legal.pk)])
+        # A different spelling renames the department in place
+        self.assertEqual(sorted(self.company.departments.values_list('name', flat=True)), ['Legal', 'SUPPORT', 'sales'])
+
+
+class DepartmentResolverTests(TestCase):
+    """Resolving department names in bulk."""
+
+    def setUp(self):
+        self.company = create_company()
+        self.sales = Department.objects.create(company=self.company, name='Sales')
+
+    def test_resolve_loads_once_and_creates_in_bulk(self):
+        resolver = DepartmentResolver()
+        names = [(self.company.pk, name) for name in ['Sales', ' sales ', 'Customer  Support', 'customer support', '']]
+        # Loading the company, creating the missing department, invalidating the
+        # company (creating and bumping its versions) and reading it back
+        with self.assertNumQueries(5):
+            departments = resolver.resolve(names)
+        self.assertEqual(departments[(self.company.pk, ' sales ')], self.sales)
+        self.assertEqual(departments[(self.company.pk, 'customer support')].name, 'Customer Support')
+        self.assertEqual(self.company.departments.count(), 2)
+        with self.assertNumQueries(0):
+            resolver.resolve(names)
+
+    def test_uploads_share_departments_by_normalized_name(self):
+        df = pd.DataFrame({
+            'name': ['Ann', 'Bob'],
+            'employee_id': ['E1', 'E2'],
+            'role': ['Rep', 'Rep'],
+            'department': ['SALES ', 'Field  Ops'],
+            'date_started': ['2024-01-01', '2024-01-01'],
+            'date_left': [None, None],
+            'duties': ['', ''],
+        })
+        EmployeeBulkUploader(self.company).process(df)
+        self.assertEqual(
+            dict(Employee.objects.values_list('name', 'current_department__name')), {'Ann': 'Sales', 'Bob': 'Field Ops'}
+        )
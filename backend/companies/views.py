@@ -1,19 +1,23 @@
 from rest_framework import viewsets, filters, status, permissions
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
 from django_filters.rest_framework import DjangoFilterBackend
-from django.db import transaction
+from django.db import IntegrityError, transaction
 from django.utils import timezone
-import pandas as pd
+from django.utils.cache import get_conditional_response
 import csv
-import io
 import logging
 
-from .models import Company, Department
-from employees.models import BulkUploadLog
+from .cache import company_etag, company_representations, list_etag
+from .departments import sync_departments
+from .models import Company
+from employees.exports import UnsupportedExportFormat, export_response
+from employees.mixins import BulkUploadJobMixin
 from .serializers import (
-    CompanySerializer, DepartmentSerializer
+    CompanySerializer, DepartmentSerializer,
+    DepartmentHeadcountSerializer, MonthlyEmployeeStatsSerializer
 )
 from users.models import User
 from users.serializers import UserSerializer
@@ -24,15 +28,34 @@ from users.permissions import (
 
 logger = logging.getLogger(__name__)
 
-class CompanyViewSet(viewsets.ModelViewSet):
+# Columns of company exports as (header, lookup) pairs
+COMPANY_EXPORT_COLUMNS = (
+    ('id', 'id'),
+    ('name', 'name'),
+    ('registration_number', 'registration_number'),
+    ('registration_date', 'registration_date'),
+    ('address', 'address'),
+    ('number_of_employees', 'number_of_employees'),
+    ('contact_person', 'contact_person'),
+    ('contact_phone', 'contact_phone'),
+    ('email_address', 'email_address'),
+    ('active_employees', 'stats__active_employees'),
+    ('created_at', 'created_at'),
+    ('updated_at', 'updated_at'),
+)
+
+class CompanyViewSet(BulkUploadJobMixin, viewsets.ModelViewSet):
     """API endpoint for companies."""
     
-    queryset = Company.objects.all()
+    # Stats back employees_count without a query per company
+    queryset = Company.objects.select_related('stats')
     serializer_class = CompanySerializer
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
     filterset_fields = ['name']
     search_fields = ['name', 'address', 'contact_person']
     ordering_fields = ['name', 'registration_date', 'created_at']
+    # Keyset used by ?cursor= pagination (see backend.pagination)
+    cursor_ordering = ('name', 'id')
     
     def get_permissions(self):
         """Get appropriate permissions for different actions."""
@@ -44,6 +67,42 @@ class CompanyViewSet(viewsets.ModelViewSet):
             permission_classes = [permissions.IsAuthenticated, IsCompanyUserOrTalentVerify]
         return [permission() for permission in permission_classes]
     
+    def list(self, request, *args, **kwargs):
+        """
+        List companies. Serialized companies come from the company cache, and
+        a request whose If-None-Match holds the list's ETag gets a 304 after
+        only reading the list's version (see companies.cache).
+        """
+        etag = list_etag(request)
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+        
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            response = self.get_paginated_response(company_representations(page))
+        else:
+            response = Response(company_representations(queryset))
+        response['ETag'] = etag
+        return response
+    
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Retrieve a company from the company cache, with an ETag like ``list``.
+        The company is looked up and permissions are checked before the ETag
+        is compared, so a 304 is only ever given for a visible company.
+        """
+        company = self.get_object()
+        etag = company_etag(company.pk)
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+        
+        response = Response(company_representations([company])[0])
+        response['ETag'] = etag
+        return response
+    
     @action(detail=False, methods=['post'])
     def create_user_and_company(self, request):
         """
@@ -130,253 +189,68 @@ class CompanyViewSet(viewsets.ModelViewSet):
         Optional columns:
         - departments: Comma-separated list of department names
         - user_email: Email for company user (if not provided, will be derived from company email)
-        - user_password: Password for company user (if not provided, a random one will be generated)
+        - user_password: Password for company user (if not provided, a set-password token is returned
+          with a synchronous result, or issued by POST /api/employees/uploads/{id}/password_setup/)
         - user_first_name: First name for company user (if not provided, will use contact person name)
         - user_last_name: Last name for company user (if not provided, will be derived from contact person)
         """
-        if 'file' not in request.FILES:
-            return Response({'error': 'No file provided'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        file = request.FILES['file']
-        
-        # Log the upload
-        upload_log = BulkUploadLog.objects.create(
-            user=request.user,
-            file_name=file.name,
-            file_size=file.size,
-            upload_type='company_with_user'
-        )
-        
-        try:
-            # Determine file type and read
-            if file.name.endswith('.csv'):
-                df = pd.read_csv(file)
-            elif file.name.endswith(('.xls', '.xlsx')):
-                df = pd.read_excel(file)
-            elif file.name.endswith('.txt'):
-                # Assuming tab-separated or comma-separated values
-                try:
-                    df = pd.read_csv(file, sep='\t')  # First try tab-separated
-                except:
-                    df = pd.read_csv(file)  # Fall back to comma-separated
-            else:
-                upload_log.mark_failed('Unsupported file type')
-                return Response(
-                    {'error': 'Unsupported file type. Please upload CSV, TXT or Excel file.'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            
-            # Process data
-            companies_created = 0
-            users_created = 0
-            skipped_existing = 0
-            errors = 0
-            error_details = []
-            
-            # Get all companies first (since we can't filter by encrypted fields directly)
-            all_companies = list(Company.objects.all())
-            # Create a mapping of registration number to company for easy lookup
-            existing_reg_numbers = {comp.registration_number for comp in all_companies}
-            # Also check for existing emails to avoid duplicate users
-            from users.models import User
-            existing_emails = set(User.objects.values_list('email', flat=True))
-            
-            # Helper function to generate a random password
-            def generate_password():
-                import string
-                import random
-                chars = string.ascii_letters + string.digits + "!@#$%^&*()"
-                return ''.join(random.choice(chars) for _ in range(12))
-            
-            # Helper function to split name into first name and last name
-            # def split_name(full_name):
-            #     parts = full_name.split(maxsplit=1)
-            #     if len(parts) == 1:
-            #         return parts[0], ""
-            #     return parts[0], parts[1]
-            
-            for index, row in df.iterrows():
-                try:
-                    with transaction.atomic():
-                        registration_number = row['registration_number'].strip() if isinstance(row['registration_number'], str) else row['registration_number']
-                        
-                        # Check if company already exists
-                        if registration_number in existing_reg_numbers:
-                            skipped_existing += 1
-                            error_details.append(f"Row {index+1}: Company with registration number '{registration_number}' already exists. Use bulk_edit to update existing companies.")
-                            continue
-                        
-                        # Create new company
-                        company = Company.objects.create(
-                            name=row['name'],
-                            registration_number=registration_number,
-                            registration_date=pd.to_datetime(row['registration_date']).date(),
-                            address=row['address'],
-                            number_of_employees=int(row['number_of_employees']),
-                            contact_person=row['contact_person'],
-                            contact_phone=row['contact_phone'],
-                            email_address=row['email_address']
-                        )
-                        companies_created += 1
-                        
-                        # Add this new registration number to our set so we don't create duplicates within the same upload
-                        existing_reg_numbers.add(registration_number)
-                        
-                        # Process departments if included
-                        if 'departments' in row and pd.notna(row['departments']):
-                            departments = str(row['departments']).split(',')
-                            for dept_name in departments:
-                                dept_name = dept_name.strip()
-                                if dept_name:  # Only create non-empty department names
-                                    Department.objects.create(company=company, name=dept_name)
-                        
-                        # Create company user
-                        # Determine user email - use specified user_email or derive from company email
-                        user_email = row.get('user_email') if pd.notna(row.get('user_email', '')) else row['email_address']
-                        
-                        # Check if a user with this email already exists
-                        if user_email in existing_emails:
-                            error_details.append(f"Row {index+1}: User with email '{user_email}' already exists. Company created but no user was created.")
-                            continue
-                        
-                        # Add to existing_emails to prevent duplicates within same upload
-                        existing_emails.add(user_email)
-                        
-                        # Determine user name
-                        # if pd.notna(row.get('user_first_name', '')) and pd.notna(row.get('user_last_name', '')):
-                        #     first_name = row['user_first_name']
-                        #     last_name = row['user_last_name']
-                        # else:
-                            # Use contact person name or default value
-                            # first_name, last_name = split_name(row['contact_person'])
-                        
-                        # Determine password
-                        password = row.get('user_password') if pd.notna(row.get('user_password', '')) else generate_password()
-                        
-                        # Create user
-                        from users.models import User
-                        user = User.objects.create_user(
-                            email=user_email,
-                            password=password,
-                            # first_name=first_name,
-                            # last_name=last_name,
-                            role='company_user',  # Set role to company_user
-                            # Add any other required fields
-                        )
-                        users_created += 1
-                    
-                        user.company = company
-                        user.save()
-                except Exception as e:
-                    errors += 1
-                    error_details.append(f"Error in row {index+1}: {str(e)}")
-                    logger.error(f"Error processing company row {index+1}: {str(e)}")
-            
-            # Update log with results
-            upload_log.mark_completed(
-                records_processed=len(df),
-                records_created=companies_created,
-                records_updated=0,  # No updates in this endpoint
-                errors=errors,
-                error_details='\n'.join(error_details) if error_details else None
-            )
-            
-            return Response({
-                'success': True,
-                'processed': len(df),
-                'companies_created': companies_created,
-                'users_created': users_created,
-                'skipped_existing': skipped_existing,
-                'errors': errors,
-                'details': 'File processed successfully',
-                'error_details': error_details
-            })
-            
-        except Exception as e:
-            upload_log.mark_failed(str(e))
-            logger.error(f"Bulk company upload failed: {str(e)}")
-            return Response(
-                {'error': f'Failed to process file: {str(e)}'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        return self.submit_upload(request, 'company_with_user')
     
     @action(detail=False, methods=['post'], parser_classes=[MultiPartParser, FormParser])
     def bulk_edit(self, request):
-        if 'file' not in request.FILES:
-            return Response({'error': 'No file provided'}, status=status.HTTP_400_BAD_REQUEST)
+        """
+        Bulk edit existing companies from CSV, Excel or text file.
+        
+        Required columns:
+        - registration_number: Identifies the company to update
+        
+        Optional columns:
+        - name, number_of_employees, contact_person, contact_phone, email_address
         
-        file = request.FILES['file']
-        companies_updated = 0
-        errors = 0
-        error_details = []
+        With ?dry_run=1 nothing is changed: the changes are stored as a plan
+        that can be reviewed and applied under /api/employees/plans/.
+        """
+        return self.submit_upload(request, 'company_edit', allow_dry_run=True)
+        
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        Export companies as a CSV file, or XLSX with ?file_format=xlsx.
         
+        Takes the same filter, search and ordering parameters as the list.
+        Company users only export their own company. The rows are streamed,
+        so any number can be exported.
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        if request.user.role == 'company_user':
+            queryset = queryset.filter(pk=request.user.company_id)
         try:
-            # Read the CSV file
-            content = file.read().decode('utf-8-sig')  # Handle BOM if present
-            df = pd.read_csv(io.StringIO(content))
-            
-            # Clean registration numbers
-            df['registration_number'] = df['registration_number'].str.strip()
-            
-            # Get all companies first (since we can't filter by encrypted fields directly)
-            all_companies = list(Company.objects.all())
-            # Create a mapping of registration number to company
-            # We need to decrypt the registration numbers from the database
-            reg_to_company = {comp.registration_number: comp for comp in all_companies}
-            
-            for index, row in df.iterrows():
-                try:
-                    reg_number = row['registration_number']
-                    logger.info(f"Processing registration number: '{reg_number}'")
-                    
-                    # Look up company by reg number in our mapping
-                    company = reg_to_company.get(reg_number)
-                    
-                    if company:
-                        logger.info(f"Found company: {company.name}")
-                        
-                        # Update fields if present
-                        if 'name' in row and pd.notna(row['name']):
-                            company.name = row['name']
-                        if 'number_of_employees' in row and pd.notna(row['number_of_employees']):
-                            company.number_of_employees = int(row['number_of_employees'])
-                        if 'contact_person' in row and pd.notna(row['contact_person']):
-                            company.contact_person = row['contact_person']
-                        if 'contact_phone' in row and pd.notna(row['contact_phone']):
-                            company.contact_phone = row['contact_phone']
-                        if 'email_address' in row and pd.notna(row['email_address']):
-                            company.email_address = row['email_address']
-                        
-                        company.save()
-                        companies_updated += 1
-                    else:
-                        errors += 1
-                        # Only show available registration numbers in plain text
-                        all_regs = list(reg_to_company.keys())
-                        error_details.append(
-                            f"Company with registration number '{reg_number}' not found. "
-                            f"Available registration numbers: {all_regs}"
-                        )
-                        
-                except Exception as e:
-                    errors += 1
-                    error_details.append(f"Error in row {index+1}: {str(e)}")
-                    logger.error(f"Error processing row {index+1}: {str(e)}")
-            
-            return Response({
-                'success': True,
-                'processed': len(df),
-                'updated': companies_updated,
-                'errors': errors,
-                'error_details': error_details
-            })
-            
-        except Exception as e:
-            logger.error(f"Bulk edit failed: {str(e)}")
-            return Response({
-                'error': f'Failed to process file: {str(e)}'
-            }, status=status.HTTP_400_BAD_REQUEST)
+            return export_response(
+                queryset, COMPANY_EXPORT_COLUMNS, 'companies', request.query_params.get('file_format', 'csv')
+            )
+        except UnsupportedExportFormat as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    @action(detail=True, methods=['get'])
+    def stats(self, request, pk=None):
+        """
+        Employee statistics of a company: active employees, active headcount
+        per department and joiners/leavers per month.
         
+        These are read from counters kept up to date as employees change
+        (see companies.stats), so nothing is aggregated per request.
+        """
+        company = self.get_object()
+        stats = getattr(company, 'stats', None)
+        departments = company.department_headcounts.filter(headcount__gt=0).select_related('department').order_by('department__name')
+        months = company.monthly_stats.exclude(joiners=0, leavers=0)
+        return Response({
+            'company': company.id,
+            'active_employees': stats.active_employees if stats else 0,
+            'departments': DepartmentHeadcountSerializer(departments, many=True).data,
+            'monthly': MonthlyEmployeeStatsSerializer(months, many=True).data,
+        })
+    
     @action(detail=True, methods=['put', 'patch'])
     def update_with_departments(self, request, pk=None):
         """
@@ -384,8 +258,15 @@ class CompanyViewSet(viewsets.ModelViewSet):
         """
         company = self.get_object()
         
-        with transaction.atomic():
-            try:
+        departments = request.data.get('departments')
+        if 'departments' in request.data and not isinstance(departments, list):
+            # Only an explicit [] removes every department
+            raise ValidationError({'departments': ['Expected a list of departments.']})
+        
+        # Errors propagate out of the transaction, so that a failed department
+        # sync also rolls back the company changes. Validation errors answer 400.
+        try:
+            with transaction.atomic():
                 # Update company basic info
                 company_data = request.data.get('company', request.data)
                 company_serializer = CompanySerializer(company, data=company_data, partial=True)
@@ -393,44 +274,24 @@ class CompanyViewSet(viewsets.ModelViewSet):
                 company = company_serializer.save()
                 
                 # Handle departments if provided
-                if 'departments' in request.data:
-                    departments_data = request.data.get('departments', [])
-                    
-                    # Delete existing departments for this company
-                    Department.objects.filter(company=company).delete()
-                    
-                    # Create new departments
-                    departments = []
-                    for dept_data in departments_data:
-                        if isinstance(dept_data, dict):
-                            dept_name = dept_data.get('name', '').strip()
-                        else:
-                            dept_name = str(dept_data).strip()
-                        
-                        if dept_name:  # Only create if name is not empty
-                            dept_data_formatted = {
-                                'name': dept_name,
-                                'company': company.id
-                            }
-                            dept_serializer = DepartmentSerializer(data=dept_data_formatted)
-                            dept_serializer.is_valid(raise_exception=True)
-                            department = dept_serializer.save()
-                            departments.append(department)
+                if departments is not None:
+                    # Only departments that were added, renamed or removed are written
+                    departments = sync_departments(company, departments)
                 
                 # Prepare response
                 response_data = {
                     'company': company_serializer.data,
-                    'departments': DepartmentSerializer(departments, many=True).data if 'departments' in request.data else []
+                    'departments': DepartmentSerializer(departments, many=True).data if departments is not None else []
                 }
                 
                 return Response(response_data, status=status.HTTP_200_OK)
                 
-            except Exception as e:
-                logger.error(f"Error updating company with departments: {str(e)}")
-                return Response(
-                    {'error': f"Failed to update company: {str(e)}"},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
+        except IntegrityError as e:
+            logger.error(f"Error updating company with departments: {str(e)}")
+            return Response(
+                {'error': 'Failed to update company: it conflicts with existing data.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
 
             
@@ -16,6 +16,7 @@ class EmployeeAdmin(admin.ModelAdmin):
     """Admin for Employee model."""
     list_display = ('name', 'employee_id', 'current_company', 'current_department', 
                     'current_role', 'date_joined', 'is_active', 'created_at')
+    list_select_related = ('current_company', 'current_department__company')
     list_filter = ('is_active', 'current_company', 'current_department', 'date_joined')
     search_fields = ('name', 'employee_id', 'current_role')
     readonly_fields = ('created_at', 'updated_at')
@@ -67,8 +68,9 @@ class BulkUploadLogAdmin(admin.ModelAdmin):
     list_filter = ('status', 'upload_type', 'created_at')
     search_fields = ('file_name', 'user__email')
     readonly_fields = ('id', 'user', 'file_name', 'file_size', 'upload_type',
-                      'records_processed', 'records_created', 'records_updated',
-                      'errors', 'error_details', 'status', 'created_at', 'completed_at',
+                      'records_total', 'records_processed', 'records_created', 'records_updated',
+                      'errors', 'error_details', 'status', 'worker', 'attempts',
+                      'created_at', 'started_at', 'heartbeat_at', 'completed_at',
                       'formatted_error_details')
     
     def has_add_permission(self, request):
@@ -92,10 +94,10 @@ class BulkUploadLogAdmin(admin.ModelAdmin):
             'fields': ('id', 'file_name', 'file_size', 'upload_type', 'user')
         }),
         ('Status', {
-            'fields': ('status', 'created_at', 'completed_at')
+            'fields': ('status', 'worker', 'attempts', 'created_at', 'started_at', 'heartbeat_at', 'completed_at')
         }),
         ('Results', {
-            'fields': ('records_processed', 'records_created', 'records_updated', 'errors')
+            'fields': ('records_total', 'records_processed', 'records_created', 'records_updated', 'errors')
         }),
         ('Error Details', {
             'fields': ('formatted_error_details',),
@@ -0,0 +1,115 @@
+"""
+Serializer-driven eager loading.
+
+``eager_load(queryset, SerializerClass)`` inspects the serializer's declared
+fields and applies the ``select_related``/``Prefetch`` calls needed to render
+it, so the number of queries per page stays constant instead of growing with
+the number of rows (and nested roles) on the page.
+
+- Dotted sources such as ``current_company.name`` select the forward
+  foreign keys along the path.
+- Nested ``many=True`` serializers become a ``Prefetch`` whose queryset is
+  itself eager loaded for the child serializer.
+- Nested single serializers are selected and their own relations followed.
+- Encrypted columns of a selected model that the serializer never reads are
+  deferred, so they are neither fetched nor decrypted.
+"""
+from functools import lru_cache
+
+from django.db.models import Prefetch
+from rest_framework import serializers
+
+from companies.encryption import EncryptedField
+
+
+def _forward_relation(model, name):
+    """Return the related model if ``name`` is a forward FK/one-to-one on ``model``."""
+    try:
+        field = model._meta.get_field(name)
+    except Exception:
+        return None
+    if field.is_relation and field.concrete and (field.many_to_one or field.one_to_one):
+        return field.related_model
+    return None
+
+
+@lru_cache(maxsize=None)
+def _plan(serializer_class):
+    """
+    Work out the relations ``serializer_class`` reads.
+
+    Returns ``(select_related paths, prefetches, deferred fields)`` where each
+    prefetch is ``(lookup, child model, child serializer class)``.
+    """
+    model = serializer_class.Meta.model
+    select = set()
+    prefetch = []
+    defer = []
+    # Attributes read from each selected model, or None if it is rendered in full
+    related = {}
+
+    for field in serializer_class().fields.values():
+        if field.write_only or field.source == '*':
+            continue
+        path = field.source_attrs
+
+        if isinstance(field, serializers.ListSerializer):
+            child = field.child
+            if isinstance(child, serializers.ModelSerializer):
+                prefetch.append(('__'.join(path), child.Meta.model, type(child)))
+            continue
+
+        # Follow forward foreign keys along the source path
+        current = model
+        walked = []
+        # The last attribute of a plain field is the value itself, not a relation to load
+        attrs = path if isinstance(field, serializers.ModelSerializer) else path[:-1]
+        for attr in attrs:
+            current = _forward_relation(current, attr)
+            if current is None:
+                break
+            walked.append(attr)
+            select.add('__'.join(walked))
+        if current is None or not walked:
+            continue
+        prefix = '__'.join(walked)
+
+        if isinstance(field, serializers.ModelSerializer):
+            related[prefix] = None
+            child_select, child_prefetch, child_defer = _plan(type(field))
+            select.update(f"{prefix}__{child_path}" for child_path in child_select)
+            prefetch.extend(
+                (f"{prefix}__{lookup}", child_model, child_class)
+                for lookup, child_model, child_class in child_prefetch
+            )
+            defer.extend(f"{prefix}__{name}" for name in child_defer)
+        elif related.get(prefix, set()) is not None:
+            related.setdefault(prefix, set()).add(path[-1])
+
+    for prefix, attributes in related.items():
+        if attributes is None:
+            continue
+        related_model = model
+        for attr in prefix.split('__'):
+            related_model = _forward_relation(related_model, attr)
+        defer.extend(
+            f"{prefix}__{field.name}" for field in related_model._meta.concrete_fields
+            if isinstance(field, EncryptedField) and field.name not in attributes
+        )
+
+    return tuple(sorted(select)), tuple(prefetch), tuple(sorted(defer))
+
+
+def eager_load(queryset, serializer_class):
+    """Apply the eager loading ``serializer_class`` needs to ``queryset``."""
+    select, prefetch, defer = _plan(serializer_class)
+    if select:
+        queryset = queryset.select_related(*select)
+    if defer:
+        queryset = queryset.defer(*defer)
+    if prefetch:
+        queryset = queryset.prefetch_related(*[
+            Prefetch(lookup, queryset=eager_load(child_model._default_manager.all(), child_class))
+            for lookup, child_model, child_class in prefetch
+        ])
+    return queryset
@@ -0,0 +1,70 @@
+"""
+Bounded error reporting for bulk upload jobs.
+
+Every error or warning a job reports is stored as a ``BulkUploadError`` row,
+written with ``bulk_create`` once per chunk. Only the first
+``BULK_UPLOAD_ERROR_SUMMARY_SIZE`` messages are kept in memory for the inline
+summary returned with the job result, together with counts per error code, so
+a file where every row fails costs the same memory as one with a few errors.
+"""
+from collections import Counter
+
+from django.conf import settings
+
+from .models import BulkUploadError
+
+
+class UploadErrors:
+    """
+    Errors and warnings of one upload job.
+
+    ``errors`` counts the entries added as errors; ``total`` also includes
+    warnings, such as rows skipped because their data already exists.
+    Without an ``upload_log`` nothing is stored.
+    """
+
+    def __init__(self, upload_log=None, summary_size=None):
+        self.upload_log = upload_log
+        self.summary_size = settings.BULK_UPLOAD_ERROR_SUMMARY_SIZE if summary_size is None else summary_size
+        self.errors = 0
+        self.total = 0
+        self.by_code = Counter()
+        self.first = []
+        self._pending = []
+        if upload_log is not None:
+            # A job that is run again after its worker stopped starts over
+            upload_log.error_records.all().delete()
+
+    def add(self, row, message, code=BulkUploadError.FAILED, warning=False):
+        """Record ``message`` for file row ``row`` (None if it is not about one row)."""
+        self.total += 1
+        if not warning:
+            self.errors += 1
+        self.by_code[code] += 1
+        if len(self.first) < self.summary_size:
+            self.first.append(message)
+        if self.upload_log is not None:
+            self._pending.append(BulkUploadError(upload_log=self.upload_log, row=row, code=code, message=message))
+
+    def flush(self):
+        """Write the entries added since the last flush."""
+        if self._pending:
+            BulkUploadError.objects.bulk_create(self._pending, batch_size=settings.BULK_UPLOAD_CHUNK_SIZE)
+            self._pending = []
+
+    @property
+    def summary(self):
+        return {
+            'total': self.total,
+            'by_code': dict(self.by_code),
+            'truncated': self.total > len(self.first),
+        }
+
+    def as_text(self):
+        """Capped text for ``BulkUploadLog.error_details``, or None without entries."""
+        if not self.total:
+            return None
+        text = '\n'.join(self.first)
+        if self.total > len(self.first):
+            text += f"\n... and {self.total - len(self.first)} more"
+        return text
@@ -0,0 +1,60 @@
+"""
+Date range filters for employee search.
+
+Date parameters name a year (``2020``), a month (``2020-03``) or a day
+(``2020-03-15``). ``parse_period`` turns each into the half-open range of days
+it covers, and the conditions below compare the bare date columns against its
+bounds (``date >= start``, ``date < end``) so the date indexes can be used.
+Conditions on role history use a subquery on the role table rather than a
+join, so matching employees are not repeated and need no ``distinct()``.
+"""
+from collections import namedtuple
+from datetime import date, timedelta
+import re
+
+from django.db.models import Q
+from django.utils.dateparse import parse_date
+
+from .models import EmployeeRole
+
+Period = namedtuple('Period', ['start', 'end'])  # Days ``start <= day < end``
+
+YEAR_RE = re.compile(r'^(\d{4})$')
+MONTH_RE = re.compile(r'^(\d{4})-(\d{1,2})$')
+
+
+def parse_period(value):
+    """The ``Period`` a year, month or date string covers, or None if it is not one."""
+    value = str(value or '').strip()
+    try:
+        if match := YEAR_RE.match(value):
+            year = int(match.group(1))
+            return Period(date(year, 1, 1), date(year + 1, 1, 1))
+        if match := MONTH_RE.match(value):
+            year, month = int(match.group(1)), int(match.group(2))
+            start = date(year, month, 1)
+            return Period(start, date(year + month // 12, month % 12 + 1, 1))
+        day = parse_date(value)
+    except ValueError:
+        return None
+    return Period(day, day + timedelta(days=1)) if day else None
+
+
+def _roles(**lookups):
+    return Q(pk__in=EmployeeRole.objects.filter(**lookups).values('employee_id'))
+
+
+def started_from(period, history=False):
+    """Employees who joined during ``period`` or later, or started a role then if ``history``."""
+    condition = Q(date_joined__gte=period.start)
+    if history:
+        condition |= _roles(start_date__gte=period.start)
+    return condition
+
+
+def ended_by(period, history=False):
+    """Employees who left during ``period`` or earlier, or ended a role then if ``history``."""
+    condition = Q(date_left__lt=period.end)
+    if history:
+        condition |= _roles(end_date__lt=period.end)
+    return condition
@@ -0,0 +1,598 @@
+"""
+Set-based ingestion pipeline for employee bulk uploads.
+
+Rows are processed in chunks. For each chunk the departments and existing
+employees it references are resolved with a few set queries, the whole chunk
+is planned in memory, and the result is written with bulk_create/bulk_update
+inside a single transaction. If writing a chunk fails, its rows are retried one
+at a time so errors are still reported against the row that caused them.
+"""
+from collections import namedtuple
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from companies.encryption import blind_index
+from companies.departments import DepartmentResolver, department_key
+from companies.stats import record_employee_changes, stats_key
+from .jobs import UploadFileError, upload_chunks
+from .errors import UploadErrors
+from .models import BulkUploadError, Employee, EmployeeRole
+from .plans import CREATE_DEPARTMENT, END_ROLE, START_ROLE, UPDATE, BulkEditor, PlanConflict, PlannedChange
+from .roles import RoleTransition, transition_roles
+from .schema import Column, UploadSchema
+from .search import rebuild_search_documents
+
+logger = logging.getLogger(__name__)
+
+UploadRow = namedtuple('UploadRow', [
+    'number', 'name', 'employee_id', 'role', 'department',
+    'date_started', 'date_left', 'duties',
+])
+
+
+# Columns of ``employee`` uploads, as documented on ``EmployeeViewSet.bulk_upload``
+EMPLOYEE_UPLOAD_SCHEMA = UploadSchema(
+    Column('name', required=True),
+    Column('employee_id'),
+    Column('role', required=True),
+    Column('department'),
+    Column('date_started', 'date', required=True),
+    Column('date_left', 'date'),
+    Column('duties'),
+)
+
+# Columns of ``employee_edit`` uploads, as documented on ``EmployeeViewSet.bulk_edit``
+EMPLOYEE_EDIT_SCHEMA = UploadSchema(
+    Column('employee_id', required=True),
+    Column('name'),
+    Column('department'),
+    Column('role'),
+    Column('start_date', 'date'),
+    Column('duties'),
+    Column('date_left', 'date'),
+    Column('is_active', 'bool'),
+)
+
+
+class _Batch:
+    """In-memory plan for one chunk of rows, merged into the uploader on commit."""
+
+    def __init__(self):
+        self.created = 0
+        self.updated = 0
+        self.skipped = 0
+        self.errors = []  # (row, message, code) tuples, reported once the batch is committed
+        self.departments = {}
+        self.new_employees = []
+        self.touched_employees = {}
+        self.previous_stats = {}  # What touched employees added to the company stats before the batch
+        self.replaced_current_roles = set()
+        self.roles = []
+
+
+class EmployeeBulkUploader:
+    """
+    Ingest employee upload rows for a single company.
+
+    Departments and employees resolved by earlier chunks are cached, so each
+    chunk only queries for names and IDs it has not seen before.
+    """
+
+    def __init__(self, company, chunk_size=None, progress=None, report=None):
+        self.company = company
+        self.chunk_size = chunk_size or settings.BULK_UPLOAD_CHUNK_SIZE
+        self.progress = progress
+        self.report = report or UploadErrors()
+        self.processed = 0
+        self.created = 0
+        self.updated = 0
+        self.skipped = 0
+        self.departments = DepartmentResolver()
+        self._employees_by_index = {}
+        self._employees_by_name = {}
+
+    def process(self, df):
+        """Process every row of ``df`` in chunks of ``chunk_size`` rows."""
+        for start in range(0, len(df), self.chunk_size):
+            self._process_chunk(df.iloc[start:start + self.chunk_size])
+            if self.progress:
+                self.progress(self.processed, self.created, self.updated, self.errors)
+
+    @property
+    def errors(self):
+        return self.report.errors
+
+    def _add_error(self, number, message, code=BulkUploadError.FAILED, batch=None):
+        if batch is not None:
+            batch.errors.append((number, message, code))
+            return
+        self.report.add(number, f"Error in row {number}: {message}", code)
+        logger.error(f"Error processing employee row {number}: {message}")
+
+    def _prepare(self, df):
+        """Validate a chunk column-wise and return its valid rows as ``UploadRow`` tuples."""
+        if not self.company:
+            for index in df.index:
+                self._add_error(index + 1, "Company user is required for bulk upload", BulkUploadError.PERMISSION_DENIED)
+            return []
+
+        clean, invalid = EMPLOYEE_UPLOAD_SCHEMA.validate(df)
+        for number, code, message in invalid.itertuples(index=False):
+            self._add_error(number, message, code)
+        clean['duties'] = clean['duties'].fillna('')
+        return [UploadRow._make(row) for row in clean[list(UploadRow._fields[1:])].itertuples()]
+
+    def _process_chunk(self, df):
+        self.processed += len(df)
+        rows = self._prepare(df)
+        if not rows:
+            return
+        try:
+            self._commit(rows)
+        except Exception:
+            # Isolate the failing row(s) by retrying each one on its own
+            for row in rows:
+                try:
+                    self._commit([row])
+                except Exception as e:
+                    self._add_error(row.number, str(e))
+
+    def _commit(self, rows):
+        """Plan and write ``rows`` in one transaction, then merge the result."""
+        batch = _Batch()
+        try:
+            with transaction.atomic():
+                self._plan(rows, batch)
+                self._write(batch)
+        except Exception:
+            # Cached employees may carry in-memory changes that were rolled back
+            self._forget(batch.touched_employees.values())
+            self._forget(batch.new_employees)
+            # and departments created in the batch no longer exist
+            self.departments.forget(batch.departments.values())
+            raise
+
+        self.created += batch.created
+        self.updated += batch.updated
+        self.skipped += batch.skipped
+        for error in batch.errors:
+            self._add_error(*error)
+
+    def _forget(self, employees):
+        for employee in employees:
+            self._employees_by_index.pop(employee.employee_id_index, None)
+            self._employees_by_name.pop(employee.name, None)
+
+    def _resolve_employees(self, rows):
+        indexes = {blind_index(row.employee_id) for row in rows if row.employee_id}
+        indexes -= set(self._employees_by_index) | {None}
+        if indexes:
+            queryset = Employee.objects.filter(current_company=self.company, employee_id_index__in=indexes)
+            for employee in queryset:
+                self._employees_by_index.setdefault(employee.employee_id_index, employee)
+
+        names = {
+            row.name for row in rows
+            if blind_index(row.employee_id) not in self._employees_by_index
+        } - set(self._employees_by_name)
+        if names:
+            for name in names:
+                self._employees_by_name[name] = []
+            for employee in Employee.objects.filter(current_company=self.company, name__in=names):
+                self._employees_by_name[employee.name].append(employee)
+
+    def _existing_role_keys(self, rows):
+        """``(employee id, title, start date)`` of the stored roles that rows of the chunk could repeat."""
+        return set(
+            EmployeeRole.objects.filter(
+                company=self.company,
+                title__in={row.role for row in rows},
+                start_date__in={row.date_started for row in rows},
+            ).values_list('employee_id', 'title', 'start_date')
+        )
+
+    def _plan(self, rows, batch):
+        batch.departments = self.departments.resolve((self.company.pk, row.department) for row in rows)
+        self._resolve_employees(rows)
+        # Roles are unique per (employee, company, title, start date); rows that
+        # repeat one, e.g. when a file is uploaded again, are skipped
+        role_keys = self._existing_role_keys(rows)
+        now = timezone.now()
+        new_employee_ids = set()
+        current_roles = {}
+
+        for row in rows:
+            department = batch.departments.get((self.company.pk, row.department))
+
+            employee = self._employees_by_index.get(blind_index(row.employee_id)) if row.employee_id else None
+            if employee is None:
+                matches = self._employees_by_name.get(row.name, [])
+                if len(matches) > 1:
+                    self._add_error(row.number, f"Multiple employees named '{row.name}' found", BulkUploadError.AMBIGUOUS, batch)
+                    continue
+                employee = matches[0] if matches else None
+
+            if employee is not None and (employee.pk, row.role, row.date_started) in role_keys:
+                batch.skipped += 1
+                continue
+
+            if employee is not None:
+                batch.updated += 1
+                if employee.pk not in new_employee_ids:
+                    batch.touched_employees[employee.pk] = employee
+                    batch.previous_stats.setdefault(employee.pk, stats_key(employee))
+            else:
+                employee = Employee(
+                    name=row.name,
+                    employee_id=row.employee_id,
+                    current_company=self.company,
+                    current_department=department,
+                    current_role=row.role,
+                    date_joined=row.date_started,
+                )
+                new_employee_ids.add(employee.pk)
+                batch.new_employees.append(employee)
+                batch.created += 1
+                self._employees_by_name.setdefault(row.name, []).append(employee)
+                if row.employee_id:
+                    employee.employee_id_index = blind_index(row.employee_id)
+                    self._employees_by_index[employee.employee_id_index] = employee
+
+            if row.date_left:
+                employee.date_left = row.date_left
+                employee.is_active = False
+
+            role = EmployeeRole(
+                employee=employee,
+                company=self.company,
+                department=department,
+                title=row.role,
+                start_date=row.date_started,
+                end_date=row.date_left,
+                duties=row.duties,
+                is_current=row.date_left is None,
+            )
+            batch.roles.append(role)
+            role_keys.add((employee.pk, row.role, row.date_started))
+
+            if role.is_current:
+                # Same effect as EmployeeRole.save(): one current role per employee
+                previous = current_roles.get(employee.pk)
+                if previous is not None:
+                    previous.is_current = False
+                elif employee.pk not in new_employee_ids:
+                    batch.replaced_current_roles.add(employee.pk)
+                current_roles[employee.pk] = role
+                employee.current_company = self.company
+                employee.current_department = department
+                employee.current_role = row.role
+            employee.updated_at = now
+
+    def _write(self, batch):
+        Employee.objects.bulk_create(batch.new_employees, batch_size=self.chunk_size)
+        if batch.replaced_current_roles:
+            EmployeeRole.objects.filter(
+                employee_id__in=batch.replaced_current_roles,
+                is_current=True,
+            ).update(is_current=False)
+        EmployeeRole.objects.bulk_create(batch.roles, batch_size=self.chunk_size)
+        if batch.touched_employees:
+            Employee.objects.bulk_update(
+                batch.touched_employees.values(),
+                ['current_company', 'current_department', 'current_role',
+                 'date_left', 'is_active', 'updated_at'],
+                batch_size=self.chunk_size,
+            )
+        # bulk_create/bulk_update skip the signals that maintain search documents and company stats
+        rebuild_search_documents({role.employee_id for role in batch.roles}, batch_size=self.chunk_size)
+        record_employee_changes(
+            batch.previous_stats.values(),
+            [stats_key(employee) for employee in [*batch.new_employees, *batch.touched_employees.values()]],
+        )
+
+
+def _user_company(user):
+    """Company whose employees ``user`` may upload, or None for non-company users."""
+    if user.role == 'company_user':
+        return user.company
+    return None
+
+
+def process_employee_upload(upload_log):
+    """Job handler for ``employee`` uploads."""
+    # Resolve and write the rows set-wise, chunk by chunk
+    report = UploadErrors(upload_log)
+    uploader = EmployeeBulkUploader(_user_company(upload_log.user), progress=upload_log.report_progress, report=report)
+    with upload_chunks(upload_log) as chunks:
+        for df in chunks:
+            # Validate required columns
+            missing_columns = EMPLOYEE_UPLOAD_SCHEMA.missing_columns(df)
+            if missing_columns:
+                raise UploadFileError(f"Missing required columns: {', '.join(missing_columns)}")
+            uploader.process(df)
+            report.flush()
+    
+    result = {
+        'success': True,
+        'processed': uploader.processed,
+        'created': uploader.created,
+        'updated': uploader.updated,
+        'skipped_duplicates': uploader.skipped,
+        'errors': uploader.errors,
+        'details': 'File processed successfully',
+        # The first errors only; see error_summary for the totals
+        'error_details': report.first,
+        'error_summary': report.summary
+    }
+    upload_log.records_total = uploader.processed
+    upload_log.mark_completed(
+        records_processed=uploader.processed,
+        records_created=uploader.created,
+        records_updated=uploader.updated,
+        errors=uploader.errors,
+        error_details=report.as_text(),
+        result=result
+    )
+    return result
+
+
+class EmployeeBulkEditor(BulkEditor):
+    """
+    Plan and apply ``employee_edit`` upload rows for existing employees.
+
+    Rows are applied in file order, so several rows for one employee behave as
+    if they were applied one after the other.
+    """
+
+    schema = EMPLOYEE_EDIT_SCHEMA
+    row_label = 'employee'
+
+    def __init__(self, user, upload_log=None):
+        super().__init__(user, upload_log)
+        self.company = _user_company(user)
+
+    def reset_planning(self):
+        # Employees as planned so far, keyed by blind index
+        self._planned_employees = {}
+        # Current department names of those employees as planned so far
+        self._current_departments = {}
+        # Natural keys of the roles stored or planned for them
+        self._role_keys = set()
+        # (company id, name key) of the departments planned so far
+        self._new_departments = set()
+        self.departments = DepartmentResolver()
+
+    @property
+    def roles_added(self):
+        return self.summary.get(START_ROLE, 0)
+
+    def _employees(self):
+        queryset = Employee.objects.select_related('current_department')
+        if self.company:
+            queryset = queryset.filter(current_company=self.company)
+        return queryset
+
+    def plan_rows(self, rows):
+        # Fetch only the employees referenced by the chunk that earlier chunks have not planned
+        employees = self._planned_employees
+        unseen = [value for value in rows['employee_id'] if blind_index(value) not in employees]
+        fetched = list(self._employees().by_employee_ids(unseen)) if unseen else []
+        for employee in fetched:
+            employees[employee.employee_id_index] = employee
+            self._current_departments[employee.pk] = (
+                employee.current_department.name if employee.current_department else None
+            )
+        # Departments are looked up by name within the employee's company
+        if rows['department'].notna().any():
+            self.departments.load(e.current_company_id for e in fetched)
+        # Natural keys of the stored roles that a role change in the chunk could repeat
+        titles = set(rows['role'].dropna())
+        if titles:
+            referenced = {employees[index].pk for index in map(blind_index, rows['employee_id']) if index in employees}
+            self._role_keys.update(
+                EmployeeRole.objects.filter(employee__in=referenced, title__in=titles)
+                .values_list('employee_id', 'company_id', 'title', 'start_date')
+            )
+
+        changes = []
+        today = timezone.now().date()
+        for row in rows.itertuples():
+            employee = employees.get(blind_index(row.employee_id))
+
+            if not employee:
+                self.report.add(
+                    row.Index, f"Row {row.Index}: Employee with ID '{row.employee_id}' not found",
+                    BulkUploadError.NOT_FOUND,
+                )
+                continue
+
+            # Check if user has permission for this employee's company
+            if self.user.role == 'company_user' and self.user.company_id != employee.current_company_id:
+                self.report.add(
+                    row.Index, f"Row {row.Index}: You don't have permission to edit employee with ID '{row.employee_id}'",
+                    BulkUploadError.PERMISSION_DENIED,
+                )
+                continue
+
+            changes.extend(self._plan_row(
+                row, employee, self._new_departments, self._current_departments, self._role_keys, today
+            ))
+        return changes
+
+    def _plan_row(self, row, employee, new_departments, current_departments, role_keys, today):
+        """
+        Changes made by one row. ``employee``, ``new_departments``,
+        ``current_departments`` and ``role_keys`` are updated in memory so
+        later rows see the result.
+        """
+        changes = []
+        new_role = row.role is not None and row.role != employee.current_role
+        start_date = row.start_date or today
+        if new_role:
+            role_key = (employee.pk, employee.current_company_id, row.role, start_date)
+            if role_key in role_keys:
+                self._add_error(
+                    row.Index, f"Role '{row.role}' starting {start_date} is already recorded for employee '{row.employee_id}'",
+                    BulkUploadError.DUPLICATE,
+                )
+                return changes
+            role_keys.add(role_key)
+
+        def update(field, old, new):
+            changes.append(PlannedChange(row.Index, UPDATE, employee.pk, field, old, new))
+
+        if row.name is not None and row.name != employee.name:
+            update('name', employee.name, row.name)
+            employee.name = row.name
+
+        # Handle department change
+        if row.department is not None:
+            key = (employee.current_company_id, department_key(row.department))
+            if self.departments.get(*key) is None and key not in new_departments:
+                new_departments.add(key)
+                changes.append(PlannedChange(
+                    row.Index, CREATE_DEPARTMENT, employee.current_company_id, 'name', None, row.department
+                ))
+            # Names differing only in case or spacing are the same department
+            if key[1] != department_key(current_departments[employee.pk]):
+                update('current_department', current_departments[employee.pk], row.department)
+                current_departments[employee.pk] = row.department
+
+        # Handle role change, only adding a new role if it's different
+        new_role_added = False
+        if new_role:
+            changes.append(PlannedChange(row.Index, END_ROLE, employee.pk, 'end_date', None, today))
+            changes.append(PlannedChange(row.Index, START_ROLE, employee.pk, 'title', None, {
+                'title': row.role,
+                'department': current_departments[employee.pk],
+                'start_date': start_date,
+                'duties': row.duties or '',
+            }))
+            update('current_role', employee.current_role, row.role)
+            employee.current_role = row.role
+            new_role_added = True
+
+        # Handle employee departure
+        if row.date_left is not None:
+            if row.date_left != employee.date_left:
+                update('date_left', employee.date_left, row.date_left)
+                employee.date_left = row.date_left
+            if employee.is_active:
+                update('is_active', True, False)
+                employee.is_active = False
+            # End the current role too, unless the row has just added a new one
+            if not new_role_added:
+                changes.append(PlannedChange(row.Index, END_ROLE, employee.pk, 'end_date', None, row.date_left))
+
+        # Handle is_active flag; a blank cell leaves it unchanged
+        if row.is_active is not None and row.is_active != employee.is_active:
+            update('is_active', employee.is_active, row.is_active)
+            employee.is_active = row.is_active
+
+        return changes
+
+    def _resolve_departments(self, changes, employees):
+        """Departments named by ``changes``, keyed by ``(company id, name)``, creating missing ones."""
+        keys = set()
+        for change in changes:
+            employee = employees.get(change.target_id)
+            if change.action == CREATE_DEPARTMENT:
+                keys.add((change.target_id, change.new))
+            elif employee is not None and change.action == UPDATE and change.field == 'current_department':
+                keys.add((employee.current_company_id, change.new))
+            elif employee is not None and change.action == START_ROLE and change.new['department']:
+                keys.add((employee.current_company_id, change.new['department']))
+        return DepartmentResolver().resolve(keys)
+
+    def apply(self, changes):
+        employees = self._employees().in_bulk(
+            {change.target_id for change in changes if change.action != CREATE_DEPARTMENT}
+        )
+        departments = self._resolve_departments(changes, employees)
+        previous_stats = [stats_key(employee) for employee in employees.values()]
+        date_field = EmployeeRole._meta.get_field('start_date')
+
+        updated_fields = set()
+        transitions = []
+        for change in changes:
+            if change.action == CREATE_DEPARTMENT:
+                continue
+            employee = employees.get(change.target_id)
+            if employee is None:
+                raise PlanConflict(change.row, f"Employee {change.target_id} no longer exists")
+
+            if change.action == UPDATE:
+                if change.field == 'current_department':
+                    current = employee.current_department.name if employee.current_department else None
+                    old = change.old
+                    new = departments[(employee.current_company_id, change.new)]
+                else:
+                    field = Employee._meta.get_field(change.field)
+                    current = getattr(employee, change.field)
+                    old, new = field.to_python(change.old), field.to_python(change.new)
+                if current != old:
+                    raise PlanConflict(change.row, f"'{change.field}' of employee {employee.pk} has changed since the plan was made")
+                setattr(employee, change.field, new)
+                updated_fields.add(change.field)
+
+            elif change.action == END_ROLE:
+                transitions.append(RoleTransition(employee, None, date_field.to_python(change.new)))
+
+            elif change.action == START_ROLE:
+                department = change.new['department']
+                role = EmployeeRole(
+                    company_id=employee.current_company_id,
+                    department=departments[(employee.current_company_id, department)] if department else None,
+                    title=change.new['title'],
+                    start_date=date_field.to_python(change.new['start_date']),
+                    duties=change.new['duties'],
+                )
+                # The row's END_ROLE change has already ended the current role
+                transitions.append(RoleTransition(employee, role, None))
+
+        now = timezone.now()
+        transition_roles(transitions, now)
+        if updated_fields:
+            touched = {change.target_id for change in changes if change.action == UPDATE}
+            for employee_id in touched:
+                employees[employee_id].updated_at = now
+            Employee.objects.bulk_update(
+                [employees[employee_id] for employee_id in touched],
+                sorted(updated_fields) + ['updated_at'],
+            )
+        # bulk_create/bulk_update skip the signals that maintain search documents and company stats
+        rebuild_search_documents(list(employees))
+        record_employee_changes(previous_stats, [stats_key(employee) for employee in employees.values()])
+
+
+def process_employee_edit(upload_log):
+    """Job handler for ``employee_edit`` uploads."""
+    editor = EmployeeBulkEditor(upload_log.user, upload_log)
+    plan = editor.run(upload_log)
+
+    result = {
+        'success': True,
+        'processed': editor.processed,
+        'updated': editor.updated,
+        'roles_added': editor.roles_added,
+        'errors': editor.errors,
+        'details': 'File processed successfully',
+        # The first errors only; see error_summary for the totals
+        'error_details': editor.report.first,
+        'error_summary': editor.report.summary
+    }
+    if plan is not None:
+        result.update(dry_run=True, plan_id=str(plan.pk), summary=plan.summary)
+    upload_log.records_total = editor.processed
+    upload_log.mark_completed(
+        records_processed=editor.processed,
+        records_created=0,
+        records_updated=editor.updated,
+        errors=editor.errors,
+        error_details=editor.report.as_text(),
+        result=result
+    )
+    return result
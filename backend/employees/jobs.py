@@ -0,0 +1,199 @@
+"""
+Database-backed job queue for bulk uploads.
+
+Each upload is stored on its ``BulkUploadLog`` and queued. Worker processes
+started with ``manage.py process_uploads`` claim queued logs with a conditional
+UPDATE, so no external broker is needed. A worker runs the handler registered
+for the log's ``upload_type`` and records the outcome on the log.
+"""
+from contextlib import contextmanager
+from datetime import timedelta
+import hashlib
+import logging
+import os
+import socket
+import threading
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import BulkEditPlan, BulkUploadLog
+from .readers import UnsupportedFileType, iter_upload_chunks
+
+logger = logging.getLogger(__name__)
+
+# Handler for each upload type, as dotted paths to avoid import cycles between apps
+JOB_HANDLERS = {
+    'employee': 'employees.ingest.process_employee_upload',
+    'employee_edit': 'employees.ingest.process_employee_edit',
+    'company_with_user': 'companies.ingest.process_company_upload',
+    'company_edit': 'companies.ingest.process_company_edit',
+}
+
+
+class UploadFileError(Exception):
+    """Raised when an uploaded file cannot be processed at all."""
+
+
+def worker_name():
+    """Identify the current worker process in job records."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def content_hash(file):
+    """SHA-256 hex digest of an uploaded file, read in chunks rather than all at once."""
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def find_duplicate_upload(user, upload_type, digest, dry_run=False):
+    """
+    Latest earlier upload of the same file by ``user`` or another user of the
+    same company that has not failed, or None.
+
+    Dry runs only match while their plan can still be applied.
+    """
+    uploads = BulkUploadLog.objects.filter(
+        upload_type=upload_type,
+        content_hash=digest,
+        dry_run=dry_run,
+    ).exclude(status=BulkUploadLog.STATUS_FAILED)
+    if dry_run:
+        uploads = uploads.filter(plan__status=BulkEditPlan.STATUS_PENDING)
+    if user.company_id:
+        uploads = uploads.filter(Q(user=user) | Q(user__company_id=user.company_id))
+    else:
+        uploads = uploads.filter(user=user)
+    return uploads.order_by('-created_at').first()
+
+
+def enqueue_upload(user, file, upload_type, dry_run=False, digest=''):
+    """Store the uploaded file and queue a job for it."""
+    upload_log = BulkUploadLog(
+        user=user,
+        file_name=file.name,
+        file_size=file.size,
+        content_hash=digest,
+        upload_type=upload_type,
+        dry_run=dry_run,
+        status=BulkUploadLog.STATUS_QUEUED,
+    )
+    upload_log.upload.save(file.name, file, save=False)
+    upload_log.save()
+    return upload_log
+
+
+@contextmanager
+def upload_chunks(upload_log):
+    """Open the stored upload and yield an iterator over its DataFrame chunks."""
+    with upload_log.upload.open('rb') as file:
+        yield iter_upload_chunks(file, upload_log.file_name)
+
+
+@contextmanager
+def heartbeat(upload_log, interval=None):
+    """
+    Keep the job's heartbeat fresh from a background thread while it runs, so
+    a single slow chunk does not get it requeued and processed twice.
+    """
+    interval = interval or settings.BULK_UPLOAD_HEARTBEAT_INTERVAL
+    stopped = threading.Event()
+
+    def beat():
+        try:
+            while not stopped.wait(interval):
+                if not upload_log.claimed().update(heartbeat_at=timezone.now()):
+                    return
+        except DatabaseError as e:
+            logger.error(f"Heartbeat of bulk upload {upload_log.pk} failed: {str(e)}")
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=beat, name=f'heartbeat-{upload_log.pk}', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        thread.join()
+
+
+def run_job(upload_log):
+    """Run the handler for ``upload_log`` and return its result payload."""
+    with heartbeat(upload_log):
+        try:
+            handler = import_string(JOB_HANDLERS[upload_log.upload_type])
+            result = handler(upload_log)
+        except (UploadFileError, UnsupportedFileType) as e:
+            upload_log.mark_failed(str(e), result={'error': str(e)})
+            result = upload_log.result
+        except Exception as e:
+            logger.error(f"Bulk {upload_log.upload_type} upload {upload_log.pk} failed: {str(e)}")
+            upload_log.mark_failed(str(e), result={'error': f'Failed to process file: {str(e)}'})
+            result = upload_log.result
+    # The stored copy is only needed until the job has finished. A job that was
+    # interrupted or lost to another worker keeps it, so it can still be retried.
+    if upload_log.status in (BulkUploadLog.STATUS_COMPLETED, BulkUploadLog.STATUS_FAILED) and upload_log.upload:
+        upload_log.upload.delete(save=False)
+        BulkUploadLog.objects.filter(pk=upload_log.pk).update(upload=None)
+    return result
+
+
+def claim_next_job(worker=None):
+    """Atomically claim the oldest queued upload, or return None if the queue is empty."""
+    worker = worker or worker_name()
+    while True:
+        job_id = (
+            BulkUploadLog.objects.filter(status=BulkUploadLog.STATUS_QUEUED)
+            .order_by('created_at')
+            .values_list('id', flat=True)
+            .first()
+        )
+        if job_id is None:
+            return None
+        now = timezone.now()
+        claimed = BulkUploadLog.objects.filter(pk=job_id, status=BulkUploadLog.STATUS_QUEUED).update(
+            status=BulkUploadLog.STATUS_PROCESSING,
+            worker=worker,
+            attempts=F('attempts') + 1,
+            started_at=now,
+            heartbeat_at=now,
+        )
+        if claimed:
+            return BulkUploadLog.objects.get(pk=job_id)
+        # Another worker claimed it first; try the next one
+
+
+def requeue_stale_jobs(stale_after=None):
+    """Put jobs whose worker stopped reporting progress back on the queue."""
+    stale_after = stale_after or settings.BULK_UPLOAD_STALE_AFTER
+    cutoff = timezone.now() - timedelta(seconds=stale_after)
+    stale = BulkUploadLog.objects.filter(
+        status=BulkUploadLog.STATUS_PROCESSING,
+        heartbeat_at__lt=cutoff,
+    )
+    exhausted = stale.filter(attempts__gte=settings.BULK_UPLOAD_MAX_ATTEMPTS).update(
+        status=BulkUploadLog.STATUS_FAILED,
+        error_details='Worker stopped responding',
+        completed_at=timezone.now(),
+    )
+    requeued = stale.update(status=BulkUploadLog.STATUS_QUEUED, worker='')
+    if requeued or exhausted:
+        logger.warning(f"Requeued {requeued} and failed {exhausted} stale bulk upload jobs")
+    return requeued
+
+
+def process_next_job(worker=None):
+    """Claim and run one job. Returns False if the queue was empty."""
+    upload_log = claim_next_job(worker)
+    if upload_log is None:
+        return False
+    logger.info(f"Processing bulk {upload_log.upload_type} upload {upload_log.pk}")
+    run_job(upload_log)
+    return True
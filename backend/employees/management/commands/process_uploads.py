@@ -0,0 +1,77 @@
+import logging
+import multiprocessing
+import time
+
+import django
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+def run_worker(poll_interval, stale_after, once):
+    """Claim and run queued bulk uploads until stopped (or the queue is empty with ``once``)."""
+    if not apps.ready:
+        # Spawned (not forked) worker processes start without Django configured
+        django.setup()
+
+    from employees.jobs import process_next_job, requeue_stale_jobs, worker_name
+
+    name = worker_name()
+    logger.info(f"Bulk upload worker {name} started")
+    try:
+        while True:
+            requeue_stale_jobs(stale_after)
+            if process_next_job(name):
+                continue
+            if once:
+                break
+            time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        connections.close_all()
+        logger.info(f"Bulk upload worker {name} stopped")
+
+
+class Command(BaseCommand):
+    help = 'Run worker processes that execute queued bulk uploads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1, help='Number of worker processes')
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help='Seconds to wait between polls when the queue is empty')
+        parser.add_argument('--stale-after', type=int, default=None,
+                            help='Requeue processing jobs without progress for this many seconds '
+                                 '(defaults to BULK_UPLOAD_STALE_AFTER)')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the queue is empty instead of polling forever')
+
+    def handle(self, *args, **options):
+        workers = max(1, options['workers'])
+        worker_args = (options['poll_interval'], options['stale_after'], options['once'])
+
+        if workers == 1:
+            run_worker(*worker_args)
+            return
+
+        # Forked children must not share the parent's database connections
+        connections.close_all()
+        # Not daemons, so they can start the process pool that hashes user
+        # passwords; they are joined or terminated below
+        processes = [
+            multiprocessing.Process(target=run_worker, args=worker_args)
+            for _ in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        self.stdout.write(f"Started {workers} bulk upload workers")
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.join()
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from employees.search import FTS_TABLE, rebuild_search_documents
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search documents of all employees'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000,
+                            help='Number of employees loaded and written per batch')
+
+    def handle(self, *args, **options):
+        written = rebuild_search_documents(batch_size=options['batch_size'])
+        if connection.vendor == 'sqlite':
+            # Merge the FTS5 index segments left behind by incremental updates
+            with connection.cursor() as cursor:
+                cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+        self.stdout.write(f"Rebuilt {written} employee search documents")
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:22
+
+import companies.encryption
+from django.db import migrations
+
+
+def backfill_employee_id_index(apps, schema_editor):
+    """Compute the blind index for every existing employee."""
+    Employee = apps.get_model('employees', 'Employee')
+    batch = []
+    for obj in Employee.objects.only('id', 'employee_id').iterator(chunk_size=2000):
+        obj.employee_id_index = companies.encryption.blind_index(obj.employee_id)
+        batch.append(obj)
+        if len(batch) >= 2000:
+            Employee.objects.bulk_update(batch, ['employee_id_index'])
+            batch = []
+    if batch:
+        Employee.objects.bulk_update(batch, ['employee_id_index'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employees', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='employee',
+            name='employee_id_index',
+            field=companies.encryption.BlindIndexField(blank=True, db_index=True, editable=False, max_length=64, null=True, source='employee_id'),
+        ),
+        migrations.RunPython(backfill_employee_id_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:26
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employees', '0002_blind_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bulkuploadlog',
+            name='attempts',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='bulkuploadlog',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='bulkuploadlog',
+            name='records_total',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='bulkuploadlog',
+            name='result',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='bulkuploadlog',
+            name='started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='bulkuploadlog',
+            name='upload',
+            field=models.FileField(blank=True, null=True, upload_to='bulk_uploads/%Y/%m/%d/'),
+        ),
+        migrations.AddField(
+            model_name='bulkuploadlog',
+            name='worker',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddIndex(
+            model_name='bulkuploadlog',
+            index=models.Index(fields=['status', 'created_at'], name='bulkupload_status_created_idx'),
+        ),
+    ]
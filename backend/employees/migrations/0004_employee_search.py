@@ -0,0 +1,114 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Prefetch
+from django.utils import timezone
+
+# The FTS5 table mirrors the document table through triggers. Note that SQLite
+# drops these triggers if a later migration has to rebuild the document table.
+SQLITE_CREATE = [
+    "CREATE VIRTUAL TABLE employees_search_fts USING fts5("
+    "name, company, department, role, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')",
+    # bm25 weights per column: name, company, department, role
+    "INSERT INTO employees_search_fts(employees_search_fts, rank) VALUES ('rank', 'bm25(10.0, 2.0, 1.0, 4.0)')",
+    "CREATE TRIGGER employees_search_fts_insert AFTER INSERT ON employees_employeesearchdocument BEGIN "
+    "INSERT INTO employees_search_fts(rowid, name, company, department, role) "
+    "VALUES (new.id, new.name, new.company, new.department, new.role); END",
+    "CREATE TRIGGER employees_search_fts_update AFTER UPDATE ON employees_employeesearchdocument BEGIN "
+    "DELETE FROM employees_search_fts WHERE rowid = old.id; "
+    "INSERT INTO employees_search_fts(rowid, name, company, department, role) "
+    "VALUES (new.id, new.name, new.company, new.department, new.role); END",
+    "CREATE TRIGGER employees_search_fts_delete AFTER DELETE ON employees_employeesearchdocument BEGIN "
+    "DELETE FROM employees_search_fts WHERE rowid = old.id; END",
+]
+SQLITE_DROP = [
+    "DROP TRIGGER IF EXISTS employees_search_fts_insert",
+    "DROP TRIGGER IF EXISTS employees_search_fts_update",
+    "DROP TRIGGER IF EXISTS employees_search_fts_delete",
+    "DROP TABLE IF EXISTS employees_search_fts",
+]
+
+POSTGRESQL_CREATE = [
+    "ALTER TABLE employees_employeesearchdocument ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('simple', coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(role, '')), 'B') || "
+    "setweight(to_tsvector('simple', coalesce(company, '')), 'C') || "
+    "setweight(to_tsvector('simple', coalesce(department, '')), 'D')) STORED",
+    "CREATE INDEX employees_search_vector_idx ON employees_employeesearchdocument USING GIN (search_vector)",
+]
+POSTGRESQL_DROP = [
+    "ALTER TABLE employees_employeesearchdocument DROP COLUMN IF EXISTS search_vector",
+]
+
+
+def _run(schema_editor, statements):
+    for statement in statements.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+def create_search_index(apps, schema_editor):
+    """Create the database's full-text index over the search documents."""
+    _run(schema_editor, {'sqlite': SQLITE_CREATE, 'postgresql': POSTGRESQL_CREATE})
+
+
+def drop_search_index(apps, schema_editor):
+    _run(schema_editor, {'sqlite': SQLITE_DROP, 'postgresql': POSTGRESQL_DROP})
+
+
+def _join_unique(values):
+    return '\n'.join(dict.fromkeys(value for value in values if value))
+
+
+def backfill_search_documents(apps, schema_editor):
+    """Build a search document for every existing employee."""
+    Employee = apps.get_model('employees', 'Employee')
+    EmployeeRole = apps.get_model('employees', 'EmployeeRole')
+    EmployeeSearchDocument = apps.get_model('employees', 'EmployeeSearchDocument')
+    employees = Employee.objects.select_related('current_company', 'current_department').prefetch_related(
+        Prefetch('roles', queryset=EmployeeRole.objects.select_related('company', 'department'))
+    ).order_by('pk')
+    now = timezone.now()
+    batch = []
+    for employee in employees.iterator(chunk_size=2000):
+        roles = list(employee.roles.all())
+        batch.append(EmployeeSearchDocument(
+            employee=employee,
+            name=employee.name,
+            company=_join_unique([employee.current_company.name] + [role.company.name for role in roles]),
+            department=_join_unique(
+                [employee.current_department.name if employee.current_department else None]
+                + [role.department.name for role in roles if role.department]
+            ),
+            role=_join_unique([employee.current_role] + [role.title for role in roles]),
+            updated_at=now,
+        ))
+        if len(batch) >= 2000:
+            EmployeeSearchDocument.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        EmployeeSearchDocument.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employees', '0003_bulk_upload_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmployeeSearchDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.TextField()),
+                ('company', models.TextField(blank=True, default='')),
+                ('department', models.TextField(blank=True, default='')),
+                ('role', models.TextField(blank=True, default='')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('employee', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='search_document', to='employees.employee')),
+            ],
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+        migrations.RunPython(backfill_search_documents, migrations.RunPython.noop),
+    ]
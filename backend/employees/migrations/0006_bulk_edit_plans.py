@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:51
+
+import companies.encryption
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employees', '0005_keyset_pagination_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bulkuploadlog',
+            name='dry_run',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='BulkEditPlan',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('upload_type', models.CharField(max_length=20)),
+                ('summary', models.JSONField(default=dict)),
+                ('status', models.CharField(default='pending', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('applied_at', models.DateTimeField(blank=True, null=True)),
+                ('upload_log', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='plan', to='employees.bulkuploadlog')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BulkEditChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('row', models.IntegerField()),
+                ('action', models.CharField(max_length=20)),
+                ('target_id', models.UUIDField()),
+                ('field', models.CharField(blank=True, default='', max_length=50)),
+                ('old_value', companies.encryption.EncryptedTextField(blank=True, null=True)),
+                ('new_value', companies.encryption.EncryptedTextField(blank=True, null=True)),
+                ('plan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='changes', to='employees.bulkeditplan')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['plan', 'id'], name='bulkeditchange_plan_id_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:53
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def remove_duplicate_roles(apps, schema_editor):
+    """
+    Keep one role per (employee, company, title, start_date) before the
+    constraint is added: the current one if any, otherwise the latest updated.
+    """
+    EmployeeRole = apps.get_model('employees', 'EmployeeRole')
+    key = ('employee_id', 'company_id', 'title', 'start_date')
+    duplicates = (
+        EmployeeRole.objects.values(*key)
+        .annotate(count=Count('id'))
+        .filter(count__gt=1)
+        .order_by()
+    )
+    for group in duplicates.iterator():
+        roles = EmployeeRole.objects.filter(**{field: group[field] for field in key})
+        keep = roles.order_by('-is_current', '-updated_at').values_list('id', flat=True).first()
+        roles.exclude(id=keep).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('companies', '0003_keyset_pagination_indexes'),
+        ('employees', '0006_bulk_edit_plans'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bulkuploadlog',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='bulkuploadlog',
+            index=models.Index(fields=['content_hash'], name='bulkupload_content_hash_idx'),
+        ),
+        migrations.RunPython(remove_duplicate_roles, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='employeerole',
+            constraint=models.UniqueConstraint(fields=('employee', 'company', 'title', 'start_date'), name='employeerole_natural_key'),
+        ),
+    ]
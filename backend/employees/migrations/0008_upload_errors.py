@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employees', '0007_upload_dedupe'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BulkUploadError',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('row', models.IntegerField(blank=True, null=True)),
+                ('code', models.CharField(max_length=30)),
+                ('message', models.TextField()),
+                ('upload_log', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='error_records', to='employees.bulkuploadlog')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['upload_log', 'id'], name='bulkuploaderror_log_id_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('companies', '0005_department_unique_name'),
+        ('employees', '0008_upload_errors'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='employee',
+            index=models.Index(fields=['current_company', 'name', 'id'], name='employee_company_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='employee',
+            index=models.Index(fields=['current_company', 'is_active'], name='employee_company_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='employee',
+            index=models.Index(fields=['date_joined'], name='employee_date_joined_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='employee',
+            index=models.Index(fields=['date_left'], name='employee_date_left_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='employeerole',
+            index=models.Index(condition=models.Q(('is_current', True)), fields=['employee'], name='employeerole_current_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='employeerole',
+            index=models.Index(fields=['employee', '-start_date'], name='employeerole_history_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('companies', '0005_department_unique_name'),
+        ('employees', '0009_access_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='employeerole',
+            index=models.Index(fields=['start_date'], name='employeerole_start_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='employeerole',
+            index=models.Index(fields=['end_date'], name='employeerole_end_date_idx'),
+        ),
+    ]
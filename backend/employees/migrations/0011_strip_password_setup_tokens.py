@@ -0,0 +1,22 @@
+from django.db import migrations
+
+
+def strip_tokens(apps, schema_editor):
+    """Remove the set-password tokens earlier company uploads stored in their result."""
+    BulkUploadLog = apps.get_model('employees', 'BulkUploadLog')
+    for upload_log in BulkUploadLog.objects.filter(upload_type='company_with_user', result__has_key='password_setup').iterator():
+        upload_log.result['password_setup'] = [
+            {'email': setup.get('email'), 'uid': setup.get('uid')} for setup in upload_log.result['password_setup']
+        ]
+        upload_log.save(update_fields=['result'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employees', '0010_role_date_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(strip_tokens, migrations.RunPython.noop),
+    ]
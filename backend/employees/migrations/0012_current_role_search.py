@@ -0,0 +1,124 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:58
+
+from django.db import migrations, models
+
+FTS_TABLE = 'employees_search_fts'
+DOCUMENT_TABLE = 'employees_employeesearchdocument'
+COLUMNS = ['name', 'company', 'department', 'role']
+CURRENT_COLUMNS = ['current_company', 'current_department', 'current_role']
+# bm25 weights per column; the current role weighs what the whole history does
+WEIGHTS = {
+    'name': '10.0', 'company': '2.0', 'department': '1.0', 'role': '4.0',
+    'current_company': '2.0', 'current_department': '1.0', 'current_role': '4.0',
+}
+
+
+def sqlite_create(columns):
+    """Statements creating the FTS5 table over ``columns`` and the triggers that fill it."""
+    names = ', '.join(columns)
+    values = ', '.join(f'new.{column}' for column in columns)
+    return [
+        f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+        f"{names}, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')",
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rank) VALUES "
+        f"('rank', 'bm25({', '.join(WEIGHTS[column] for column in columns)})')",
+        f"CREATE TRIGGER employees_search_fts_insert AFTER INSERT ON {DOCUMENT_TABLE} BEGIN "
+        f"INSERT INTO {FTS_TABLE}(rowid, {names}) VALUES (new.id, {values}); END",
+        f"CREATE TRIGGER employees_search_fts_update AFTER UPDATE ON {DOCUMENT_TABLE} BEGIN "
+        f"DELETE FROM {FTS_TABLE} WHERE rowid = old.id; "
+        f"INSERT INTO {FTS_TABLE}(rowid, {names}) VALUES (new.id, {values}); END",
+        f"CREATE TRIGGER employees_search_fts_delete AFTER DELETE ON {DOCUMENT_TABLE} BEGIN "
+        f"DELETE FROM {FTS_TABLE} WHERE rowid = old.id; END",
+        f"INSERT INTO {FTS_TABLE}(rowid, {names}) SELECT id, {names} FROM {DOCUMENT_TABLE}",
+    ]
+
+
+# Adding or removing document columns rebuilds the document table on SQLite,
+# which drops its triggers, so the FTS5 table is recreated around the change
+SQLITE_DROP = [
+    "DROP TRIGGER IF EXISTS employees_search_fts_insert",
+    "DROP TRIGGER IF EXISTS employees_search_fts_update",
+    "DROP TRIGGER IF EXISTS employees_search_fts_delete",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+POSTGRESQL_CREATE = [
+    f"ALTER TABLE {DOCUMENT_TABLE} ADD COLUMN current_search_vector tsvector GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('simple', coalesce(current_role, '')), 'B') || "
+    "setweight(to_tsvector('simple', coalesce(current_company, '')), 'C') || "
+    "setweight(to_tsvector('simple', coalesce(current_department, '')), 'D')) STORED",
+    f"CREATE INDEX employees_current_search_vector_idx ON {DOCUMENT_TABLE} USING GIN (current_search_vector)",
+]
+POSTGRESQL_DROP = [
+    f"ALTER TABLE {DOCUMENT_TABLE} DROP COLUMN IF EXISTS current_search_vector",
+]
+
+
+def _run(schema_editor, statements):
+    for statement in statements.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+def create_search_index(apps, schema_editor):
+    """Index the current role columns next to the others."""
+    _run(schema_editor, {
+        'sqlite': SQLITE_DROP + sqlite_create(COLUMNS + CURRENT_COLUMNS),
+        'postgresql': POSTGRESQL_CREATE,
+    })
+
+
+def drop_search_index(apps, schema_editor):
+    _run(schema_editor, {'sqlite': SQLITE_DROP, 'postgresql': POSTGRESQL_DROP})
+
+
+def restore_search_index(apps, schema_editor):
+    """Recreate the index of 0004_employee_search once the current role columns are gone."""
+    _run(schema_editor, {'sqlite': SQLITE_DROP + sqlite_create(COLUMNS)})
+
+
+def backfill_current_role(apps, schema_editor):
+    """Copy the current company, department and role of every employee into its document."""
+    EmployeeSearchDocument = apps.get_model('employees', 'EmployeeSearchDocument')
+    documents = EmployeeSearchDocument.objects.select_related(
+        'employee__current_company', 'employee__current_department'
+    ).order_by('pk')
+    batch = []
+    for document in documents.iterator(chunk_size=2000):
+        employee = document.employee
+        document.current_company = employee.current_company.name
+        document.current_department = employee.current_department.name if employee.current_department else ''
+        document.current_role = employee.current_role or ''
+        batch.append(document)
+        if len(batch) >= 2000:
+            EmployeeSearchDocument.objects.bulk_update(batch, CURRENT_COLUMNS)
+            batch = []
+    if batch:
+        EmployeeSearchDocument.objects.bulk_update(batch, CURRENT_COLUMNS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employees', '0011_strip_password_setup_tokens'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, restore_search_index),
+        migrations.AddField(
+            model_name='employeesearchdocument',
+            name='current_company',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='employeesearchdocument',
+            name='current_department',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='employeesearchdocument',
+            name='current_role',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.RunPython(backfill_current_role, migrations.RunPython.noop),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,79 @@
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.reverse import reverse
+
+from .jobs import content_hash, enqueue_upload, find_duplicate_upload, run_job
+from .models import BulkUploadLog
+from .readers import SUPPORTED_EXTENSIONS
+
+
+class BulkUploadJobMixin:
+    """Viewset mixin that hands bulk upload files to the background job queue."""
+
+    def submit_upload(self, request, upload_type, allow_dry_run=False):
+        """
+        Queue the uploaded file and return 202 with the ``BulkUploadLog`` id.
+
+        With ``BULK_UPLOADS_ASYNC`` disabled the job runs inside the request and
+        its result is returned directly. If ``allow_dry_run`` is set,
+        ``?dry_run=1`` stores the changes as a ``BulkEditPlan`` instead of
+        applying them.
+
+        Re-uploading a file that the user or their company already uploaded
+        returns the earlier upload instead of processing the file again, unless
+        ``?force=1`` is given.
+        """
+        if 'file' not in request.FILES:
+            return Response({'error': 'No file provided'}, status=status.HTTP_400_BAD_REQUEST)
+
+        file = request.FILES['file']
+
+        if not file.name.endswith(SUPPORTED_EXTENSIONS):
+            upload_log = BulkUploadLog.objects.create(
+                user=request.user,
+                file_name=file.name,
+                file_size=file.size,
+                upload_type=upload_type
+            )
+            upload_log.mark_failed('Unsupported file type')
+            return Response(
+                {'error': 'Unsupported file type. Please upload CSV, Excel, or TXT file.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        dry_run = allow_dry_run and self._flag(request, 'dry_run')
+        digest = content_hash(file)
+        if not self._flag(request, 'force'):
+            duplicate = find_duplicate_upload(request.user, upload_type, digest, dry_run=dry_run)
+            if duplicate is not None:
+                if duplicate.status == BulkUploadLog.STATUS_COMPLETED:
+                    return Response({**duplicate.result, 'upload_id': duplicate.id, 'duplicate': True})
+                return self._accepted(request, duplicate, duplicate=True)
+
+        upload_log = enqueue_upload(request.user, file, upload_type, dry_run=dry_run, digest=digest)
+
+        if not settings.BULK_UPLOADS_ASYNC:
+            upload_log.status = BulkUploadLog.STATUS_PROCESSING
+            upload_log.started_at = timezone.now()
+            upload_log.save(update_fields=['status', 'started_at'])
+            result = run_job(upload_log)
+            if upload_log.status == BulkUploadLog.STATUS_FAILED:
+                return Response(result, status=status.HTTP_400_BAD_REQUEST)
+            return Response(result)
+
+        return self._accepted(request, upload_log)
+
+    @staticmethod
+    def _flag(request, name):
+        return request.query_params.get(name, '').lower() in ('1', 'true', 'yes')
+
+    @staticmethod
+    def _accepted(request, upload_log, duplicate=False):
+        return Response({
+            'upload_id': upload_log.id,
+            'status': upload_log.status,
+            'status_url': reverse('bulk-upload-detail', args=[upload_log.id], request=request),
+            'duplicate': duplicate,
+        }, status=status.HTTP_202_ACCEPTED)
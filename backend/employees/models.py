@@ -1,9 +1,25 @@
-from django.db import models
+from django.db import models, transaction
 import uuid
-from companies.encryption import EncryptedCharField
+from companies.encryption import EncryptedCharField, EncryptedTextField, BlindIndexField, blind_index
 from companies.models import Company, Department
 from django.conf import settings
 from django.utils import timezone
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class EmployeeQuerySet(models.QuerySet):
+    """QuerySet with blind-index lookups for encrypted employee fields."""
+
+    def by_employee_id(self, employee_id):
+        """Filter employees by exact (plaintext) employee ID."""
+        return self.filter(employee_id_index=blind_index(employee_id))
+
+    def by_employee_ids(self, employee_ids):
+        """Filter employees whose employee ID is in the given iterable."""
+        indexes = {blind_index(value) for value in employee_ids} - {None}
+        return self.filter(employee_id_index__in=indexes)
 
 
 class Employee(models.Model):
@@ -12,6 +28,7 @@ class Employee(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     name = models.CharField(max_length=255)
     employee_id = EncryptedCharField(max_length=50, blank=True, null=True)  # Encrypted for security
+    employee_id_index = BlindIndexField(source='employee_id')  # Blind index for exact lookups
     current_company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='employees')
     current_department = models.ForeignKey(Department, on_delete=models.SET_NULL, null=True, related_name='employees')
     current_role = models.CharField(max_length=100)
@@ -21,6 +38,21 @@ class Employee(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = EmployeeQuerySet.as_manager()
+    
+    class Meta:
+        indexes = [
+            # Keyset pagination order
+            models.Index(fields=['name', 'id'], name='employee_name_id_idx'),
+            # Name lookups within a company (bulk upload) and a company user's pages in keyset order
+            models.Index(fields=['current_company', 'name', 'id'], name='employee_company_name_idx'),
+            # Active employees of a company
+            models.Index(fields=['current_company', 'is_active'], name='employee_company_active_idx'),
+            # Start and leave date filters
+            models.Index(fields=['date_joined'], name='employee_date_joined_idx'),
+            models.Index(fields=['date_left'], name='employee_date_left_idx'),
+        ]
+    
     def __str__(self):
         return f"{self.name} ({self.current_company.name})"
 
@@ -42,62 +74,240 @@ class EmployeeRole(models.Model):
     
     class Meta:
         ordering = ['-start_date']
+        constraints = [
+            # The same role can only be recorded once, so re-running an upload cannot duplicate history
+            models.UniqueConstraint(
+                fields=['employee', 'company', 'title', 'start_date'],
+                name='employeerole_natural_key',
+            ),
+        ]
+        indexes = [
+            # An employee's current roles, ended on every role change; few rows are current
+            models.Index(fields=['employee'], condition=models.Q(is_current=True), name='employeerole_current_idx'),
+            # Role history, newest first
+            models.Index(fields=['employee', '-start_date'], name='employeerole_history_idx'),
+            # Date filters on role history (see employees.filters)
+            models.Index(fields=['start_date'], name='employeerole_start_date_idx'),
+            models.Index(fields=['end_date'], name='employeerole_end_date_idx'),
+        ]
     
     def __str__(self):
         return f"{self.employee.name} - {self.title} at {self.company.name}"
     
     def save(self, *args, **kwargs):
-        """Override save method to handle current role logic."""
-        # If this is a new current role, mark other roles as not current
-        if self.is_current:
-            EmployeeRole.objects.filter(
-                employee=self.employee, 
-                is_current=True
-            ).exclude(pk=self.pk).update(is_current=False)
-            
-            # Update the employee's current information
-            self.employee.current_company = self.company
-            self.employee.current_department = self.department
-            self.employee.current_role = self.title
-            self.employee.save()
-            
-        super().save(*args, **kwargs)
+        """
+        Override save method to handle current role logic.
+        
+        Batches of role changes should use ``employees.roles.transition_roles``
+        instead, which does the same with a fixed number of statements.
+        """
+        with transaction.atomic():
+            # If this is a new current role, mark other roles as not current
+            if self.is_current:
+                EmployeeRole.objects.filter(
+                    employee=self.employee, 
+                    is_current=True
+                ).exclude(pk=self.pk).update(is_current=False, updated_at=timezone.now())
+                
+                # Update the employee's current information, leaving its other columns alone
+                self.employee.current_company = self.company
+                self.employee.current_department = self.department
+                self.employee.current_role = self.title
+                self.employee.save(update_fields=['current_company', 'current_department', 'current_role', 'updated_at'])
+                
+            super().save(*args, **kwargs)
+
+
+class EmployeeSearchDocument(models.Model):
+    """
+    Denormalized full-text search document for an employee.
+    
+    Holds the employee's name and the companies, departments and titles of its
+    current and past roles, and those of its current role on their own. Kept in
+    sync by ``employees.signals`` and by the bulk upload pipeline; the full-text
+    index over it lives in the database (see ``employees.search``).
+    """
+    
+    employee = models.OneToOneField(Employee, on_delete=models.CASCADE, related_name='search_document')
+    name = models.TextField()
+    company = models.TextField(blank=True, default='')
+    department = models.TextField(blank=True, default='')
+    role = models.TextField(blank=True, default='')
+    current_company = models.TextField(blank=True, default='')
+    current_department = models.TextField(blank=True, default='')
+    current_role = models.TextField(blank=True, default='')
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Search document for {self.name}"
 
 
 class BulkUploadLog(models.Model):
-    """Model to track bulk uploads."""
+    """Model to track bulk uploads. Doubles as the job record for the upload queue."""
+    
+    STATUS_QUEUED = 'queued'
+    STATUS_PROCESSING = 'processing'
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
     
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     file_name = models.CharField(max_length=255)
     file_size = models.IntegerField()
-    upload_type = models.CharField(max_length=20)  # 'employee' or 'company'
+    upload = models.FileField(upload_to='bulk_uploads/%Y/%m/%d/', blank=True, null=True)  # Removed once processed
+    content_hash = models.CharField(max_length=64, blank=True, default='')  # SHA-256 of the file, to spot re-uploads
+    upload_type = models.CharField(max_length=20)  # 'employee', 'employee_edit', 'company_with_user' or 'company_edit'
+    dry_run = models.BooleanField(default=False)  # Edit uploads only: store a BulkEditPlan instead of applying it
+    records_total = models.IntegerField(blank=True, null=True)  # Unknown until the file has been read
     records_processed = models.IntegerField(default=0)
     records_created = models.IntegerField(default=0)
     records_updated = models.IntegerField(default=0)
     errors = models.IntegerField(default=0)
     error_details = models.TextField(blank=True, null=True)
-    status = models.CharField(max_length=20, default='processing')  # 'processing', 'completed', 'failed'
+    result = models.JSONField(blank=True, null=True)  # Response payload once the job has finished
+    status = models.CharField(max_length=20, default=STATUS_PROCESSING)  # 'queued', 'processing', 'completed', 'failed'
+    worker = models.CharField(max_length=100, blank=True, default='')
+    attempts = models.IntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    heartbeat_at = models.DateTimeField(blank=True, null=True)
     completed_at = models.DateTimeField(blank=True, null=True)
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='bulkupload_status_created_idx'),
+            models.Index(fields=['content_hash'], name='bulkupload_content_hash_idx'),
+        ]
+    
     def __str__(self):
         return f"{self.upload_type} upload by {self.user.email} on {self.created_at}"
     
-    def mark_completed(self, records_processed, records_created, records_updated, errors=0, error_details=None):
-        """Mark the upload as completed with stats."""
+    def claimed(self):
+        """
+        Rows of this upload still held by the worker running it. Empty once the
+        job has been requeued and claimed by another worker, or has finished.
+        """
+        return BulkUploadLog.objects.filter(pk=self.pk, status=self.STATUS_PROCESSING, worker=self.worker)
+    
+    def report_progress(self, records_processed, records_created=0, records_updated=0, errors=0):
+        """Publish live progress counters without overwriting the rest of the row."""
         self.records_processed = records_processed
         self.records_created = records_created
         self.records_updated = records_updated
         self.errors = errors
-        self.error_details = error_details
-        self.status = 'completed'
-        self.completed_at = timezone.now()
-        self.save()
+        self.heartbeat_at = timezone.now()
+        self.claimed().update(
+            records_total=self.records_total,
+            records_processed=records_processed,
+            records_created=records_created,
+            records_updated=records_updated,
+            errors=errors,
+            heartbeat_at=self.heartbeat_at,
+        )
+    
+    def _finish(self, **fields):
+        """Record the outcome unless the job is no longer ours, and return whether it was recorded."""
+        fields['completed_at'] = timezone.now()
+        if not self.claimed().update(**fields):
+            logger.warning(f"Bulk upload {self.pk} was claimed by another worker; not recording its outcome")
+            return False
+        for name, value in fields.items():
+            setattr(self, name, value)
+        return True
+    
+    def mark_completed(self, records_processed, records_created, records_updated, errors=0, error_details=None, result=None):
+        """Mark the upload as completed with stats."""
+        return self._finish(
+            records_total=self.records_total,
+            records_processed=records_processed,
+            records_created=records_created,
+            records_updated=records_updated,
+            errors=errors,
+            error_details=error_details,
+            result=result,
+            status=self.STATUS_COMPLETED,
+        )
     
-    def mark_failed(self, error_details):
+    def mark_failed(self, error_details, result=None):
         """Mark the upload as failed with error details."""
-        self.status = 'failed'
-        self.error_details = error_details
-        self.completed_at = timezone.now()
-        self.save()
+        return self._finish(status=self.STATUS_FAILED, error_details=error_details, result=result)
+
+
+class BulkUploadError(models.Model):
+    """
+    One error or warning reported while processing a bulk upload.
+    
+    Written in batches by ``employees.errors.UploadErrors``; the upload's own
+    ``error_details`` only keeps the first few messages.
+    """
+    
+    MISSING_VALUE = 'missing_value'
+    INVALID_VALUE = 'invalid_value'
+    NOT_FOUND = 'not_found'
+    PERMISSION_DENIED = 'permission_denied'
+    AMBIGUOUS = 'ambiguous'
+    DUPLICATE = 'duplicate'  # Rows skipped because what they describe already exists
+    CONFLICT = 'conflict'  # Rows changed by someone else while the upload was processed
+    FAILED = 'failed'  # Unexpected errors while writing a row
+    
+    upload_log = models.ForeignKey(BulkUploadLog, on_delete=models.CASCADE, related_name='error_records')
+    row = models.IntegerField(blank=True, null=True)  # Row number in the uploaded file
+    code = models.CharField(max_length=30)
+    message = models.TextField()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['upload_log', 'id'], name='bulkuploaderror_log_id_idx'),
+        ]
+    
+    def __str__(self):
+        return self.message
+
+
+class BulkEditPlan(models.Model):
+    """
+    Changes a ``bulk_edit`` upload would make, stored by a dry run.
+
+    The plan can be reviewed page by page and applied later without reading
+    the file again (see ``employees.plans``).
+    """
+    
+    STATUS_PENDING = 'pending'
+    STATUS_APPLIED = 'applied'
+    STATUS_STALE = 'stale'
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    upload_log = models.OneToOneField(BulkUploadLog, on_delete=models.CASCADE, related_name='plan')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    upload_type = models.CharField(max_length=20)  # 'employee_edit' or 'company_edit'
+    summary = models.JSONField(default=dict)  # Number of changes per action and field
+    status = models.CharField(max_length=20, default=STATUS_PENDING)  # 'pending', 'applied' or 'stale'
+    created_at = models.DateTimeField(auto_now_add=True)
+    applied_at = models.DateTimeField(blank=True, null=True)
+    
+    def __str__(self):
+        return f"{self.upload_type} plan by {self.user.email} on {self.created_at}"
+
+
+class BulkEditChange(models.Model):
+    """
+    One change of a ``BulkEditPlan``.
+    
+    Values are stored as encrypted JSON since they can come from encrypted columns.
+    """
+    
+    plan = models.ForeignKey(BulkEditPlan, on_delete=models.CASCADE, related_name='changes')
+    row = models.IntegerField()  # Row number in the uploaded file
+    action = models.CharField(max_length=20)  # See employees.plans
+    target_id = models.UUIDField()  # Employee or company the change applies to
+    field = models.CharField(max_length=50, blank=True, default='')
+    old_value = EncryptedTextField(blank=True, null=True)
+    new_value = EncryptedTextField(blank=True, null=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['plan', 'id'], name='bulkeditchange_plan_id_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Row {self.row}: {self.action} {self.field}"
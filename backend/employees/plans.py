@@ -0,0 +1,239 @@
+"""
+Change plans for ``bulk_edit`` uploads.
+
+Edit uploads are handled in two steps that share one code path. A
+``BulkEditor`` first turns the validated rows of a chunk into
+``PlannedChange`` tuples using set-based reads only, then ``apply`` writes
+them with bulk operations in one transaction.
+
+A normal upload applies each chunk's changes straight away. A dry run
+(``?dry_run=1``) stores them as a ``BulkEditPlan`` instead. The plan can be
+reviewed page by page and applied later by id with ``apply_plan``, which
+replays the stored changes without reading the file or resolving its rows
+again. Every update records the value it replaces; if that value has changed
+by the time the plan is applied, nothing is written and the plan is marked
+stale.
+"""
+from collections import Counter, namedtuple
+from itertools import groupby
+from operator import attrgetter
+import json
+import logging
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from companies.encryption import LazyDecrypted
+from .jobs import UploadFileError, upload_chunks
+from .errors import UploadErrors
+from .models import BulkEditChange, BulkEditPlan, BulkUploadError
+
+logger = logging.getLogger(__name__)
+
+PlannedChange = namedtuple('PlannedChange', ['row', 'action', 'target_id', 'field', 'old', 'new'])
+
+# Actions of a planned change
+UPDATE = 'update'  # Set ``field`` of the target from ``old`` to ``new``
+CREATE_DEPARTMENT = 'create_department'  # Create department ``new`` in company ``target_id``
+END_ROLE = 'end_role'  # End the employee's current roles on date ``new``
+START_ROLE = 'start_role'  # Give the employee the current role described by ``new``
+
+# Editor for each upload type that can be planned, as dotted paths to avoid import cycles between apps
+PLAN_EDITORS = {
+    'employee_edit': 'employees.ingest.EmployeeBulkEditor',
+    'company_edit': 'companies.ingest.CompanyBulkEditor',
+}
+
+
+class PlanConflict(Exception):
+    """Raised when a row changed between planning and applying a change to it."""
+
+    def __init__(self, row, message):
+        self.row = row
+        super().__init__(message)
+
+
+def _encode(value):
+    if isinstance(value, LazyDecrypted):
+        value = str(value) if value.decrypts() else None
+    return json.dumps(value, cls=DjangoJSONEncoder)
+
+
+def summarize(changes, summary=None):
+    """Count ``changes`` per action, and per field for updates, into ``summary``."""
+    summary = Counter(summary or {})
+    for change in changes:
+        summary[f'{change.action}.{change.field}' if change.action == UPDATE else change.action] += 1
+    return dict(summary)
+
+
+def save_changes(plan, changes):
+    """Store ``changes`` on ``plan``."""
+    BulkEditChange.objects.bulk_create([
+        BulkEditChange(
+            plan=plan,
+            row=change.row,
+            action=change.action,
+            target_id=change.target_id,
+            field=change.field,
+            old_value=_encode(change.old),
+            new_value=_encode(change.new),
+        )
+        for change in changes
+    ], batch_size=settings.BULK_UPLOAD_CHUNK_SIZE)
+
+
+def stored_changes(plan, chunk_size=None):
+    """Yield the changes of ``plan`` as lists of ``PlannedChange``, in file order."""
+    chunk_size = chunk_size or settings.BULK_UPLOAD_CHUNK_SIZE
+    chunk = []
+    for stored in plan.changes.order_by('id').iterator(chunk_size=chunk_size):
+        change = PlannedChange(
+            stored.row, stored.action, stored.target_id, stored.field,
+            json.loads(str(stored.old_value)), json.loads(str(stored.new_value)),
+        )
+        # Keep the changes of a row together
+        if len(chunk) >= chunk_size and change.row != chunk[-1].row:
+            yield chunk
+            chunk = []
+        chunk.append(change)
+    if chunk:
+        yield chunk
+
+
+class BulkEditor:
+    """
+    Base class for ``bulk_edit`` upload handlers.
+
+    Subclasses set ``schema`` and ``row_label`` and implement ``plan_rows``,
+    which turns the valid rows of a chunk into changes without writing
+    anything, and ``apply``, which writes a list of changes.
+
+    What earlier chunks planned is kept in memory until ``reset_planning``,
+    so a dry run plans every chunk on top of the ones before it. When chunks
+    are applied as they go, the state is reset after each one and the next
+    chunk reads what was actually written.
+    """
+
+    schema = None
+    # What a row describes, for log messages
+    row_label = 'row'
+
+    def __init__(self, user, upload_log=None):
+        self.user = user
+        self.report = UploadErrors(upload_log)
+        self.processed = 0
+        self.updated = 0
+        self.summary = {}
+        self.reset_planning()
+
+    def reset_planning(self):
+        """Forget the state planned so far."""
+
+    @property
+    def errors(self):
+        return self.report.errors
+
+    def _add_error(self, number, message, code=BulkUploadError.FAILED):
+        self.report.add(number, f"Error in row {number}: {message}", code)
+        logger.error(f"Error processing {self.row_label} row {number}: {message}")
+
+    def plan(self, df):
+        """Validate a chunk and return the changes its rows would make."""
+        self.processed += len(df)
+        clean, invalid = self.schema.validate(df)
+        for number, code, message in invalid.itertuples(index=False):
+            self._add_error(number, message, code)
+        return self.plan_rows(clean)
+
+    def plan_rows(self, rows):
+        raise NotImplementedError
+
+    def apply(self, changes):
+        raise NotImplementedError
+
+    def _count(self, changes):
+        self.updated += len({change.row for change in changes})
+        self.summary = summarize(changes, self.summary)
+
+    def apply_changes(self, changes):
+        """Apply ``changes`` in one transaction."""
+        with transaction.atomic():
+            self.apply(changes)
+        self._count(changes)
+
+    def apply_chunk(self, changes):
+        """
+        Apply a chunk's changes, retrying row by row if the chunk fails so the
+        error is reported against the row that caused it.
+        """
+        try:
+            self.apply_changes(changes)
+        except Exception:
+            for row, row_changes in groupby(changes, key=attrgetter('row')):
+                try:
+                    self.apply_changes(list(row_changes))
+                except PlanConflict as e:
+                    self._add_error(row, str(e), BulkUploadError.CONFLICT)
+                except Exception as e:
+                    self._add_error(row, str(e))
+
+    def run(self, upload_log):
+        """Plan every chunk of the upload, then apply it or store it as a plan."""
+        plan = None
+        if upload_log.dry_run:
+            plan = BulkEditPlan.objects.create(
+                upload_log=upload_log,
+                user=upload_log.user,
+                upload_type=upload_log.upload_type,
+            )
+
+        with upload_chunks(upload_log) as chunks:
+            for df in chunks:
+                # Validate required columns
+                missing_columns = self.schema.missing_columns(df)
+                if missing_columns:
+                    raise UploadFileError(f"Missing required column: {', '.join(missing_columns)}")
+                changes = self.plan(df)
+                if plan is not None:
+                    save_changes(plan, changes)
+                    self._count(changes)
+                else:
+                    self.apply_chunk(changes)
+                    self.reset_planning()
+                self.report.flush()
+                upload_log.report_progress(self.processed, 0, self.updated, self.errors)
+
+        if plan is not None:
+            plan.summary = self.summary
+            plan.save(update_fields=['summary'])
+        return plan
+
+
+def apply_plan(plan):
+    """
+    Apply a stored plan in one transaction and return the editor that applied it.
+
+    Raises ``PlanConflict``, and marks the plan stale, if any row it changes
+    was modified after the plan was made. ``PlanConflict.row`` is None when
+    the conflict was only detected by a database constraint.
+    """
+    editor = import_string(PLAN_EDITORS[plan.upload_type])(plan.user)
+    try:
+        with transaction.atomic():
+            for changes in stored_changes(plan):
+                editor.apply_changes(changes)
+            plan.status = BulkEditPlan.STATUS_APPLIED
+            plan.applied_at = timezone.now()
+            plan.save(update_fields=['status', 'applied_at'])
+    except (PlanConflict, IntegrityError) as e:
+        BulkEditPlan.objects.filter(pk=plan.pk).update(status=BulkEditPlan.STATUS_STALE)
+        plan.status = BulkEditPlan.STATUS_STALE
+        if isinstance(e, IntegrityError):
+            # e.g. a role the plan adds has been recorded since
+            raise PlanConflict(None, f"The plan conflicts with data changed since it was made ({e})") from e
+        raise
+    return editor
@@ -0,0 +1,91 @@
+"""
+Streaming readers for bulk upload files.
+
+Uploads are read in DataFrame chunks of at most ``BULK_UPLOAD_CHUNK_SIZE`` rows
+so memory stays bounded regardless of file size. Chunks keep a running index,
+so ``index + 1`` is still the row number within the whole file. Blank rows are
+left out of the chunks but still counted, so they do not shift the numbers of
+the rows after them.
+"""
+from django.conf import settings
+import pandas as pd
+
+SUPPORTED_EXTENSIONS = ('.csv', '.xls', '.xlsx', '.txt')
+
+
+class UnsupportedFileType(ValueError):
+    """Raised for files whose extension has no reader."""
+
+
+def _sniff_separator(file):
+    """Use tabs for text files whose header line contains one, commas otherwise."""
+    header = file.readline()
+    file.seek(0)
+    return '\t' if b'\t' in header else ','
+
+
+def _iter_csv(file, chunksize, sep=','):
+    # Read every column as text: types are inferred per chunk otherwise, so the
+    # same column could come back as int in one chunk and float in the next
+    chunks = pd.read_csv(
+        file, sep=sep, dtype=str, encoding='utf-8-sig', skip_blank_lines=False, chunksize=chunksize
+    )
+    for chunk in chunks:
+        chunk = chunk.dropna(how='all')
+        if len(chunk):
+            yield chunk
+
+
+def _iter_xlsx(file, chunksize):
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [
+            str(name).strip() if name is not None else f'Unnamed: {position}'
+            for position, name in enumerate(header)
+        ]
+        chunk = []
+        positions = []
+        for position, row in enumerate(rows):
+            if all(value is None for value in row):
+                continue
+            chunk.append(row[:len(columns)])
+            positions.append(position)
+            if len(chunk) >= chunksize:
+                yield pd.DataFrame(chunk, columns=columns, index=pd.Index(positions))
+                chunk = []
+                positions = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=columns, index=pd.Index(positions))
+    finally:
+        workbook.close()
+
+
+def _iter_xls(file, chunksize):
+    # The legacy binary format cannot be streamed; read it whole and slice it
+    df = pd.read_excel(file).dropna(how='all')
+    for start in range(0, len(df), chunksize):
+        yield df.iloc[start:start + chunksize].copy()
+
+
+def iter_upload_chunks(file, file_name, chunksize=None):
+    """
+    Yield the rows of an uploaded file as DataFrames of at most ``chunksize`` rows.
+
+    ``file`` must be a binary, seekable file object.
+    """
+    chunksize = chunksize or settings.BULK_UPLOAD_CHUNK_SIZE
+    if file_name.endswith('.csv'):
+        return _iter_csv(file, chunksize)
+    elif file_name.endswith('.txt'):
+        return _iter_csv(file, chunksize, sep=_sniff_separator(file))
+    elif file_name.endswith('.xlsx'):
+        return _iter_xlsx(file, chunksize)
+    elif file_name.endswith('.xls'):
+        return _iter_xls(file, chunksize)
+    raise UnsupportedFileType('Unsupported file type. Please upload CSV, Excel, or TXT file.')
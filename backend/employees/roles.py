@@ -0,0 +1,75 @@
+"""
+Set-based role transitions.
+
+A ``RoleTransition(employee, role, effective_date)`` ends the employee's
+current roles on ``effective_date`` and, unless ``role`` is None, makes the
+unsaved ``role`` its current one, copying the role's company, department and
+title onto the employee. ``transition_roles`` applies a batch of transitions
+with the same statements however large it is: one UPDATE ending the stored
+current roles, one INSERT of the new roles and one bulk UPDATE of the
+employees that got one. Transitions of one employee apply in order, so a role
+opened earlier in the batch is ended in memory by a later transition.
+
+``EmployeeRole.save()`` does the same for a single role, with signals.
+"""
+from collections import namedtuple
+
+from django.db.models import Case, DateField, F, Value, When
+from django.utils import timezone
+
+from .models import Employee, EmployeeRole
+
+RoleTransition = namedtuple('RoleTransition', ['employee', 'role', 'effective_date'])
+
+# Employee fields that mirror its current role
+CURRENT_ROLE_FIELDS = ('current_company', 'current_department', 'current_role')
+
+
+def transition_roles(transitions, now=None):
+    """
+    Apply ``transitions`` and return the employees whose current role changed.
+
+    An ``effective_date`` of None ends current roles without setting their
+    end date. Like other bulk writes this skips signals: callers rebuild
+    search documents and record company stats changes themselves.
+    """
+    now = now or timezone.now()
+    # Date ending each employee's stored current roles
+    end_dates = {}
+    # Role opened in this batch that is still current, per employee
+    opened = {}
+    roles = []
+    employees = {}
+
+    for employee, role, effective_date in transitions:
+        previous = opened.pop(employee.pk, None)
+        if previous is not None:
+            previous.is_current = False
+            previous.end_date = effective_date or previous.end_date
+        else:
+            end_dates.setdefault(employee.pk, effective_date)
+
+        if role is not None:
+            role.employee = employee
+            role.is_current = True
+            role.updated_at = now
+            roles.append(role)
+            opened[employee.pk] = role
+            employee.current_company_id = role.company_id
+            employee.current_department = role.department
+            employee.current_role = role.title
+            employee.updated_at = now
+            employees[employee.pk] = employee
+
+    if end_dates:
+        dated = [When(employee_id=pk, then=Value(end_date)) for pk, end_date in end_dates.items() if end_date]
+        EmployeeRole.objects.filter(employee_id__in=end_dates, is_current=True).update(
+            is_current=False,
+            end_date=Case(*dated, default=F('end_date'), output_field=DateField()) if dated else F('end_date'),
+            updated_at=now,
+        )
+    # Created after the UPDATE above so it does not end them
+    EmployeeRole.objects.bulk_create(roles)
+    if employees:
+        Employee.objects.bulk_update(employees.values(), [*CURRENT_ROLE_FIELDS, 'updated_at'])
+    return list(employees.values())
@@ -0,0 +1,125 @@
+"""
+Column-wise validation of bulk upload chunks.
+
+An ``UploadSchema`` lists the columns an upload type understands. ``validate``
+runs once per chunk and does all per-cell work with vectorized pandas
+operations: strings are stripped (blank cells become None), dates, integers
+and booleans are coerced, and rows with a missing required value or an
+unparseable one are split off into an error frame. Row processors then iterate
+the clean frame with ``itertuples`` and only ever see plain Python values.
+"""
+import pandas as pd
+
+TRUE_VALUES = ('true', 't', 'yes', 'y', '1')
+FALSE_VALUES = ('false', 'f', 'no', 'n', '0')
+
+
+def _blank(data):
+    return pd.Series([None] * len(data), index=data.index, dtype=object)
+
+
+def text_column(df, column):
+    """Return a stripped string column with blanks turned into None."""
+    if column not in df.columns:
+        return _blank(df)
+    values = df[column]
+    cleaned = values.astype(str).str.strip().astype(object)
+    return cleaned.where(values.notna() & (cleaned != ''), None)
+
+
+def _coerce_str(raw):
+    return raw, pd.Series(False, index=raw.index)
+
+
+def _coerce_date(raw):
+    parsed = pd.to_datetime(raw, errors='coerce', format='mixed')
+    values = parsed.dt.date.astype(object).where(parsed.notna(), None)
+    return values, raw.notna() & parsed.isna()
+
+
+def _coerce_int(raw):
+    numbers = pd.to_numeric(raw, errors='coerce')
+    valid = numbers.notna() & (numbers % 1 == 0)
+    values = numbers.where(valid).astype('Int64').astype(object).where(valid, None)
+    return values, raw.notna() & ~valid
+
+
+def _coerce_bool(raw):
+    lowered = raw.str.lower()
+    true, false = lowered.isin(TRUE_VALUES), lowered.isin(FALSE_VALUES)
+    values = _blank(raw).mask(true, True).mask(false, False)
+    return values, raw.notna() & ~(true | false)
+
+
+COERCERS = {
+    'str': _coerce_str,
+    'date': _coerce_date,
+    'int': _coerce_int,
+    'bool': _coerce_bool,
+}
+
+
+class Column:
+    """An upload column: its type (``str``, ``date``, ``int`` or ``bool``) and whether every row needs a value."""
+
+    def __init__(self, name, type='str', required=False):
+        if type not in COERCERS:
+            raise ValueError(f"Unknown column type '{type}'")
+        self.name = name
+        self.type = type
+        self.required = required
+
+
+class UploadSchema:
+    """The columns of one upload type, validated together a chunk at a time."""
+
+    def __init__(self, *columns, required_columns=None):
+        self.columns = columns
+        # Columns the file must have; defaults to those whose values are required
+        self.required_columns = required_columns or [column.name for column in columns if column.required]
+
+    @property
+    def names(self):
+        return [column.name for column in self.columns]
+
+    def missing_columns(self, df):
+        """Required columns that ``df`` does not have at all."""
+        return [name for name in self.required_columns if name not in df.columns]
+
+    def validate(self, df):
+        """
+        Return ``(clean, errors)`` for the chunk ``df``.
+
+        ``clean`` has one column per schema column, in schema order, holding
+        stripped strings, ``date`` objects, ints, bools or None, and only the
+        valid rows. Its index is the 1-based row number used in error
+        messages. ``errors`` has ``row``, ``code`` (``missing_value`` or
+        ``invalid_value``) and ``message`` columns with one entry per invalid
+        row, reporting the first failing column in schema order.
+        """
+        numbers = pd.Index(df.index + 1, name='row')
+        values = {}
+        messages = _blank(df)
+        codes = _blank(df)
+        for column in self.columns:
+            raw = text_column(df, column.name)
+            values[column.name], invalid = COERCERS[column.type](raw)
+
+            first = messages.isna()
+            if column.required:
+                missing = first & raw.isna()
+                messages = messages.mask(missing, f"Missing value for '{column.name}'")
+                codes = codes.mask(missing, 'missing_value')
+            invalid = first & invalid
+            messages = messages.mask(invalid, f"Invalid '{column.name}' value '" + raw.fillna('') + "'")
+            codes = codes.mask(invalid, 'invalid_value')
+
+        failed = messages.notna().to_numpy()
+        clean = pd.DataFrame(values, columns=self.names)
+        clean.index = numbers
+        errors = pd.DataFrame({
+            'row': numbers[failed],
+            'code': codes[failed].to_numpy(),
+            'message': messages[failed].to_numpy(),
+        })
+        return clean[~failed], errors
@@ -0,0 +1,198 @@
+"""
+Full-text search over employees.
+
+Every employee has an ``EmployeeSearchDocument`` with its name and the
+companies, departments and role titles of its current and past roles, and
+separately those of its current role only. The database keeps a full-text
+index over those columns:
+
+- SQLite: an FTS5 table (``employees_search_fts``) filled by triggers on the
+  document table.
+- PostgreSQL: generated ``tsvector`` columns with GIN indexes, weighted
+  A (name), B (role), C (company) and D (department): ``search_vector`` over
+  every role and ``current_search_vector`` over the current one.
+
+Other databases fall back to ``icontains`` over the document columns, which
+still avoids joining every historical role.
+
+Search text is split into words and every word must match the start of a
+word in the document, so typing "eng" finds "Engineering".
+"""
+from functools import reduce
+from operator import or_
+import re
+
+from django.db import connection
+from django.db.models import FloatField, Prefetch, Q, Value
+from django.db.models.expressions import RawSQL
+
+from .models import Employee, EmployeeRole, EmployeeSearchDocument
+
+SEARCH_FIELDS = ('name', 'company', 'department', 'role')
+# Fields matching the current role only
+CURRENT_FIELDS = ('current_company', 'current_department', 'current_role')
+
+FTS_TABLE = 'employees_search_fts'
+DOCUMENT_TABLE = EmployeeSearchDocument._meta.db_table
+
+# Weight labels of the document columns in the PostgreSQL tsvector
+_WEIGHTS = {
+    'name': 'A', 'role': 'B', 'company': 'C', 'department': 'D',
+    'current_role': 'B', 'current_company': 'C', 'current_department': 'D',
+}
+
+
+def _terms(text):
+    return re.findall(r'\w+', str(text).lower())
+
+
+def _fts5_query(criteria):
+    parts = []
+    for field, text in criteria:
+        terms = ' '.join(f'"{term}"*' for term in _terms(text))
+        parts.append(f'{{{field}}} : ({terms})' if field else f'({terms})')
+    return ' AND '.join(parts)
+
+
+def _tsquery(criteria):
+    return ' & '.join(
+        f"'{term}':*{_WEIGHTS[field] if field else ''}"
+        for field, text in criteria
+        for term in _terms(text)
+    )
+
+
+def _tsqueries(criteria):
+    """``(tsvector column, tsquery)`` of the criteria on every role and on the current one."""
+    queries = []
+    for column, criteria in [
+        ('search_vector', [criterion for criterion in criteria if criterion[0] not in CURRENT_FIELDS]),
+        ('current_search_vector', [criterion for criterion in criteria if criterion[0] in CURRENT_FIELDS]),
+    ]:
+        if criteria:
+            queries.append((column, _tsquery(criteria)))
+    return queries
+
+
+def search_condition(*criteria):
+    """
+    Q matching employees whose search document matches every criterion.
+
+    Each criterion is a ``(field, text)`` pair where ``field`` is one of
+    ``SEARCH_FIELDS`` or ``CURRENT_FIELDS``, or None to search all of
+    ``SEARCH_FIELDS``.
+    """
+    if any(not _terms(text) for _, text in criteria):
+        # Nothing searchable (e.g. only punctuation) can match no document
+        return Q(pk__in=[])
+
+    if connection.vendor == 'sqlite':
+        return Q(pk__in=RawSQL(
+            f'SELECT d.employee_id FROM {FTS_TABLE} '
+            f'JOIN {DOCUMENT_TABLE} d ON d.id = {FTS_TABLE}.rowid '
+            f'WHERE {FTS_TABLE} MATCH %s',
+            [_fts5_query(criteria)]
+        ))
+    if connection.vendor == 'postgresql':
+        queries = _tsqueries(criteria)
+        return Q(pk__in=RawSQL(
+            f"SELECT employee_id FROM {DOCUMENT_TABLE} WHERE "
+            + ' AND '.join(f"{column} @@ to_tsquery('simple', %s)" for column, _ in queries),
+            [query for _, query in queries]
+        ))
+
+    condition = Q()
+    for field, text in criteria:
+        fields = [field] if field else SEARCH_FIELDS
+        for term in _terms(text):
+            condition &= reduce(or_, (Q(**{f'search_document__{name}__icontains': term}) for name in fields))
+    return condition
+
+
+def search_rank(*criteria):
+    """Relevance of each employee for ``criteria`` (higher is better) for use in ``annotate``."""
+    if connection.vendor == 'sqlite':
+        # FTS5's rank is bm25, where lower is better
+        return RawSQL(
+            f'(SELECT -{FTS_TABLE}.rank FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s AND {FTS_TABLE}.rowid = '
+            f'(SELECT id FROM {DOCUMENT_TABLE} WHERE employee_id = "employees_employee"."id"))',
+            [_fts5_query(criteria)],
+            output_field=FloatField()
+        )
+    if connection.vendor == 'postgresql':
+        queries = _tsqueries(criteria)
+        return RawSQL(
+            '(SELECT '
+            + ' + '.join(f"ts_rank({column}, to_tsquery('simple', %s))" for column, _ in queries)
+            + f' FROM {DOCUMENT_TABLE} WHERE employee_id = "employees_employee"."id")',
+            [query for _, query in queries],
+            output_field=FloatField()
+        )
+    return Value(0.0, output_field=FloatField())
+
+
+def _join_unique(values):
+    return '\n'.join(dict.fromkeys(value for value in values if value))
+
+
+def build_document(employee):
+    """Search document for ``employee``, whose roles (with company and department) should be prefetched."""
+    roles = list(employee.roles.all())
+    return EmployeeSearchDocument(
+        employee=employee,
+        name=employee.name,
+        company=_join_unique(
+            [employee.current_company.name] + [role.company.name for role in roles]
+        ),
+        department=_join_unique(
+            [employee.current_department.name if employee.current_department else None]
+            + [role.department.name for role in roles if role.department]
+        ),
+        role=_join_unique([employee.current_role] + [role.title for role in roles]),
+        current_company=employee.current_company.name,
+        current_department=employee.current_department.name if employee.current_department else '',
+        current_role=employee.current_role or '',
+    )
+
+
+def _save_documents(documents):
+    EmployeeSearchDocument.objects.bulk_create(
+        documents,
+        update_conflicts=True,
+        unique_fields=['employee'],
+        update_fields=['name', 'company', 'department', 'role', *CURRENT_FIELDS, 'updated_at'],
+    )
+    return len(documents)
+
+
+def rebuild_search_documents(employee_ids=None, batch_size=2000):
+    """
+    Recompute the search documents of the given employees, or of every employee.
+
+    Ids of employees that no longer exist are ignored. Returns the number of
+    documents written.
+    """
+    employees = Employee.objects.select_related('current_company', 'current_department').prefetch_related(
+        Prefetch('roles', queryset=EmployeeRole.objects.select_related('company', 'department'))
+    ).order_by('pk')
+
+    if employee_ids is None:
+        batches = [employees]
+    else:
+        employee_ids = list(dict.fromkeys(employee_ids))
+        batches = [
+            employees.filter(pk__in=employee_ids[start:start + batch_size])
+            for start in range(0, len(employee_ids), batch_size)
+        ]
+
+    written = 0
+    for batch in batches:
+        documents = []
+        for employee in batch.iterator(chunk_size=batch_size):
+            documents.append(build_document(employee))
+            if len(documents) >= batch_size:
+                written += _save_documents(documents)
+                documents = []
+        if documents:
+            written += _save_documents(documents)
+    return written
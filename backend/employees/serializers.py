@@ -1,5 +1,8 @@
+import json
+
 from rest_framework import serializers
-from .models import Employee, EmployeeRole, BulkUploadLog
+from rest_framework.reverse import reverse
+from .models import Employee, EmployeeRole, BulkUploadLog, BulkUploadError, BulkEditPlan, BulkEditChange
 
 class EmployeeRoleSerializer(serializers.ModelSerializer):
     """Serializer for EmployeeRole model."""
@@ -47,12 +50,52 @@ class BulkUploadLogSerializer(serializers.ModelSerializer):
     """Serializer for BulkUploadLog model."""
     
     user_email = serializers.CharField(source='user.email', read_only=True)
+    errors_url = serializers.SerializerMethodField()
     
     class Meta:
         model = BulkUploadLog
         fields = [
-            'id', 'user', 'user_email', 'file_name', 'file_size', 'upload_type',
-            'records_processed', 'records_created', 'records_updated', 'errors',
-            'error_details', 'status', 'created_at', 'completed_at'
+            'id', 'user', 'user_email', 'file_name', 'file_size', 'upload_type', 'dry_run',
+            'records_total', 'records_processed', 'records_created', 'records_updated', 'errors',
+            'error_details', 'result', 'status', 'attempts', 'created_at', 'started_at',
+            'heartbeat_at', 'completed_at', 'errors_url'
         ]
-        read_only_fields = ['id', 'created_at', 'completed_at']
\ No newline at end of file
+        read_only_fields = fields
+    
+    def get_errors_url(self, obj):
+        return reverse('bulk-upload-errors', args=[obj.pk], request=self.context.get('request'))
+
+
+class BulkUploadErrorSerializer(serializers.ModelSerializer):
+    """Serializer for BulkUploadError model."""
+    
+    class Meta:
+        model = BulkUploadError
+        fields = ['row', 'code', 'message']
+        read_only_fields = fields
+
+class BulkEditPlanSerializer(serializers.ModelSerializer):
+    """Serializer for BulkEditPlan model."""
+    
+    class Meta:
+        model = BulkEditPlan
+        fields = ['id', 'upload_log', 'user', 'upload_type', 'summary', 'status', 'created_at', 'applied_at']
+        read_only_fields = fields
+
+
+class BulkEditChangeSerializer(serializers.ModelSerializer):
+    """Serializer for BulkEditChange model, with the stored JSON values decoded."""
+    
+    old_value = serializers.SerializerMethodField()
+    new_value = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = BulkEditChange
+        fields = ['row', 'action', 'target_id', 'field', 'old_value', 'new_value']
+        read_only_fields = fields
+    
+    def get_old_value(self, obj):
+        return json.loads(str(obj.old_value))
+    
+    def get_new_value(self, obj):
+        return json.loads(str(obj.new_value))
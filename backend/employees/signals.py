@@ -0,0 +1,95 @@
+"""
+Keep employee search documents and company statistics in sync with the rows
+they are built from.
+
+Bulk operations that bypass ``save()`` (``bulk_create``, ``update``) must call
+``rebuild_search_documents`` and ``record_employee_changes`` themselves.
+"""
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from companies.models import Company, Department
+from companies.stats import STATS_FIELDS, record_employee_changes, stats_key, stored_stats_keys
+from .models import Employee, EmployeeRole
+from .search import rebuild_search_documents
+
+
+@receiver(post_save, sender=Employee)
+def employee_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        rebuild_search_documents([instance.pk])
+
+
+def _affects_stats(update_fields):
+    return update_fields is None or any(field.removesuffix('_id') in update_fields for field in STATS_FIELDS)
+
+
+@receiver(pre_save, sender=Employee)
+def remember_stats(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or not _affects_stats(update_fields):
+        return
+    if instance._state.adding:
+        instance._previous_stats = None
+    else:
+        instance._previous_stats = stored_stats_keys(sender.objects.filter(pk=instance.pk)).get(instance.pk)
+
+
+@receiver(post_save, sender=Employee)
+def employee_stats_saved(sender, instance, raw=False, update_fields=None, **kwargs):
+    if not raw and _affects_stats(update_fields):
+        record_employee_changes([instance._previous_stats], [stats_key(instance)])
+
+
+@receiver(post_delete, sender=Employee)
+def employee_deleted(sender, instance, **kwargs):
+    record_employee_changes([stats_key(instance)])
+
+
+@receiver(post_save, sender=EmployeeRole)
+def role_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        rebuild_search_documents([instance.employee_id])
+
+
+@receiver(post_delete, sender=EmployeeRole)
+def role_deleted(sender, instance, **kwargs):
+    # Wait for the commit: when the employee itself is being deleted its
+    # document must not be recreated halfway through the cascade
+    employee_id = instance.employee_id
+    transaction.on_commit(lambda: rebuild_search_documents([employee_id]))
+
+
+@receiver(pre_save, sender=Company)
+@receiver(pre_save, sender=Department)
+def remember_name(sender, instance, raw=False, **kwargs):
+    if not raw and not instance._state.adding:
+        instance._previous_name = sender.objects.filter(pk=instance.pk).values_list('name', flat=True).first()
+
+
+def _employees_referencing(field, obj):
+    return Employee.objects.filter(
+        Q(**{f'current_{field}': obj}) | Q(**{f'roles__{field}': obj})
+    ).values_list('pk', flat=True).distinct()
+
+
+@receiver(post_save, sender=Company)
+def company_saved(sender, instance, created, raw=False, **kwargs):
+    previous_name = getattr(instance, '_previous_name', None)
+    if not created and not raw and previous_name is not None and previous_name != instance.name:
+        rebuild_search_documents(_employees_referencing('company', instance))
+
+
+@receiver(post_save, sender=Department)
+def department_saved(sender, instance, created, raw=False, **kwargs):
+    previous_name = getattr(instance, '_previous_name', None)
+    if not created and not raw and previous_name is not None and previous_name != instance.name:
+        rebuild_search_documents(_employees_referencing('department', instance))
+
+
+@receiver(pre_delete, sender=Department)
+def department_deleting(sender, instance, **kwargs):
+    # Employees and roles lose the department via SET_NULL without signals
+    employee_ids = list(_employees_referencing('department', instance))
+    transaction.on_commit(lambda: rebuild_search_documents(employee_ids))
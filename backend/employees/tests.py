@@ -1,3 +1,922 @@
-from django.test import TestCase
+from cryptography.fernet import Fernet
+from django.db import IntegrityError, connection
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from unittest import mock, skipUnless
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+import base64
+import csv
+import datetime
+import io
+import json
+import tempfile
+import time
+import uuid
 
-# Create your tests here.
+import pandas as pd
+
+from companies.models import Company, Department
+from companies.tests import create_company
+from users.models import User
+from .eager import eager_load
+from .ingest import EmployeeBulkUploader
+from .filters import Period, ended_by, parse_period, started_from
+from .jobs import claim_next_job, enqueue_upload, heartbeat, process_next_job, requeue_stale_jobs, run_job
+from .models import BulkEditPlan, BulkUploadLog, Employee, EmployeeRole
+from .readers import UnsupportedFileType, iter_upload_chunks
+from .roles import RoleTransition, transition_roles
+from .schema import Column, UploadSchema
+from .serializers import EmployeeSerializer
+
+
+class EmployeeQueryCountTests(TestCase):
+    """Listing endpoints must cost a constant number of queries per page."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='admin@example.com', password='pw', role='talent_verify')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.company = create_company()
+        self.department = Department.objects.create(company=self.company, name='Engineering')
+
+    def create_employees(self, count):
+        for i in range(count):
+            employee = Employee.objects.create(
+                name=f'Employee {i}', employee_id=f'E{i}', current_company=self.company,
+                current_department=self.department, current_role='Engineer',
+                date_joined=datetime.date(2020, 1, 1)
+            )
+            for year in (2020, 2021):
+                EmployeeRole.objects.create(
+                    employee=employee, company=self.company, department=self.department,
+                    title=f'Engineer {year}', start_date=datetime.date(year, 1, 1), duties=''
+                )
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_eager_load_follows_serializer_sources(self):
+        queryset = eager_load(Employee.objects.all(), EmployeeSerializer)
+        self.assertEqual(
+            set(queryset.query.select_related),
+            {'current_company', 'current_department'}
+        )
+        self.assertEqual([p.prefetch_to for p in queryset._prefetch_related_lookups], ['roles'])
+        # Only the company name is rendered, so its encrypted columns are not loaded
+        deferred, _ = queryset.query.deferred_loading
+        self.assertIn('current_company__contact_phone', deferred)
+
+    def test_search_query_count_is_constant_per_page(self):
+        self.create_employees(2)
+        small_page = self.count_queries('/api/employees/search/?name=Employee')
+        self.create_employees(8)
+        large_page = self.count_queries('/api/employees/search/?name=Employee')
+        self.assertEqual(small_page, large_page)
+        # COUNT, employees with their company/department, roles with theirs
+        self.assertEqual(large_page, 3)
+
+    def test_list_query_count_is_constant_per_page(self):
+        self.create_employees(2)
+        small_page = self.count_queries('/api/employees/')
+        self.create_employees(8)
+        self.assertEqual(small_page, self.count_queries('/api/employees/'))
+
+    def upload(self, count, start=0):
+        df = pd.DataFrame({
+            'name': [f'Employee {i}' for i in range(start, start + count)],
+            'employee_id': [f'E{i}' for i in range(start, start + count)],
+            'role': 'Engineer',
+            'department': ['Engineering', 'Sales'] * (count // 2),
+            'date_started': '2021-01-01',
+            'date_left': None,
+            'duties': '',
+        })
+        uploader = EmployeeBulkUploader(self.company)
+        with CaptureQueriesContext(connection) as context:
+            uploader.process(df)
+        self.assertEqual((uploader.created, uploader.errors), (count, 0))
+        return len(context.captured_queries)
+
+    def test_upload_query_count_is_constant(self):
+        # Creating a department costs the same few queries however many rows use it
+        Department.objects.create(company=self.company, name='Sales')
+        few = self.upload(4)
+        self.assertEqual(few, self.upload(40, start=4))
+        self.assertEqual(Employee.objects.count(), 44)
+        self.assertEqual(EmployeeRole.objects.count(), 44)
+
+
+class EmployeeSearchTests(TestCase):
+    """Search endpoints query the full-text search documents."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='admin@example.com', password='pw', role='talent_verify')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.acme = self.create_company('Acme Corporation', 'REG1')
+        self.globex = self.create_company('Globex', 'REG2')
+        engineering = Department.objects.create(company=self.acme, name='Engineering')
+        sales = Department.objects.create(company=self.globex, name='Sales')
+
+        self.jane = Employee.objects.create(
+            name='Jane Doe', employee_id='E1', current_company=self.globex,
+            current_department=sales, current_role='Account Manager',
+            date_joined=datetime.date(2020, 1, 1)
+        )
+        EmployeeRole.objects.create(
+            employee=self.jane, company=self.acme, department=engineering, title='Software Engineer',
+            start_date=datetime.date(2015, 1, 1), end_date=datetime.date(2019, 12, 31),
+            duties='', is_current=False
+        )
+        EmployeeRole.objects.create(
+            employee=self.jane, company=self.globex, department=sales, title='Account Manager',
+            start_date=datetime.date(2020, 1, 1), duties=''
+        )
+        self.john = Employee.objects.create(
+            name='John Engineer Smith', employee_id='E2', current_company=self.acme,
+            current_department=engineering, current_role='Engineer',
+            date_joined=datetime.date(2018, 1, 1)
+        )
+
+    def create_company(self, name, registration_number):
+        return create_company(
+            name=name, registration_number=registration_number, registration_date=datetime.date(2000, 1, 1),
+            email_address=f'{registration_number.lower()}@example.com'
+        )
+
+    def names(self, response):
+        self.assertEqual(response.status_code, 200)
+        return [employee['name'] for employee in response.data['results']]
+
+    def test_document_covers_past_roles(self):
+        document = self.jane.search_document
+        document.refresh_from_db()
+        self.assertIn('Acme Corporation', document.company)
+        self.assertIn('Software Engineer', document.role)
+        self.assertIn('Engineering', document.department)
+        self.assertEqual(
+            (document.current_company, document.current_department, document.current_role),
+            ('Globex', 'Sales', 'Account Manager')
+        )
+
+    def test_query_matches_word_prefixes_across_history(self):
+        response = self.client.get('/api/employees/search/', {'query': 'acme'})
+        self.assertEqual(set(self.names(response)), {'Jane Doe', 'John Engineer Smith'})
+        response = self.client.get('/api/employees/search/', {'query': 'softw eng'})
+        self.assertEqual(self.names(response), ['Jane Doe'])
+
+    def test_query_matches_exact_employee_id(self):
+        response = self.client.get('/api/employees/search/', {'query': 'E2'})
+        self.assertEqual(self.names(response), ['John Engineer Smith'])
+
+    def test_field_filters_apply_to_current_role(self):
+        response = self.client.get('/api/employees/search/', {'company': 'acme'})
+        self.assertEqual(self.names(response), ['John Engineer Smith'])
+
+    def test_field_filters_use_the_index_only(self):
+        response = self.client.get('/api/employees/search/', {'role': 'software'})
+        self.assertEqual(self.names(response), [])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/employees/search/', {'role': 'account', 'department': 'sal'})
+        self.assertEqual(self.names(response), ['Jane Doe'])
+        self.assertFalse([query['sql'] for query in queries if 'LIKE' in query['sql']])
+
+    def test_results_are_ranked(self):
+        # "engineer" is in John's name, which is weighted highest
+        response = self.client.get('/api/employees/search/', {'query': 'engineer'})
+        self.assertEqual(self.names(response), ['John Engineer Smith', 'Jane Doe'])
+
+    def test_advanced_search_matches_past_roles(self):
+        response = self.client.post('/api/employees/advanced_search/', {'company': 'acme', 'role': 'software'}, format='json')
+        self.assertEqual(self.names(response), ['Jane Doe'])
+
+    def test_punctuation_only_matches_nothing(self):
+        response = self.client.get('/api/employees/search/', {'name': '!!'})
+        self.assertEqual(self.names(response), [])
+
+    def test_renaming_company_updates_documents(self):
+        self.globex.name = 'Initech'
+        self.globex.save()
+        response = self.client.get('/api/employees/search/', {'query': 'initech'})
+        self.assertEqual(self.names(response), ['Jane Doe'])
+
+    def test_deleting_role_updates_document(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.jane.roles.filter(title='Software Engineer').delete()
+        response = self.client.post('/api/employees/advanced_search/', {'role': 'software'}, format='json')
+        self.assertEqual(self.names(response), [])
+
+
+class EmployeePaginationTests(TestCase):
+    """Listings support uncounted pages and keyset (cursor) pagination."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='admin@example.com', password='pw', role='talent_verify')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        company = create_company()
+        # Duplicate names make sure ties are broken by id
+        for i in range(7):
+            Employee.objects.create(
+                name=f'Employee {i // 2}', current_company=company, current_role='Engineer',
+                date_joined=datetime.date(2020, 1, 1)
+            )
+        self.expected = list(Employee.objects.order_by('name', 'id').values_list('id', flat=True))
+
+    def ids(self, response):
+        self.assertEqual(response.status_code, 200)
+        return [employee['id'] for employee in response.data['results']]
+
+    def test_cursor_pages_walk_forward_and_back(self):
+        url = '/api/employees/?cursor=&page_size=3'
+        seen = []
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertIsNone(response.data['count'])
+            pages.append(response)
+            seen.extend(self.ids(response))
+            url = response.data['next']
+        self.assertEqual(seen, [str(pk) for pk in self.expected])
+
+        previous = self.client.get(pages[-1].data['previous'])
+        self.assertEqual(self.ids(previous), self.ids(pages[-2]))
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/employees/?cursor=nonsense')
+        self.assertEqual(response.status_code, 404)
+
+    def test_cursor_values_must_fit_their_fields(self):
+        for position in (['Employee 1', 'not-a-uuid'], ['Employee 1', None], [['Employee 1'], {}]):
+            cursor = base64.urlsafe_b64encode(json.dumps({'r': False, 'p': position}).encode()).decode()
+            response = self.client.get(f'/api/employees/?cursor={cursor}')
+            self.assertEqual(response.status_code, 404, position)
+            self.assertEqual(response.data['detail'], 'Invalid cursor')
+
+    def test_page_without_count(self):
+        response = self.client.get('/api/employees/?count=false&page_size=5')
+        self.assertIsNone(response.data['count'])
+        self.assertIsNotNone(response.data['next'])
+        response = self.client.get(response.data['next'])
+        self.assertEqual(len(self.ids(response)), 2)
+        self.assertIsNone(response.data['next'])
+        self.assertIsNotNone(response.data['previous'])
+
+    def test_page_with_count(self):
+        response = self.client.get('/api/employees/?page_size=5')
+        self.assertEqual(response.data['count'], 7)
+
+
+class UploadSchemaTests(SimpleTestCase):
+    """Upload chunks are validated and coerced column-wise."""
+
+    schema = UploadSchema(
+        Column('name', required=True),
+        Column('date_started', 'date', required=True),
+        Column('headcount', 'int'),
+        Column('is_active', 'bool'),
+        Column('duties'),
+    )
+
+    def test_clean_rows_are_typed(self):
+        df = pd.DataFrame({
+            'name': ['  Ann ', 'Bob'],
+            'date_started': ['2021-01-02', '2022-03-04 00:00:00'],
+            'headcount': ['12', '3.0'],
+            'is_active': ['Yes', 'false'],
+        })
+        clean, errors = self.schema.validate(df)
+        self.assertTrue(errors.empty)
+        self.assertEqual(list(clean.itertuples()), [
+            (1, 'Ann', datetime.date(2021, 1, 2), 12, True, None),
+            (2, 'Bob', datetime.date(2022, 3, 4), 3, False, None),
+        ])
+
+    def test_invalid_rows_are_reported_with_row_numbers(self):
+        df = pd.DataFrame({
+            'name': ['Ann', ' ', 'Cy', 'Di', 'Ed'],
+            'date_started': ['2021-01-02', '2021-01-02', 'soon', '2021-01-02', '2021-01-02'],
+            'headcount': ['1', '2', '3', '2.5', '4'],
+            'is_active': ['y', 'n', 'y', 'y', 'maybe'],
+        })
+        clean, errors = self.schema.validate(df)
+        self.assertEqual(list(clean.index), [1])
+        self.assertEqual(errors.to_dict('records'), [
+            {'row': 2, 'code': 'missing_value', 'message': "Missing value for 'name'"},
+            {'row': 3, 'code': 'invalid_value', 'message': "Invalid 'date_started' value 'soon'"},
+            {'row': 4, 'code': 'invalid_value', 'message': "Invalid 'headcount' value '2.5'"},
+            {'row': 5, 'code': 'invalid_value', 'message': "Invalid 'is_active' value 'maybe'"},
+        ])
+        self.assertEqual(self.schema.missing_columns(df.drop(columns='name')), ['name'])
+
+
+class UploadReaderTests(SimpleTestCase):
+    """Every format is read in chunks whose index is the row number within the file, less one."""
+
+    def read(self, content, file_name, chunksize=2):
+        return list(iter_upload_chunks(io.BytesIO(content), file_name, chunksize=chunksize))
+
+    def xlsx(self, rows):
+        from openpyxl import Workbook
+
+        workbook = Workbook()
+        for row in rows:
+            workbook.active.append(row)
+        file = io.BytesIO()
+        workbook.save(file)
+        return file.getvalue()
+
+    def test_csv_chunks_keep_a_running_index(self):
+        content = b"employee_id,name\n007,A\nE2,B\nE3,C\nE4,D\nE5,E\n"
+        chunks = self.read(content, 'employees.csv')
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+        self.assertEqual([list(chunk.index) for chunk in chunks], [[0, 1], [2, 3], [4]])
+        # Values are read as text, so leading zeros survive
+        self.assertEqual(chunks[0].loc[0, 'employee_id'], '007')
+
+    def test_blank_rows_are_skipped_but_counted(self):
+        csv_chunks = self.read(b"employee_id,name\nE1,A\n\n,\nE4,D\nE5,E\n", 'employees.csv')
+        xlsx_chunks = self.read(
+            self.xlsx([['employee_id', 'name'], ['E1', 'A'], [None, None], [None, None], ['E4', 'D'], ['E5', 'E']]),
+            'employees.xlsx',
+        )
+        for chunks in (csv_chunks, xlsx_chunks):
+            rows = pd.concat(chunks)
+            self.assertEqual(list(rows.index), [0, 3, 4])
+            self.assertEqual(list(rows['employee_id']), ['E1', 'E4', 'E5'])
+
+    def test_txt_separator_is_sniffed(self):
+        tabs = self.read(b"employee_id\tname\nE1\tA, Jr\n", 'employees.txt')
+        commas = self.read(b"employee_id,name\nE1,A\n", 'employees.txt')
+        self.assertEqual(tabs[0].to_dict('records'), [{'employee_id': 'E1', 'name': 'A, Jr'}])
+        self.assertEqual(commas[0].to_dict('records'), [{'employee_id': 'E1', 'name': 'A'}])
+
+    def test_xlsx_is_streamed_in_chunks(self):
+        rows = [['employee_id', 'name', None]] + [[f'E{i}', f'Name {i}'] for i in range(5)]
+        chunks = self.read(self.xlsx(rows), 'employees.xlsx')
+        self.assertEqual([list(chunk.index) for chunk in chunks], [[0, 1], [2, 3], [4]])
+        self.assertEqual(list(chunks[0].columns), ['employee_id', 'name', 'Unnamed: 2'])
+        self.assertEqual(chunks[2].loc[4, 'name'], 'Name 4')
+        self.assertEqual(self.read(self.xlsx([]), 'employees.xlsx'), [])
+
+    def test_unsupported_extension(self):
+        with self.assertRaises(UnsupportedFileType):
+            iter_upload_chunks(io.BytesIO(b''), 'employees.pdf')
+
+
+@override_settings(BULK_UPLOADS_ASYNC=False, MEDIA_ROOT=tempfile.mkdtemp())
+class BulkEditPlanTests(TestCase):
+    """bulk_edit dry runs store a plan that is applied later without the file."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='admin@example.com', password='pw', role='talent_verify')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.company = create_company()
+        self.employee = Employee.objects.create(
+            name='Jo', employee_id='E1', current_company=self.company,
+            current_role='Developer', date_joined=datetime.date(2020, 1, 1)
+        )
+        EmployeeRole.objects.create(
+            employee=self.employee, company=self.company, title='Developer',
+            start_date=datetime.date(2020, 1, 1), duties=''
+        )
+
+    def edit(self, url, content):
+        file = SimpleUploadedFile('edit.csv', content)
+        return self.client.post(f'{url}?dry_run=1', {'file': file}, format='multipart')
+
+    def test_dry_run_plans_without_writing_and_applies_later(self):
+        response = self.edit(
+            '/api/employees/bulk_edit/',
+            b"employee_id,role,department,start_date\nE1,Lead,Platform,2024-02-01\nE404,Lead,,\n",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['dry_run'])
+        self.assertEqual(response.data['errors'], 1)
+        self.assertEqual(response.data['summary'], {
+            'create_department': 1, 'update.current_department': 1,
+            'end_role': 1, 'start_role': 1, 'update.current_role': 1,
+        })
+        self.employee.refresh_from_db()
+        self.assertEqual(self.employee.current_role, 'Developer')
+        self.assertFalse(Department.objects.exists())
+
+        plan_id = response.data['plan_id']
+        changes = self.client.get(f'/api/employees/plans/{plan_id}/changes/', {'page_size': 2})
+        self.assertEqual(changes.data['count'], 5)
+        self.assertEqual(changes.data['results'][0]['new_value'], 'Platform')
+
+        response = self.client.post(f'/api/employees/plans/{plan_id}/apply/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['plan']['status'], BulkEditPlan.STATUS_APPLIED)
+        self.employee.refresh_from_db()
+        self.assertEqual(self.employee.current_role, 'Lead')
+        self.assertEqual(self.employee.current_department.name, 'Platform')
+        current = self.employee.roles.get(is_current=True)
+        self.assertEqual((current.title, current.start_date), ('Lead', datetime.date(2024, 2, 1)))
+        self.assertEqual(self.employee.roles.count(), 2)
+
+        response = self.client.post(f'/api/employees/plans/{plan_id}/apply/')
+        self.assertEqual(response.status_code, 400)
+
+    def test_multi_chunk_dry_run_plans_on_earlier_chunks(self):
+        with self.settings(BULK_UPLOAD_CHUNK_SIZE=1):
+            response = self.edit(
+                '/api/employees/bulk_edit/',
+                b"employee_id,name,role,department\nE1,Joe,Lead,Platform\nE1,Joey,Lead,platform\n",
+            )
+            self.assertEqual(response.data['summary'], {
+                'update.name': 2, 'create_department': 1, 'update.current_department': 1,
+                'end_role': 1, 'start_role': 1, 'update.current_role': 1,
+            })
+            response = self.client.post(f"/api/employees/plans/{response.data['plan_id']}/apply/")
+        self.assertEqual(response.status_code, 200)
+        self.employee.refresh_from_db()
+        self.assertEqual((self.employee.name, self.employee.current_role), ('Joey', 'Lead'))
+        self.assertEqual(self.employee.current_department.name, 'Platform')
+
+    def test_plan_is_stale_when_rows_changed_since(self):
+        response = self.edit('/api/companies/bulk_edit/', b"registration_number,contact_phone\nREG1,999\n")
+        self.assertEqual(response.data['summary'], {'update.contact_phone': 1})
+        Company.objects.filter(pk=self.company.pk).update(contact_phone='555')
+
+        response = self.client.post(f"/api/employees/plans/{response.data['plan_id']}/apply/")
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['status'], BulkEditPlan.STATUS_STALE)
+        self.company.refresh_from_db()
+        self.assertEqual(self.company.contact_phone, '555')
+
+
+@override_settings(BULK_UPLOADS_ASYNC=False, MEDIA_ROOT=tempfile.mkdtemp())
+class UploadDedupeTests(TestCase):
+    """Uploading the same file again must not duplicate employee history."""
+
+    csv = (
+        b"name,employee_id,role,date_started\n"
+        b"Jo,E1,Developer,2021-01-01\n"
+        b"Jo,E1,Lead,2022-01-01\n"
+    )
+
+    def setUp(self):
+        self.company = create_company()
+        self.user = User.objects.create_user(
+            email='hr@acme.example.com', password='pw', role='company_user', company=self.company
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, query=''):
+        file = SimpleUploadedFile('employees.csv', self.csv)
+        return self.client.post(f'/api/employees/bulk_upload/{query}', {'file': file}, format='multipart')
+
+    def test_identical_upload_returns_the_earlier_one(self):
+        first = self.upload()
+        self.assertEqual(first.data['created'], 1)
+        again = self.upload()
+        self.assertTrue(again.data['duplicate'])
+        self.assertEqual(BulkUploadLog.objects.count(), 1)
+        self.assertEqual(again.data['upload_id'], BulkUploadLog.objects.get().pk)
+        self.assertEqual(len(BulkUploadLog.objects.get().content_hash), 64)
+
+    def test_forced_reupload_skips_existing_roles(self):
+        self.upload()
+        response = self.upload('?force=1')
+        self.assertEqual(BulkUploadLog.objects.count(), 2)
+        self.assertEqual((response.data['created'], response.data['updated']), (0, 0))
+        self.assertEqual(response.data['skipped_duplicates'], 2)
+        employee = Employee.objects.get()
+        self.assertEqual(employee.roles.count(), 2)
+        self.assertEqual(employee.current_role, 'Lead')
+
+
+@override_settings(BULK_UPLOADS_ASYNC=True, MEDIA_ROOT=tempfile.mkdtemp())
+class UploadJobTests(TestCase):
+    """Uploads are queued, claimed by one worker each and retried when a worker dies."""
+
+    def setUp(self):
+        self.company = create_company()
+        self.user = User.objects.create_user(
+            email='hr@acme.example.com', password='pw', role='company_user', company=self.company
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def enqueue(self, name='employees.csv', employee_id='E1'):
+        content = f"name,employee_id,role,date_started\nJo,{employee_id},Developer,2021-01-01\n".encode()
+        return enqueue_upload(self.user, SimpleUploadedFile(name, content), 'employee')
+
+    def test_async_upload_is_accepted_and_polled(self):
+        file = SimpleUploadedFile('employees.csv', b"name,employee_id,role,date_started\nJo,E1,Developer,2021-01-01\n")
+        response = self.client.post('/api/employees/bulk_upload/', {'file': file}, format='multipart')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], BulkUploadLog.STATUS_QUEUED)
+        self.assertFalse(Employee.objects.exists())
+
+        status_url = response.data['status_url']
+        self.assertEqual(self.client.get(status_url).data['status'], BulkUploadLog.STATUS_QUEUED)
+
+        self.assertTrue(process_next_job('worker-1'))
+        self.assertFalse(process_next_job('worker-1'))
+        polled = self.client.get(status_url).data
+        self.assertEqual(polled['status'], BulkUploadLog.STATUS_COMPLETED)
+        self.assertEqual((polled['attempts'], polled['records_created']), (1, 1))
+        self.assertEqual(Employee.objects.get().name, 'Jo')
+
+        # Other users do not see the upload
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user(email='other@example.com', password='pw', role='company_user'))
+        self.assertEqual(other.get(status_url).status_code, 404)
+
+    def test_claim_next_job_claims_the_oldest_job_once(self):
+        first, second = self.enqueue(), self.enqueue('other.csv', 'E2')
+        BulkUploadLog.objects.filter(pk=first.pk).update(created_at=second.created_at - datetime.timedelta(seconds=1))
+
+        claimed = claim_next_job('worker-1')
+        self.assertEqual(claimed.pk, first.pk)
+        self.assertEqual((claimed.status, claimed.worker, claimed.attempts), (BulkUploadLog.STATUS_PROCESSING, 'worker-1', 1))
+        self.assertIsNotNone(claimed.heartbeat_at)
+        self.assertEqual(claim_next_job('worker-2').pk, second.pk)
+        self.assertIsNone(claim_next_job('worker-3'))
+
+    @override_settings(BULK_UPLOAD_STALE_AFTER=60, BULK_UPLOAD_MAX_ATTEMPTS=2)
+    def test_stale_jobs_are_retried_until_attempts_run_out(self):
+        upload_log = self.enqueue()
+        long_ago = timezone.now() - datetime.timedelta(minutes=5)
+
+        # The first worker dies: the job goes back on the queue and is retried
+        claim_next_job('worker-1')
+        self.assertEqual(requeue_stale_jobs(), 0)
+        BulkUploadLog.objects.filter(pk=upload_log.pk).update(heartbeat_at=long_ago)
+        self.assertEqual(requeue_stale_jobs(), 1)
+        upload_log.refresh_from_db()
+        self.assertEqual((upload_log.status, upload_log.worker), (BulkUploadLog.STATUS_QUEUED, ''))
+        self.assertEqual(claim_next_job('worker-2').attempts, 2)
+
+        # So does the second, and the job has used up its attempts
+        BulkUploadLog.objects.filter(pk=upload_log.pk).update(heartbeat_at=long_ago)
+        self.assertEqual(requeue_stale_jobs(), 0)
+        upload_log.refresh_from_db()
+        self.assertEqual(upload_log.status, BulkUploadLog.STATUS_FAILED)
+        self.assertEqual(upload_log.error_details, 'Worker stopped responding')
+        self.assertIsNone(claim_next_job('worker-3'))
+
+    def test_retried_job_completes(self):
+        upload_log = self.enqueue()
+        claim_next_job('worker-1')
+        BulkUploadLog.objects.filter(pk=upload_log.pk).update(heartbeat_at=timezone.now() - datetime.timedelta(days=1))
+        requeue_stale_jobs()
+
+        self.assertTrue(process_next_job('worker-2'))
+        upload_log.refresh_from_db()
+        self.assertEqual((upload_log.status, upload_log.attempts), (BulkUploadLog.STATUS_COMPLETED, 2))
+        self.assertFalse(upload_log.upload)
+        self.assertEqual(Employee.objects.count(), 1)
+
+    def test_interrupted_job_keeps_its_upload(self):
+        upload_log = self.enqueue()
+        with mock.patch('employees.ingest.process_employee_upload', side_effect=SystemExit):
+            with self.assertRaises(SystemExit):
+                process_next_job('worker-1')
+        upload_log.refresh_from_db()
+        self.assertEqual(upload_log.status, BulkUploadLog.STATUS_PROCESSING)
+        self.assertTrue(upload_log.upload)
+
+        BulkUploadLog.objects.filter(pk=upload_log.pk).update(heartbeat_at=timezone.now() - datetime.timedelta(days=1))
+        requeue_stale_jobs()
+        self.assertTrue(process_next_job('worker-2'))
+        upload_log.refresh_from_db()
+        self.assertEqual(upload_log.status, BulkUploadLog.STATUS_COMPLETED)
+        self.assertFalse(upload_log.upload)
+
+    def test_requeued_job_is_not_finished_by_its_first_worker(self):
+        upload_log = self.enqueue()
+        lost = claim_next_job('worker-1')
+        BulkUploadLog.objects.filter(pk=upload_log.pk).update(heartbeat_at=timezone.now() - datetime.timedelta(days=1))
+        requeue_stale_jobs()
+        claim_next_job('worker-2')
+
+        with self.assertLogs('employees.models', 'WARNING'):
+            run_job(lost)
+        upload_log.refresh_from_db()
+        self.assertEqual((upload_log.status, upload_log.worker), (BulkUploadLog.STATUS_PROCESSING, 'worker-2'))
+        self.assertTrue(upload_log.upload)
+
+
+@override_settings(BULK_UPLOADS_ASYNC=True, MEDIA_ROOT=tempfile.mkdtemp())
+class UploadHeartbeatTests(TransactionTestCase):
+    """A running job keeps its heartbeat fresh between progress reports."""
+
+    def test_heartbeat_runs_while_the_job_does(self):
+        user = User.objects.create_user(email='hr@acme.example.com', password='pw', role='talent_verify')
+        enqueue_upload(user, SimpleUploadedFile('employees.csv', b"name\n"), 'employee')
+        upload_log = claim_next_job('worker-1')
+        claimed_at = upload_log.heartbeat_at
+
+        with heartbeat(upload_log, interval=0.05):
+            time.sleep(0.3)
+            beat_at = BulkUploadLog.objects.get(pk=upload_log.pk).heartbeat_at
+        self.assertGreater(beat_at, claimed_at)
+
+        # Stops beating once another worker holds the job
+        BulkUploadLog.objects.filter(pk=upload_log.pk).update(worker='worker-2', heartbeat_at=claimed_at)
+        with heartbeat(upload_log, interval=0.05):
+            time.sleep(0.2)
+        self.assertEqual(BulkUploadLog.objects.get(pk=upload_log.pk).heartbeat_at, claimed_at)
+
+
+@override_settings(BULK_UPLOADS_ASYNC=False, MEDIA_ROOT=tempfile.mkdtemp(), BULK_UPLOAD_ERROR_SUMMARY_SIZE=2)
+class UploadErrorReportTests(TestCase):
+    """Upload errors are stored row by row and only summarized inline."""
+
+    def setUp(self):
+        self.company = create_company()
+        self.user = User.objects.create_user(
+            email='hr@acme.example.com', password='pw', role='company_user', company=self.company
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_errors_are_capped_inline_and_listed_in_full(self):
+        csv = b"name,role,date_started\n" + b"".join(
+            f"Person {i},Engineer,not a date\n".encode() for i in range(5)
+        ) + b",Engineer,2021-01-01\n"
+        file = SimpleUploadedFile('employees.csv', csv)
+        response = self.client.post('/api/employees/bulk_upload/', {'file': file}, format='multipart')
+
+        self.assertEqual(response.data['errors'], 6)
+        self.assertEqual(len(response.data['error_details']), 2)
+        self.assertEqual(response.data['error_summary'], {
+            'total': 6, 'by_code': {'invalid_value': 5, 'missing_value': 1}, 'truncated': True,
+        })
+        upload_log = BulkUploadLog.objects.get()
+        self.assertTrue(upload_log.error_details.endswith('... and 4 more'))
+
+        page = self.client.get(f'/api/employees/uploads/{upload_log.pk}/errors/', {'page_size': 4})
+        self.assertEqual(page.data['count'], 6)
+        self.assertEqual(page.data['results'][0], {
+            'row': 1, 'code': 'invalid_value', 'message': "Error in row 1: Invalid 'date_started' value 'not a date'",
+        })
+
+        response = self.client.get(f'/api/employees/uploads/{upload_log.pk}/errors/csv/')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'row,code,message')
+        self.assertEqual(len(lines), 7)
+        self.assertTrue(lines[-1].startswith("6,missing_value,"))
+
+
+class ExportTests(TestCase):
+    """Exports stream every matching row, decrypted, within the user's scope."""
+
+    def setUp(self):
+        self.company = create_company()
+        other = create_company(
+            name='Globex', registration_number='REG2', address='2 Main St', contact_person='Bob',
+            contact_phone='456', email_address='globex@example.com'
+        )
+        for i, company in enumerate([self.company, self.company, other]):
+            Employee.objects.create(
+                name=f'Employee {i}', employee_id=f'E{i}', current_company=company,
+                current_role='Engineer' if i else 'Manager', date_joined=datetime.date(2020, 1, 1)
+            )
+        self.client = APIClient()
+        self.client.force_authenticate(
+            User.objects.create_user(email='user@acme.com', password='pw', role='company_user', company=self.company)
+        )
+
+    def read_csv(self, response):
+        self.assertEqual(response.status_code, 200)
+        return list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+
+    def test_undecryptable_values_export_empty(self):
+        with override_settings(FERNET_KEYS=[Fernet.generate_key().decode()]):
+            Employee.objects.filter(name='Employee 1').update(employee_id='x')
+        with self.assertLogs('companies.encryption', 'WARNING'):
+            rows = self.read_csv(self.client.get('/api/employees/export/'))
+        self.assertEqual(
+            [(row['name'], row['employee_id']) for row in rows], [('Employee 0', 'E0'), ('Employee 1', '')]
+        )
+
+    def test_employee_csv_uses_search_filters_and_company_scope(self):
+        with self.settings(BULK_UPLOAD_CHUNK_SIZE=1):
+            rows = self.read_csv(self.client.get('/api/employees/export/'))
+        self.assertEqual([(row['name'], row['employee_id']) for row in rows], [('Employee 0', 'E0'), ('Employee 1', 'E1')])
+
+        rows = self.read_csv(self.client.get('/api/employees/export/?role=engineer'))
+        self.assertEqual([row['name'] for row in rows], ['Employee 1'])
+
+    def test_xlsx_export(self):
+        from openpyxl import load_workbook
+
+        response = self.client.get('/api/companies/export/?file_format=xlsx')
+        self.assertEqual(response.status_code, 200)
+        sheet = load_workbook(io.BytesIO(b''.join(response.streaming_content)), read_only=True).active
+        rows = list(sheet.iter_rows(values_only=True))
+        self.assertEqual(rows[0][:3], ('id', 'name', 'registration_number'))
+        self.assertEqual([row[1:3] for row in rows[1:]], [('Acme', 'REG1')])
+        self.assertEqual(self.client.get('/api/employees/export/?file_format=pdf').status_code, 400)
+
+
+class RoleTransitionTests(TestCase):
+    """Role changes in bulk use a fixed number of statements; single saves stay correct."""
+
+    def setUp(self):
+        self.company = create_company()
+        self.department = Department.objects.create(company=self.company, name='Engineering')
+
+    def create_employees(self, count):
+        employees = []
+        for i in range(count):
+            employee = Employee.objects.create(
+                name=f'Employee {i}', employee_id=f'E{i}', current_company=self.company,
+                current_role='Engineer', date_joined=datetime.date(2020, 1, 1)
+            )
+            EmployeeRole.objects.create(
+                employee=employee, company=self.company, title='Engineer',
+                start_date=datetime.date(2020, 1, 1), duties=''
+            )
+            employees.append(employee)
+        return employees
+
+    def new_role(self, title, start_date):
+        return EmployeeRole(
+            company=self.company, department=self.department, title=title, start_date=start_date, duties=''
+        )
+
+    def transition(self, employees):
+        transitions = []
+        for i, employee in enumerate(employees):
+            effective_date = datetime.date(2024, 1, 1 + i)
+            transitions.append(RoleTransition(employee, self.new_role('Lead', effective_date), effective_date))
+            transitions.append(RoleTransition(employee, self.new_role('Manager', datetime.date(2024, 6, 1)), datetime.date(2024, 6, 1)))
+        with CaptureQueriesContext(connection) as context:
+            transition_roles(transitions)
+        return len(context.captured_queries)
+
+    def test_statement_count_does_not_grow_with_batch(self):
+        self.assertEqual(self.transition(self.create_employees(2)), self.transition(self.create_employees(6)))
+
+        employee = Employee.objects.by_employee_id('E5').get()
+        self.assertEqual((employee.current_role, employee.current_department), ('Manager', self.department))
+        self.assertEqual(
+            list(employee.roles.order_by('start_date').values_list('title', 'is_current', 'end_date')),
+            [
+                ('Engineer', False, datetime.date(2024, 1, 6)),
+                ('Lead', False, datetime.date(2024, 6, 1)),
+                ('Manager', True, None),
+            ]
+        )
+
+    def test_single_save_only_updates_current_role_columns(self):
+        employee = self.create_employees(1)[0]
+        stored = Employee.objects.filter(pk=employee.pk).values_list('employee_id', flat=True).get().ciphertext
+        role = self.new_role('Lead', datetime.date(2024, 1, 1))
+        role.employee = employee
+        role.save()
+
+        employee.refresh_from_db()
+        self.assertEqual(employee.current_role, 'Lead')
+        self.assertEqual(employee.roles.filter(is_current=True).get(), role)
+        self.assertEqual(Employee.objects.filter(pk=employee.pk).values_list('employee_id', flat=True).get().ciphertext, stored)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Query plans are checked against SQLite')
+class AccessPathIndexTests(TestCase):
+    """The hot search and ingest queries are answered from their indexes rather than by scanning."""
+
+    def test_query_plans_use_indexes(self):
+        company, employee = uuid.uuid4(), uuid.uuid4()
+        expected = [
+            (Employee.objects.filter(current_company_id=company, name__in=['Ann']), 'employee_company_name_idx'),
+            (Employee.objects.filter(current_company_id=company).order_by('name', 'id'), 'employee_company_name_idx'),
+            (Employee.objects.filter(current_company_id=company, is_active=True), 'employee_company_active_idx'),
+            (Employee.objects.filter(date_joined__gte=datetime.date(2020, 1, 1)), 'employee_date_joined_idx'),
+            (Employee.objects.filter(date_left__lte=datetime.date(2020, 1, 1)), 'employee_date_left_idx'),
+            (EmployeeRole.objects.filter(employee_id=employee, is_current=True).order_by(), 'employeerole_current_idx'),
+            (EmployeeRole.objects.filter(employee_id=employee), 'employeerole_history_idx'),
+        ]
+        for queryset, index in expected:
+            plan = queryset.explain()
+            self.assertIn(f'USING INDEX {index}', plan)
+            self.assertNotIn('USE TEMP B-TREE', plan)
+
+    def test_department_names_are_unique_per_company(self):
+        company = create_company()
+        Department.objects.create(company=company, name='Sales')
+        self.assertIn('USING INDEX', Department.objects.filter(company=company, name__in=['Sales']).explain())
+        with self.assertRaises(IntegrityError):
+            Department.objects.create(company=company, name='Sales')
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Query plans are checked against SQLite')
+class AccessPathMigrationBenchmark(TransactionTestCase):
+    """
+    Query plans of the hot access paths before and after the migrations that
+    index them (employees 0009, companies 0005).
+    """
+
+    before = [('employees', '0008_upload_errors'), ('companies', '0004_company_stats')]
+    after = [('employees', '0009_access_path_indexes'), ('companies', '0005_department_unique_name')]
+    # (query, parameters, part of the plan before, part of the plan after)
+    paths = [
+        ('SELECT id FROM employees_employee WHERE current_company_id = %s AND name IN (%s)', ['c', 'Ann'],
+         '(current_company_id=?)', 'employee_company_name_idx (current_company_id=? AND name=?)'),
+        ('SELECT id FROM employees_employee WHERE current_company_id = %s ORDER BY name, id', ['c'],
+         'USE TEMP B-TREE FOR ORDER BY', 'employee_company_name_idx (current_company_id=?)'),
+        ('SELECT id FROM employees_employee WHERE current_company_id = %s AND is_active = %s', ['c', True],
+         '(current_company_id=?)', 'employee_company_active_idx (current_company_id=? AND is_active=?)'),
+        ('SELECT id FROM employees_employee WHERE date_joined >= %s', ['2020-01-01'],
+         'SCAN employees_employee', 'employee_date_joined_idx'),
+        ('SELECT id FROM employees_employee WHERE date_left <= %s', ['2020-01-01'],
+         'SCAN employees_employee', 'employee_date_left_idx'),
+        ('SELECT id FROM employees_employeerole WHERE employee_id = %s AND is_current', ['e'],
+         'employees_employeerole_employee_id', 'employeerole_current_idx'),
+        ('SELECT id FROM employees_employeerole WHERE employee_id = %s ORDER BY start_date DESC', ['e'],
+         'USE TEMP B-TREE FOR ORDER BY', 'employeerole_history_idx'),
+        ('SELECT id FROM companies_department WHERE company_id = %s AND name IN (%s)', ['c', 'Sales'],
+         '(company_id=?)', '(company_id=? AND name=?)'),
+    ]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets)
+
+    def plans(self, targets):
+        self.migrate(targets)
+        plans = []
+        with connection.cursor() as cursor:
+            for query, params, _, _ in self.paths:
+                cursor.execute(f'EXPLAIN QUERY PLAN {query}', params)
+                plans.append(' / '.join(row[-1] for row in cursor.fetchall()))
+        return plans
+
+    def test_indexes_turn_scans_into_searches(self):
+        self.addCleanup(lambda: self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes()))
+        before, after = self.plans(self.before), self.plans(self.after)
+        for (query, _, scanned, searched), old, new in zip(self.paths, before, after):
+            with self.subTest(query=query):
+                # Before: a full scan, a sort, or a search on the foreign key alone
+                self.assertIn(scanned, old)
+                self.assertTrue(old.startswith('SCAN') or 'USE TEMP B-TREE' in old or searched not in old, old)
+                self.assertTrue(new.startswith('SEARCH'), new)
+                self.assertIn(searched, new)
+                self.assertNotIn('USE TEMP B-TREE', new)
+
+
+class DateFilterTests(TestCase):
+    """Date parameters become half-open ranges on the bare, indexed columns."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='admin@example.com', password='pw', role='talent_verify')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        company = create_company()
+        for name, joined, left in [
+            ('Ann', datetime.date(2019, 12, 31), datetime.date(2020, 2, 29)),
+            ('Bob', datetime.date(2020, 3, 1), None),
+            ('Cat', datetime.date(2020, 3, 31), datetime.date(2021, 1, 1)),
+        ]:
+            employee = Employee.objects.create(
+                name=name, current_company=company, current_role='Engineer', date_joined=joined, date_left=left,
+                is_active=left is None
+            )
+            EmployeeRole.objects.create(
+                employee=employee, company=company, title='Engineer', start_date=joined, end_date=left,
+                is_current=left is None, duties=''
+            )
+
+    def names(self, response):
+        self.assertEqual(response.status_code, 200)
+        return sorted(employee['name'] for employee in response.data['results'])
+
+    def test_parse_period(self):
+        self.assertEqual(parse_period('2020'), Period(datetime.date(2020, 1, 1), datetime.date(2021, 1, 1)))
+        self.assertEqual(parse_period('2020-12'), Period(datetime.date(2020, 12, 1), datetime.date(2021, 1, 1)))
+        self.assertEqual(parse_period('2020-02-29'), Period(datetime.date(2020, 2, 29), datetime.date(2020, 3, 1)))
+        for value in ['', 'soon', '2020-13', '2021-02-29']:
+            self.assertIsNone(parse_period(value))
+
+    def test_search_and_advanced_search_use_periods(self):
+        self.assertEqual(self.names(self.client.get('/api/employees/search/?start_year=2020')), ['Bob', 'Cat'])
+        self.assertEqual(self.names(self.client.get('/api/employees/search/?start_year=2020-03-31')), ['Cat'])
+        self.assertEqual(self.names(self.client.get('/api/employees/search/?end_year=2020-02')), ['Ann', 'Bob'])
+        self.assertEqual(self.names(self.client.get('/api/employees/search/?end_year=2020')), ['Ann', 'Bob'])
+        self.assertEqual(self.names(self.client.get('/api/employees/search/?end_year=bad')), ['Ann', 'Bob', 'Cat'])
+        response = self.client.post('/api/employees/advanced_search/', {'start_date': '2020-03', 'end_date': '2021'}, format='json')
+        self.assertEqual(self.names(response), ['Cat'])
+
+    @skipUnless(connection.vendor == 'sqlite', 'Query plans are checked against SQLite')
+    def test_ranges_use_date_indexes(self):
+        period = parse_period('2020-03')
+        queryset = Employee.objects.filter(started_from(period, history=True)).filter(ended_by(period, history=True))
+        self.assertNotIn('django_date_extract', str(queryset.query))
+        plan = queryset.explain()
+        for index in ['employee_date_joined_idx', 'employeerole_start_date_idx', 'employeerole_end_date_idx']:
+            self.assertIn(f'USING INDEX {index}', plan)
+        self.assertNotIn('SCAN employees_employeerole', plan)
@@ -1,9 +1,12 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import EmployeeViewSet
+from .views import EmployeeViewSet, BulkUploadLogViewSet, BulkEditPlanViewSet
 
 
 router = DefaultRouter()
+# Registered before the employee routes so 'uploads/' and 'plans/' are not taken as employee ids
+router.register(r'uploads', BulkUploadLogViewSet, basename='bulk-upload')
+router.register(r'plans', BulkEditPlanViewSet, basename='bulk-edit-plan')
 router.register(r'', EmployeeViewSet)
 
 urlpatterns = [
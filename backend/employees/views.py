@@ -2,28 +2,53 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
-from django.db import transaction
-from django.db.models import Q
-from django.utils import timezone
-from django.utils.dateparse import parse_date
-import pandas as pd
+from django.db.models import F, Q
 import logging
-import io
 
-from .models import Employee, EmployeeRole, BulkUploadLog
-from .serializers import EmployeeSerializer, EmployeeRoleSerializer
+from .models import Employee, EmployeeRole, BulkUploadLog, BulkEditPlan
+from .serializers import (
+    EmployeeSerializer, EmployeeRoleSerializer, BulkUploadLogSerializer, BulkUploadErrorSerializer,
+    BulkEditPlanSerializer, BulkEditChangeSerializer,
+)
+from .mixins import BulkUploadJobMixin
+from .eager import eager_load
+from .exports import UnsupportedExportFormat, export_response
+from .filters import ended_by, parse_period, started_from
+from .plans import PlanConflict, apply_plan
+from .search import search_condition, search_rank
+from users.models import User
 from users.permissions import IsCompanyUserOrTalentVerify, IsCompanyUserForEmployee
+from users.services import set_password_token
 from rest_framework.permissions import IsAuthenticated
-from companies.models import Company, Department
+from companies.encryption import blind_index
 
 logger = logging.getLogger(__name__)
 
-class EmployeeViewSet(viewsets.ModelViewSet):
+
+# Columns of employee exports as (header, lookup) pairs
+EMPLOYEE_EXPORT_COLUMNS = (
+    ('id', 'id'),
+    ('name', 'name'),
+    ('employee_id', 'employee_id'),
+    ('company_id', 'current_company_id'),
+    ('company', 'current_company__name'),
+    ('department', 'current_department__name'),
+    ('role', 'current_role'),
+    ('date_joined', 'date_joined'),
+    ('date_left', 'date_left'),
+    ('is_active', 'is_active'),
+    ('updated_at', 'updated_at'),
+)
+
+
+class EmployeeViewSet(BulkUploadJobMixin, viewsets.ModelViewSet):
     """API endpoint for employees."""
     
     queryset = Employee.objects.all()
     serializer_class = EmployeeSerializer
     permission_classes = [IsCompanyUserOrTalentVerify]
+    # Keyset used by ?cursor= pagination (see backend.pagination)
+    cursor_ordering = ('name', 'id')
 
     def get_permissions(self):
         """Get appropriate permissions for different actions."""
@@ -42,7 +67,10 @@ class EmployeeViewSet(viewsets.ModelViewSet):
         """Filter employees based on user's company if they are a company user."""
         queryset = Employee.objects.all()
         if self.request.user.role == 'company_user':
-            queryset = queryset.filter(current_company=self.request.user.company)
+            queryset = queryset.filter(current_company_id=self.request.user.company_id)
+        if self.action not in ['history', 'add_role', 'export']:
+            # Load everything the serializer renders up front (avoids N+1 queries per page)
+            queryset = eager_load(queryset, self.get_serializer_class())
         return queryset
     
     @action(detail=False, methods=['get'])
@@ -56,59 +84,15 @@ class EmployeeViewSet(viewsets.ModelViewSet):
         - role: Filter by job title/position
         - department: Filter by department name
         - start_year: Filter by year started (employees who joined on or after this year)
-        - end_year: Filter by year left (employees who left on or before this year)
-        - query: General search across name, company, role, department, and employee_id
+        - end_year: Filter by year left (employees who left on or before this year, or have not left)
+        - query: General search across name, employee_id and current or past company, role and department
+        
+        start_year and end_year also take a month (YYYY-MM) or a date (YYYY-MM-DD).
+        Text filters match the start of words (``eng`` finds "Engineering") and
+        results are ordered by relevance.
         """
         # Get base queryset (already filtered by user's company if applicable)
-        queryset = self.get_queryset()
-        
-        # Get search parameters
-        query = request.query_params.get('query', '')
-        name = request.query_params.get('name', '')
-        company = request.query_params.get('company', '')
-        role = request.query_params.get('role', '')
-        department = request.query_params.get('department', '')
-        start_year = request.query_params.get('start_year', '')
-        end_year = request.query_params.get('end_year', '')
-        
-        # Apply filters based on parameters
-        if query:
-            queryset = queryset.filter(
-                Q(name__icontains=query) |
-                Q(employee_id__icontains=query) |
-                Q(current_company__name__icontains=query) |
-                Q(current_department__name__icontains=query) |
-                Q(current_role__icontains=query)
-            )
-        
-        if name:
-            queryset = queryset.filter(name__icontains=name)
-        
-        if company:
-            queryset = queryset.filter(current_company__name__icontains=company)
-        
-        if department:
-            queryset = queryset.filter(current_department__name__icontains=department)
-        
-        if role:
-            queryset = queryset.filter(current_role__icontains=role)
-        
-        if start_year:
-            try:
-                start_year_int = int(start_year)
-                queryset = queryset.filter(date_joined__year__gte=start_year_int)
-            except ValueError:
-                pass
-        
-        if end_year:
-            try:
-                end_year_int = int(end_year)
-                queryset = queryset.filter(
-                    Q(date_left__year__lte=end_year_int) |
-                    Q(date_left__isnull=True)
-                )
-            except ValueError:
-                pass
+        queryset = self.filter_search(self.get_queryset(), request.query_params)
         
         # Use the viewset's serializer to maintain consistency
         page = self.paginate_queryset(queryset)
@@ -122,6 +106,70 @@ class EmployeeViewSet(viewsets.ModelViewSet):
             'count': queryset.count()
         })
     
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        Export employees as a CSV file, or XLSX with ?file_format=xlsx.
+        
+        Takes the same query parameters as search, and company users only
+        export their own company's employees. One row per employee with its
+        current role; the rows are streamed, so any number can be exported.
+        """
+        queryset = self.filter_search(self.get_queryset(), request.query_params)
+        if not queryset.ordered:
+            queryset = queryset.order_by(*self.cursor_ordering)
+        try:
+            return export_response(
+                queryset, EMPLOYEE_EXPORT_COLUMNS, 'employees', request.query_params.get('file_format', 'csv')
+            )
+        except UnsupportedExportFormat as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    def filter_search(self, queryset, params):
+        """Apply the search query parameters (see search) to ``queryset``."""
+        query = params.get('query', '')
+        name = params.get('name', '')
+        company = params.get('company', '')
+        role = params.get('role', '')
+        department = params.get('department', '')
+        start_year = params.get('start_year', '')
+        end_year = params.get('end_year', '')
+        
+        # Text filters go through the full-text search index
+        criteria = []
+        if query:
+            queryset = queryset.filter(
+                search_condition((None, query)) |
+                Q(employee_id_index=blind_index(query))
+            )
+            criteria.append((None, query))
+        
+        # These filters apply to the current role only, which the index keeps apart
+        field_criteria = [
+            (field, value) for field, value in
+            [('name', name), ('current_company', company), ('current_department', department), ('current_role', role)]
+            if value
+        ]
+        if field_criteria:
+            queryset = queryset.filter(search_condition(*field_criteria))
+            criteria.extend(field_criteria)
+        
+        if criteria:
+            queryset = queryset.annotate(search_rank=search_rank(*criteria)).order_by(
+                F('search_rank').desc(nulls_last=True), 'name'
+            )
+        
+        # Dates are compared as ranges on the bare columns so their indexes apply
+        start_period = parse_period(start_year)
+        if start_period:
+            queryset = queryset.filter(started_from(start_period))
+        
+        end_period = parse_period(end_year)
+        if end_period:
+            queryset = queryset.filter(ended_by(end_period) | Q(date_left__isnull=True))
+        
+        return queryset
+    
     @action(detail=False, methods=['post'])
     def advanced_search(self, request):
         """
@@ -132,8 +180,8 @@ class EmployeeViewSet(viewsets.ModelViewSet):
         - company: Filter by current or past company
         - role: Filter by current or past job title/position
         - department: Filter by current or past department
-        - start_date: Filter by start date (YYYY-MM-DD format)
-        - end_date: Filter by end date (YYYY-MM-DD format)
+        - start_date: Filter by start date (YYYY-MM-DD format, or YYYY-MM or YYYY for a whole month or year)
+        - end_date: Filter by end date (YYYY-MM-DD format, or YYYY-MM or YYYY for a whole month or year)
         - active: Filter by active status (true/false)
         """
         # Get base queryset (already filtered by user's company if applicable)
@@ -142,43 +190,24 @@ class EmployeeViewSet(viewsets.ModelViewSet):
         # Get search parameters from request body
         params = request.data
         
-        # Apply filters based on parameters
-        if 'name' in params and params['name']:
-            queryset = queryset.filter(name__icontains=params['name'])
-        
-        if 'company' in params and params['company']:
-            queryset = queryset.filter(
-                Q(current_company__name__icontains=params['company']) |
-                Q(roles__company__name__icontains=params['company'])
-            ).distinct()
-        
-        if 'department' in params and params['department']:
-            queryset = queryset.filter(
-                Q(current_department__name__icontains=params['department']) |
-                Q(roles__department__name__icontains=params['department'])
-            ).distinct()
-        
-        if 'role' in params and params['role']:
-            queryset = queryset.filter(
-                Q(current_role__icontains=params['role']) |
-                Q(roles__title__icontains=params['role'])
-            ).distinct()
-        
-        if 'start_date' in params and params['start_date']:
-            start_date = parse_date(params['start_date'])
-            if start_date:
-                queryset = queryset.filter(
-                    Q(date_joined__gte=start_date) |
-                    Q(roles__start_date__gte=start_date)
-                ).distinct()
-        
-        if 'end_date' in params and params['end_date']:
-            end_date = parse_date(params['end_date'])
-            if end_date:
-                queryset = queryset.filter(
-                    Q(date_left__lte=end_date) |
-                    Q(roles__end_date__lte=end_date)
-                ).distinct()
+        # Text filters go through the full-text search index, which covers current and past roles
+        criteria = [
+            (field, params[field]) for field in ['name', 'company', 'department', 'role']
+            if field in params and params[field]
+        ]
+        if criteria:
+            queryset = queryset.filter(search_condition(*criteria)).annotate(
+                search_rank=search_rank(*criteria)
+            ).order_by(F('search_rank').desc(nulls_last=True), 'name')
+        
+        # Current or past roles are matched with a subquery, so no distinct() is needed
+        start_period = parse_period(params.get('start_date'))
+        if start_period:
+            queryset = queryset.filter(started_from(start_period, history=True))
+        
+        end_period = parse_period(params.get('end_date'))
+        if end_period:
+            queryset = queryset.filter(ended_by(end_period, history=True))
         
         if 'active' in params:
             is_active = params['active']
@@ -202,7 +231,7 @@ class EmployeeViewSet(viewsets.ModelViewSet):
     def history(self, request, pk=None):
         """Get employee role history."""
         employee = self.get_object()
-        roles = EmployeeRole.objects.filter(employee=employee).order_by('-start_date')
+        roles = eager_load(EmployeeRole.objects.filter(employee=employee), EmployeeRoleSerializer).order_by('-start_date')
         serializer = EmployeeRoleSerializer(roles, many=True)
         return Response(serializer.data)
     
@@ -220,6 +249,12 @@ class EmployeeViewSet(viewsets.ModelViewSet):
         
         serializer = EmployeeRoleSerializer(data=request.data)
         if serializer.is_valid():
+            data = serializer.validated_data
+            if employee.roles.filter(company=data['company'], title=data['title'], start_date=data['start_date']).exists():
+                return Response(
+                    {'error': 'This role is already recorded for this employee.'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
             serializer.save(employee=employee)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -240,156 +275,7 @@ class EmployeeViewSet(viewsets.ModelViewSet):
         - date_left: End date in the format YYYY-MM-DD (if not provided, employee is considered current)
         - duties: Job duties or description
         """
-        if 'file' not in request.FILES:
-            return Response({'error': 'No file provided'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        file = request.FILES['file']
-        
-        # Log the upload
-        upload_log = BulkUploadLog.objects.create(
-            user=request.user,
-            file_name=file.name,
-            file_size=file.size,
-            upload_type='employee'
-        )
-        
-        try:
-            # Determine file type and read
-            if file.name.endswith('.csv'):
-                df = pd.read_csv(file)
-            elif file.name.endswith(('.xls', '.xlsx')):
-                df = pd.read_excel(file)
-            elif file.name.endswith('.txt'):
-                # Try both tab and comma as separators
-                try:
-                    df = pd.read_csv(file, sep='\t')
-                except:
-                    df = pd.read_csv(file)
-            else:
-                upload_log.mark_failed('Unsupported file type')
-                return Response(
-                    {'error': 'Unsupported file type. Please upload CSV, Excel, or TXT file.'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            
-            # Validate required columns
-            required_columns = ['name', 'role', 'date_started']
-            missing_columns = [col for col in required_columns if col not in df.columns]
-            if missing_columns:
-                error_msg = f"Missing required columns: {', '.join(missing_columns)}"
-                upload_log.mark_failed(error_msg)
-                return Response({'error': error_msg}, status=status.HTTP_400_BAD_REQUEST)
-            
-            # Process data
-            employees_created = 0
-            employees_updated = 0
-            errors = 0
-            error_details = []
-            
-            # Get user's company if they are a company user
-            user_company = None
-            if request.user.role == 'company_user':
-                user_company = request.user.company
-            
-            for index, row in df.iterrows():
-                try:
-                    with transaction.atomic():
-                        # Determine which company to use
-                        company = user_company
-                        
-                        # Company is required
-                        if not company:
-                            raise Exception("Company user is required for bulk upload")
-                        
-                        # Get or create department if specified
-                        department = None
-                        department_name = row.get('department', '').strip() if pd.notna(row.get('department', '')) else None
-                        if department_name:
-                            department, _ = Department.objects.get_or_create(
-                                company=company,
-                                name=department_name
-                            )
-                        
-                        # Try to find existing employee by ID or name and company
-                        employee = None
-                        employee_id = str(row.get('employee_id', '')).strip() if pd.notna(row.get('employee_id', '')) else None
-                        
-                        if employee_id:
-                            try:
-                                employee = Employee.objects.get(employee_id=employee_id, current_company=company)
-                                employees_updated += 1
-                            except Employee.DoesNotExist:
-                                pass
-                        
-                        if not employee and row['name']:
-                            try:
-                                employee = Employee.objects.get(name=row['name'], current_company=company)
-                                employees_updated += 1
-                            except Employee.DoesNotExist:
-                                # Create new employee
-                                employee = Employee.objects.create(
-                                    name=row['name'],
-                                    employee_id=employee_id,
-                                    current_company=company,
-                                    current_department=department,
-                                    current_role=row['role'],
-                                    date_joined=pd.to_datetime(row['date_started']).date()
-                                )
-                                employees_created += 1
-                        
-                        # If we found or created an employee, update their role history
-                        if employee:
-                            # Update employee fields if necessary
-                            if pd.notna(row.get('date_left', '')):
-                                employee.date_left = pd.to_datetime(row['date_left']).date()
-                                employee.is_active = False
-                            
-                            # Add role to employee history
-                            role = EmployeeRole.objects.create(
-                                employee=employee,
-                                company=company,
-                                department=department,
-                                title=row['role'],
-                                start_date=pd.to_datetime(row['date_started']).date(),
-                                end_date=pd.to_datetime(row['date_left']).date() if pd.notna(row.get('date_left', '')) else None,
-                                duties=row.get('duties', '') if pd.notna(row.get('duties', '')) else '',
-                                is_current=not pd.notna(row.get('date_left', ''))
-                            )
-                            
-                            # Save employee for any field updates
-                            employee.save()
-                        
-                except Exception as e:
-                    errors += 1
-                    error_details.append(f"Error in row {index+1}: {str(e)}")
-                    logger.error(f"Error processing employee row {index+1}: {str(e)}")
-            
-            # Update log with results
-            upload_log.mark_completed(
-                records_processed=len(df),
-                records_created=employees_created,
-                records_updated=employees_updated,
-                errors=errors,
-                error_details='\n'.join(error_details) if error_details else None
-            )
-            
-            return Response({
-                'success': True,
-                'processed': len(df),
-                'created': employees_created,
-                'updated': employees_updated,
-                'errors': errors,
-                'details': 'File processed successfully',
-                'error_details': error_details
-            })
-            
-        except Exception as e:
-            upload_log.mark_failed(str(e))
-            logger.error(f"Bulk employee upload failed: {str(e)}")
-            return Response(
-                {'error': f'Failed to process file: {str(e)}'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        return self.submit_upload(request, 'employee')
     
     @action(detail=False, methods=['post'], parser_classes=[MultiPartParser, FormParser])
     def bulk_edit(self, request):
@@ -405,199 +291,119 @@ class EmployeeViewSet(viewsets.ModelViewSet):
         - department: Updated department name
         - date_left: End date if employee is leaving
         - is_active: Boolean indicating if employee is active
-        """
-        if 'file' not in request.FILES:
-            return Response({'error': 'No file provided'}, status=status.HTTP_400_BAD_REQUEST)
         
-        file = request.FILES['file']
-        
-        # Log the upload
-        upload_log = BulkUploadLog.objects.create(
-            user=request.user,
-            file_name=file.name,
-            file_size=file.size,
-            upload_type='employee_edit'
+        With ?dry_run=1 nothing is changed: the changes are stored as a plan
+        that can be reviewed and applied under /api/employees/plans/.
+        """
+        return self.submit_upload(request, 'employee_edit', allow_dry_run=True)
+
+
+class BulkUploadLogViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    API endpoint for polling bulk upload jobs.
+    
+    Users see their own uploads; Talent Verify sees all of them.
+    """
+    
+    queryset = BulkUploadLog.objects.all()
+    serializer_class = BulkUploadLogSerializer
+    permission_classes = [IsAuthenticated]
+    
+    def get_queryset(self):
+        queryset = BulkUploadLog.objects.select_related('user').order_by('-created_at')
+        if self.request.user.role != 'talent_verify':
+            queryset = queryset.filter(user=self.request.user)
+        return queryset
+    
+    @action(detail=True, methods=['get'])
+    def errors(self, request, pk=None):
+        """Every error and warning of the upload in file order, paginated."""
+        upload_log = self.get_object()
+        page = self.paginate_queryset(upload_log.error_records.order_by('id'))
+        return self.get_paginated_response(BulkUploadErrorSerializer(page, many=True).data)
+    
+    @action(detail=True, methods=['get'], url_path='errors/csv')
+    def errors_csv(self, request, pk=None):
+        """Every error and warning of the upload as a streamed CSV file."""
+        upload_log = self.get_object()
+        return export_response(
+            upload_log.error_records.order_by('id'),
+            [('row', 'row'), ('code', 'code'), ('message', 'message')],
+            f'upload-{upload_log.pk}-errors',
         )
-        
-        try:
-            # Read the file based on its type
-            if file.name.endswith('.csv'):
-                content = file.read().decode('utf-8-sig')  # Handle BOM if present
-                df = pd.read_csv(io.StringIO(content))
-            elif file.name.endswith(('.xls', '.xlsx')):
-                df = pd.read_excel(file)
-            elif file.name.endswith('.txt'):
-                content = file.read().decode('utf-8-sig')
-                try:
-                    df = pd.read_csv(io.StringIO(content), sep='\t')  # Try tab-separated
-                except:
-                    df = pd.read_csv(io.StringIO(content))  # Fall back to comma-separated
-            else:
-                upload_log.mark_failed('Unsupported file type')
-                return Response(
-                    {'error': 'Unsupported file type. Please upload CSV, Excel, or TXT file.'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            
-            # Validate required columns
-            if 'employee_id' not in df.columns:
-                error_msg = "Missing required column: employee_id"
-                upload_log.mark_failed(error_msg)
-                return Response({'error': error_msg}, status=status.HTTP_400_BAD_REQUEST)
-            
-            # Process data
-            employees_updated = 0
-            roles_added = 0
-            errors = 0
-            error_details = []
-            
-            # Get user's company if they are a company user
-            user_company = None
-            if request.user.role == 'company_user':
-                user_company = request.user.company
-            
-            # Get all employees for this company
-            if user_company:
-                employees = {str(e.employee_id): e for e in Employee.objects.filter(current_company=user_company)}
-            else:
-                employees = {str(e.employee_id): e for e in Employee.objects.all()}
-            
-            for index, row in df.iterrows():
-                try:
-                    with transaction.atomic():
-                        employee_id = str(row['employee_id']).strip()
-                        
-                        # Look up employee by ID
-                        employee = employees.get(employee_id)
-                        
-                        if not employee:
-                            errors += 1
-                            error_details.append(f"Row {index+1}: Employee with ID '{employee_id}' not found")
-                            continue
-                        
-                        # Check if user has permission for this employee's company
-                        if request.user.role == 'company_user' and request.user.company != employee.current_company:
-                            errors += 1
-                            error_details.append(f"Row {index+1}: You don't have permission to edit employee with ID '{employee_id}'")
-                            continue
-                        
-                        # Update employee fields if present
-                        updated = False
-                        new_role_added = False
-                        
-                        if 'name' in row and pd.notna(row['name']):
-                            employee.name = row['name'].strip()
-                            updated = True
-                        
-                        # Handle department change
-                        department = None
-                        if 'department' in row and pd.notna(row['department']):
-                            department_name = row['department'].strip()
-                            department, _ = Department.objects.get_or_create(
-                                company=employee.current_company,
-                                name=department_name
-                            )
-                            employee.current_department = department
-                            updated = True
-                        
-                        # Handle role change
-                        if 'role' in row and pd.notna(row['role']):
-                            new_role_title = row['role'].strip()
-                            
-                            # Only add a new role if it's different
-                            if new_role_title != employee.current_role:
-                                # First, end the current role
-                                current_roles = EmployeeRole.objects.filter(
-                                    employee=employee, 
-                                    is_current=True
-                                )
-                                
-                                for current_role in current_roles:
-                                    current_role.is_current = False
-                                    current_role.end_date = timezone.now().date()
-                                    current_role.save()
-                                
-                                # Create new role
-                                start_date = pd.to_datetime(row['start_date']).date() if 'start_date' in row and pd.notna(row['start_date']) else timezone.now().date()
-                                
-                                new_role = EmployeeRole.objects.create(
-                                    employee=employee,
-                                    company=employee.current_company,
-                                    department=department or employee.current_department,
-                                    title=new_role_title,
-                                    start_date=start_date,
-                                    end_date=None,
-                                    duties=row.get('duties', '') if pd.notna(row.get('duties', '')) else '',
-                                    is_current=True
-                                )
-                                
-                                employee.current_role = new_role_title
-                                updated = True
-                                new_role_added = True
-                                roles_added += 1
-                        
-                        # Handle employee departure
-                        if 'date_left' in row and pd.notna(row['date_left']):
-                            date_left = pd.to_datetime(row['date_left']).date()
-                            employee.date_left = date_left
-                            employee.is_active = False
-                            
-                            # Update current role end date if we haven't already added a new role
-                            if not new_role_added:
-                                current_roles = EmployeeRole.objects.filter(
-                                    employee=employee, 
-                                    is_current=True
-                                )
-                                
-                                for current_role in current_roles:
-                                    current_role.is_current = False
-                                    current_role.end_date = date_left
-                                    current_role.save()
-                            
-                            updated = True
-                        
-                        # Handle is_active flag
-                        if 'is_active' in row:
-                            is_active = pd.notna(row['is_active']) and (
-                                row['is_active'] == True or 
-                                str(row['is_active']).lower() == 'true' or 
-                                str(row['is_active']) == '1'
-                            )
-                            employee.is_active = is_active
-                            updated = True
-                        
-                        if updated:
-                            employee.save()
-                            employees_updated += 1
-                        
-                except Exception as e:
-                    errors += 1
-                    error_details.append(f"Error in row {index+1}: {str(e)}")
-                    logger.error(f"Error processing employee row {index+1}: {str(e)}")
-            
-            # Update log with results
-            upload_log.mark_completed(
-                records_processed=len(df),
-                records_created=0,
-                records_updated=employees_updated,
-                errors=errors,
-                error_details='\n'.join(error_details) if error_details else None
+
+    @action(detail=True, methods=['post'])
+    def password_setup(self, request, pk=None):
+        """
+        Issue set-password tokens for the accounts a company upload created
+        without a password and whose password has not been set yet.
+
+        Only the user who made the upload may ask. Tokens are not stored, so
+        this is how uploads that ran in the background hand them out; they stop
+        working once the password has been set.
+        """
+        upload_log = self.get_object()
+        if upload_log.user_id != request.user.pk:
+            return Response(
+                {'error': 'Only the user who made the upload can issue its set-password tokens.'},
+                status=status.HTTP_403_FORBIDDEN
             )
-            
-            return Response({
-                'success': True,
-                'processed': len(df),
-                'updated': employees_updated,
-                'roles_added': roles_added,
-                'errors': errors,
-                'details': 'File processed successfully',
-                'error_details': error_details
-            })
-            
-        except Exception as e:
-            upload_log.mark_failed(str(e))
-            logger.error(f"Bulk employee edit failed: {str(e)}")
+        emails = [setup['email'] for setup in (upload_log.result or {}).get('password_setup') or []]
+        password_setup = []
+        for user in User.objects.filter(email__in=emails).order_by('email'):
+            if not user.has_usable_password():
+                uid, token = set_password_token(user)
+                password_setup.append({'email': user.email, 'uid': uid, 'token': token})
+        return Response({'password_setup': password_setup})
+
+
+
+class BulkEditPlanViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    API endpoint for reviewing and applying ``bulk_edit`` dry runs.
+    
+    Users see their own plans; Talent Verify sees all of them.
+    """
+    
+    queryset = BulkEditPlan.objects.all()
+    serializer_class = BulkEditPlanSerializer
+    permission_classes = [IsAuthenticated]
+    
+    def get_queryset(self):
+        queryset = BulkEditPlan.objects.select_related('upload_log').order_by('-created_at')
+        if self.request.user.role != 'talent_verify':
+            queryset = queryset.filter(user=self.request.user)
+        return queryset
+    
+    @action(detail=True, methods=['get'])
+    def changes(self, request, pk=None):
+        """Planned changes in file order, paginated."""
+        plan = self.get_object()
+        page = self.paginate_queryset(plan.changes.order_by('id'))
+        return self.get_paginated_response(BulkEditChangeSerializer(page, many=True).data)
+    
+    @action(detail=True, methods=['post'])
+    def apply(self, request, pk=None):
+        """Apply every change of a pending plan in one transaction."""
+        plan = self.get_object()
+        if plan.upload_log.status != BulkUploadLog.STATUS_COMPLETED or plan.status != BulkEditPlan.STATUS_PENDING:
             return Response(
-                {'error': f'Failed to process file: {str(e)}'},
+                {'error': f"Only pending plans of completed uploads can be applied (plan is {plan.status})"},
                 status=status.HTTP_400_BAD_REQUEST
-            )
\ No newline at end of file
+            )
+        try:
+            editor = apply_plan(plan)
+        except PlanConflict as e:
+            return Response(
+                {
+                    'error': f"{f'Row {e.row}: ' if e.row else ''}{e}. Upload the file again to make a new plan.",
+                    'status': plan.status,
+                },
+                status=status.HTTP_409_CONFLICT
+            )
+        return Response({
+            'success': True,
+            'plan': BulkEditPlanSerializer(plan).data,
+            'updated': editor.updated,
+            'summary': editor.summary,
+        })
@@ -0,0 +1,99 @@
+"""
+JWT authentication that does not load the user row on every request.
+
+Tokens carry the user's ``role`` and ``company_id`` as claims next to
+``user_id``. ``CachedJWTAuthentication`` checks them against a cached copy of
+the user's state (``USER_STATE_CACHE_TIMEOUT`` seconds, dropped whenever the
+user is saved or deleted) and returns a ``User`` holding only those fields, so
+authorizing a request usually costs no query. Other fields load on first use,
+like a queryset's ``only()``.
+
+A token whose claims no longer match the user, e.g. after a role change, is
+rejected; refreshing it issues an access token with the current claims.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .models import User
+
+# User fields kept in the state cache, besides the primary key
+USER_STATE_FIELDS = ('email', 'role', 'company_id', 'is_active', 'is_staff', 'is_superuser')
+
+
+def _state_cache_key(user_id):
+    return f'users:state:{user_id}'
+
+
+def get_user_state(user_id):
+    """``{field: value}`` of ``id`` and ``USER_STATE_FIELDS`` for a user, or None if it does not exist."""
+    key = _state_cache_key(user_id)
+    state = cache.get(key)
+    if state is None:
+        state = User.objects.filter(pk=user_id).values('id', *USER_STATE_FIELDS).first()
+        if state is None:
+            return None
+        cache.set(key, state, settings.USER_STATE_CACHE_TIMEOUT)
+    return state
+
+
+def invalidate_user_state(user_id):
+    """Drop the cached state of a user, so the next request reads it again."""
+    cache.delete(_state_cache_key(user_id))
+
+
+def user_claims(state):
+    """Token claims for a user, from the user or its state."""
+    get = state.get if isinstance(state, dict) else lambda name: getattr(state, name)
+    company_id = get('company_id')
+    return {'role': get('role'), 'company_id': str(company_id) if company_id else None}
+
+
+class UserRefreshToken(RefreshToken):
+    """Refresh token whose access tokens carry the user's current claims."""
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        for claim, value in user_claims(user).items():
+            token[claim] = value
+        return token
+
+    @property
+    def access_token(self):
+        access = super().access_token
+        state = get_user_state(self[api_settings.USER_ID_CLAIM])
+        if state is not None:
+            for claim, value in user_claims(state).items():
+                access[claim] = value
+        return access
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """``JWTAuthentication`` that authorizes from token claims and cached user state."""
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        state = get_user_state(user_id)
+        if state is None:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+        if not state['is_active']:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+
+        # Tokens issued before the claims existed are authorized from the state alone
+        claims = user_claims(state)
+        if any(validated_token.get(claim, value) != value for claim, value in claims.items()):
+            raise AuthenticationFailed(_('Token is out of date, refresh it'), code='token_stale')
+
+        # from_db() expects the loaded fields in model order
+        fields = [field.attname for field in User._meta.concrete_fields if field.attname in state]
+        return User.from_db(DEFAULT_DB_ALIAS, fields, [state[field] for field in fields])
@@ -35,7 +35,8 @@ class IsCompanyUserForCompany(permissions.BasePermission):
             return True
         
         # Company users can only access their own company
-        return request.user.role == 'company_user' and request.user.company == obj
+        # Compare ids so neither company has to be loaded
+        return request.user.role == 'company_user' and request.user.company_id == obj.pk
 
 
 class IsCompanyUserForEmployee(permissions.BasePermission):
@@ -55,7 +56,7 @@ class IsCompanyUserForEmployee(permissions.BasePermission):
             return True
         
         # Company users can only access employees of their company
-        return request.user.role == 'company_user' and request.user.company == obj.current_company
+        return request.user.role == 'company_user' and request.user.company_id == obj.current_company_id
 
 
 class IsAuthenticatedForSearch(permissions.BasePermission):
@@ -0,0 +1,90 @@
+"""
+Bulk provisioning of user accounts.
+
+Hashing a password with Django's default PBKDF2 settings takes a noticeable
+fraction of a second, so creating thousands of accounts one ``create_user`` at
+a time is dominated by hashing. ``provision_users`` instead:
+
+- hashes the passwords that were supplied across a process pool
+  (``PASSWORD_HASH_WORKERS`` processes),
+- gives accounts without a password an unusable one plus a one-time
+  set-password token (see ``UserViewSet.set_password``),
+- inserts all users with a single ``bulk_create``, company already set.
+"""
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+import django
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.tokens import default_token_generator
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from .models import User
+
+UserAccount = namedtuple('UserAccount', ['email', 'password', 'role', 'company'])
+
+ProvisionedUser = namedtuple('ProvisionedUser', ['user', 'uid', 'token'])
+
+
+def _hash_password(password):
+    if not apps.ready:
+        # Spawned (not forked) worker processes start without Django configured
+        django.setup()
+    return make_password(password)
+
+
+def hash_passwords(passwords, workers=None):
+    """Hash ``passwords`` in parallel, returning the hashes in the same order."""
+    passwords = list(passwords)
+    workers = min(workers or settings.PASSWORD_HASH_WORKERS, len(passwords))
+    # Daemon processes, e.g. multiprocessing workers, cannot start a pool
+    if workers <= 1 or multiprocessing.current_process().daemon:
+        return [make_password(password) for password in passwords]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_hash_password, passwords, chunksize=max(1, len(passwords) // (workers * 4))))
+
+
+def set_password_token(user):
+    """``(uid, token)`` that lets ``user`` choose a password once."""
+    return urlsafe_base64_encode(force_bytes(user.pk)), default_token_generator.make_token(user)
+
+
+def provision_users(accounts, workers=None):
+    """
+    Create a user for each ``UserAccount`` and return a ``ProvisionedUser`` per account.
+
+    Accounts with a password get it hashed; the others get an unusable password
+    and a set-password ``uid``/``token`` (None for accounts with a password).
+    Emails must not exist yet: a clash fails the whole ``bulk_create``.
+    """
+    accounts = list(accounts)
+    with_password = [account for account in accounts if account.password]
+    hashes = dict(zip(
+        (id(account) for account in with_password),
+        hash_passwords([account.password for account in with_password], workers),
+    ))
+
+    users = []
+    for account in accounts:
+        user = User(
+            email=User.objects.normalize_email(account.email),
+            role=account.role,
+            company=account.company,
+        )
+        if account.password:
+            user.password = hashes[id(account)]
+        else:
+            user.set_unusable_password()
+        users.append(user)
+
+    User.objects.bulk_create(users)
+
+    provisioned = []
+    for account, user in zip(accounts, users):
+        uid, token = (None, None) if account.password else set_password_token(user)
+        provisioned.append(ProvisionedUser(user, uid, token))
+    return provisioned
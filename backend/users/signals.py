@@ -0,0 +1,25 @@
+"""
+Drop the cached state ``CachedJWTAuthentication`` authorizes from whenever the
+user changes. ``QuerySet.update()`` bypasses these signals, so callers that
+change users that way must call ``invalidate_user_state`` themselves.
+"""
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from companies.models import Company
+from .authentication import invalidate_user_state
+from .models import User
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    invalidate_user_state(instance.pk)
+
+
+@receiver(pre_delete, sender=Company)
+def company_deleted(sender, instance, **kwargs):
+    # Its users lose their company through an UPDATE, without saving them
+    user_ids = list(instance.users.values_list('pk', flat=True))
+    transaction.on_commit(lambda: [invalidate_user_state(pk) for pk in user_ids])
@@ -1,3 +1,101 @@
-from django.test import TestCase
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from unittest import mock
 
-# Create your tests here.
+from companies.tests import create_company
+from .models import User
+from .services import UserAccount, hash_passwords, provision_users
+
+
+@override_settings(PASSWORD_HASH_WORKERS=2)
+class ProvisionUsersTests(TestCase):
+    """Bulk user provisioning."""
+
+    def setUp(self):
+        self.company = create_company()
+
+    def test_hash_passwords_in_parallel(self):
+        hashes = hash_passwords(['first secret', 'second secret', 'third secret'])
+        user = User(email='a@example.com')
+        for password, hashed in zip(['first secret', 'second secret', 'third secret'], hashes):
+            user.password = hashed
+            self.assertTrue(user.check_password(password))
+
+    def test_hash_passwords_serially_in_daemon_processes(self):
+        daemon = mock.Mock(daemon=True)
+        with mock.patch('users.services.multiprocessing.current_process', return_value=daemon), \
+                mock.patch('users.services.ProcessPoolExecutor', side_effect=AssertionError('pool started')):
+            hashes = hash_passwords(['first secret', 'second secret'])
+        user = User(email='a@example.com', password=hashes[1])
+        self.assertTrue(user.check_password('second secret'))
+
+    def test_provision_users(self):
+        provisioned = provision_users([
+            UserAccount('one@example.com', 'Str0ng-password!', 'company_user', self.company),
+            UserAccount('two@example.com', None, 'company_user', self.company),
+        ])
+        one, two = (User.objects.get(email=email) for email in ['one@example.com', 'two@example.com'])
+        self.assertEqual((one.company, two.company), (self.company, self.company))
+        self.assertTrue(one.check_password('Str0ng-password!'))
+        self.assertFalse(two.has_usable_password())
+        self.assertIsNone(provisioned[0].token)
+
+        # The set-password token works once
+        client = APIClient()
+        data = {'uid': provisioned[1].uid, 'token': provisioned[1].token, 'password': 'An0ther-password!'}
+        response = client.post('/api/users/set_password/', data, format='json')
+        self.assertEqual(response.status_code, 200)
+        two.refresh_from_db()
+        self.assertTrue(two.check_password('An0ther-password!'))
+        response = client.post('/api/users/set_password/', data, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class CachedJWTAuthenticationTests(TestCase):
+    """Authorizing requests from token claims and cached user state."""
+
+    def setUp(self):
+        cache.clear()
+        self.company = create_company()
+        self.user = User.objects.create_user(
+            email='company@example.com', password='Str0ng-password!', role='company_user', company=self.company
+        )
+        self.client = APIClient()
+
+    def login(self):
+        response = self.client.post(
+            '/api/users/token/', {'email': 'company@example.com', 'password': 'Str0ng-password!'}, format='json'
+        )
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        return response.data
+
+    def test_requests_are_authorized_without_queries(self):
+        self.login()
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/users/me/')
+        self.assertEqual(response.data['role'], 'company_user')
+
+        # Company scoping reads company_id without loading the user or its company
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/employees/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([query for query in queries if 'users_user' in query['sql']])
+
+    def test_changed_and_deactivated_users(self):
+        tokens = self.login()
+        self.user.role = 'general_user'
+        self.user.save()
+        response = self.client.get('/api/users/me/')
+        self.assertEqual((response.status_code, response.data['code']), (401, 'token_stale'))
+
+        # Refreshing issues a token with the current claims
+        response = self.client.post('/api/users/token/refresh/', {'refresh': tokens['refresh']}, format='json')
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        self.assertEqual(self.client.get('/api/users/me/').data['role'], 'general_user')
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
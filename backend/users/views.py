@@ -2,11 +2,12 @@ from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
 import logging
 
+from .authentication import UserRefreshToken
 from .models import User
-from .serializers import UserSerializer
+from .serializers import UserSerializer, SetPasswordSerializer
 
 from .permissions import IsTalentVerify
 
@@ -15,6 +16,8 @@ logger = logging.getLogger(__name__)
 # Custom JWT response to include user details
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
     username_field = 'email'
+    # Tokens carry the role and company_id claims CachedJWTAuthentication checks
+    token_class = UserRefreshToken
     
     def validate(self, attrs):
         # Original token validation
@@ -45,9 +48,16 @@ class CustomTokenObtainPairView(TokenObtainPairView):
                 status=status.HTTP_401_UNAUTHORIZED
             )
 
+class CustomTokenRefreshSerializer(TokenRefreshSerializer):
+    # Refreshed access tokens carry the user's current claims
+    token_class = UserRefreshToken
+
+
 class CustomTokenRefreshView(TokenRefreshView):
     """Custom token refresh view with enhanced error handling."""
     
+    serializer_class = CustomTokenRefreshSerializer
+    
     def post(self, request, *args, **kwargs):
         try:
             return super().post(request, *args, **kwargs)
@@ -71,7 +81,7 @@ class UserViewSet(viewsets.ModelViewSet):
         """
         if self.action == 'me':
             permission_classes = [permissions.IsAuthenticated]
-        elif self.action == 'register':
+        elif self.action in ['register', 'set_password']:
             permission_classes = [permissions.AllowAny]
         else:
             permission_classes = [permissions.IsAuthenticated, IsTalentVerify]
@@ -115,6 +125,19 @@ class UserViewSet(viewsets.ModelViewSet):
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
     
+    @action(detail=False, methods=['post'])
+    def set_password(self, request):
+        """
+        Set the password of an account that was created without one.
+        
+        Expects the ``uid`` and one-time ``token`` issued when the account was
+        provisioned, and the new ``password``.
+        """
+        serializer = SetPasswordSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response({'detail': 'Password has been set.'})
+    
     def perform_create(self, serializer):
         """Save the new user instance."""
         serializer.save()
\ No newline at end of file